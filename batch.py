@@ -0,0 +1,162 @@
+"""
+ENVÍO POR LOTES
+Varios archivos o carpetas enteras por una sola conexión, juntando los
+archivos pequeños en escrituras grandes y leyendo el siguiente mientras
+el actual sale por el enlace
+"""
+import os
+import queue
+import threading
+
+import tracing
+import transfer
+from protocol import CoalescingStream, FrameWriter
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+SMALL_FILE_SIZE = 256 * 1024  # Hasta este tamaño se lee el archivo entero por adelantado
+PREFETCH_ITEMS = 16  # Archivos leídos por adelantado como máximo
+COALESCE_SIZE = 256 * 1024  # Bytes acumulados antes de una escritura real
+
+
+def expand_selection(paths):
+    """
+    Convierte archivos y carpetas seleccionados en una lista de (ruta, nombre relativo).
+    Las carpetas conservan su nombre y su estructura interna en el destino.
+    """
+    entries = []
+    for path in paths:
+        path = str(path)
+        if os.path.isdir(path):
+            root_name = os.path.basename(os.path.normpath(path))
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    full_path = os.path.join(dirpath, filename)
+                    relative = os.path.relpath(full_path, path)
+                    name = "/".join([root_name] + relative.split(os.sep))
+                    entries.append((full_path, name))
+        elif os.path.isfile(path):
+            entries.append((path, os.path.basename(path)))
+    return entries
+
+
+def batch_size(entries):
+    """Bytes totales del lote; los archivos ilegibles no cuentan"""
+    total = 0
+    for path, _ in entries:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+class Prefetcher:
+    """Hilo que lee por adelantado los archivos pequeños a una cola acotada"""
+
+    def __init__(self, entries, max_items=PREFETCH_ITEMS, small_file_size=SMALL_FILE_SIZE):
+        self.entries = entries
+        self.small_file_size = small_file_size
+        self._queue = queue.Queue(maxsize=max_items)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for path, name in self.entries:
+            if self._stopped:
+                break
+            try:
+                data = None
+                if os.path.getsize(path) <= self.small_file_size:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                self._queue.put((path, name, data, None))
+            except OSError as e:
+                self._queue.put((path, name, None, e))
+        self._queue.put(None)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        """Detiene la lectura y vacía la cola para desbloquear el hilo"""
+        self._stopped = True
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def send_batch(writer, entries, reader=None, compress=None, tuner=None,
+               on_file=None, on_progress=None, verify=False, hashes=None):
+    """
+    Envía todos los archivos de `entries` por la sesión abierta.
+    on_progress(bytes_enviados, bytes_totales) cuenta el lote completo.
+    Con `hashes` (dedup.HashCache; solo si el receptor anunció "dedup") se
+    ofrecen antes los resúmenes y no se envía lo que el receptor ya tiene;
+    de un archivo modificado se nombra además la versión anterior como base
+    para un envío delta.
+    on_file(ruta, nombre) se llama cuando el archivo ha salido de verdad: los
+    pequeños acumulados, tras el flush que los vacía; si ese flush falla no se
+    anuncian y la excepción llega al llamador.
+    Devuelve la lista de (ruta, error) de los archivos que no se pudieron leer.
+    """
+    tuner = tuner or transfer.SendTuner()
+    batch_writer = FrameWriter(CoalescingStream(writer.stream, COALESCE_SIZE))
+    total = batch_size(entries)
+    done = 0
+    if hashes is not None and reader is not None:
+        entries, present = transfer.offer_batch(writer, reader, entries, hashes)
+        for path, name in present:
+            done += os.path.getsize(path)
+            if on_file:
+                on_file(path, name)
+        if present and on_progress:
+            on_progress(done, total)
+    file_progress = None
+    if on_progress:
+        def file_progress(sent, size):
+            on_progress(done + sent, total)
+
+    prefetcher = Prefetcher(entries)
+    failed = []
+    unflushed = []  # Enviados a CoalescingStream pero aún no vaciados
+    try:
+        with tracing.span("send.batch", files=len(entries), bytes=total):
+            for path, name, data, error in prefetcher:
+                if error:
+                    failed.append((path, error))
+                    continue
+                with tracing.span("send.file", file=name, prefetched=data is not None) as span:
+                    sent = transfer.send_file(batch_writer, path, name=name, tuner=tuner,
+                                              reader=reader, compress=compress, data=data,
+                                              on_progress=file_progress, verify=verify,
+                                              final_flush=data is None,
+                                              basis=hashes.previous(path) if hashes else None)
+                    span.set(bytes=sent, chunk_size=tuner.chunk_size)
+                done += sent
+                unflushed.append((path, name))
+                if data is None:
+                    # send_file ha hecho flush: también salieron los anteriores
+                    _report(unflushed, on_file)
+            batch_writer.flush()
+            _report(unflushed, on_file)
+    finally:
+        prefetcher.close()
+    return failed
+
+
+def _report(entries, on_file):
+    """Anuncia y olvida los archivos cuyas tramas ya se han vaciado"""
+    if on_file:
+        for path, name in entries:
+            on_file(path, name)
+    entries.clear()
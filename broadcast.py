@@ -0,0 +1,315 @@
+"""
+DIFUSIÓN A VARIOS RECEPTORES
+Envía el mismo lote a varios pares a la vez leyendo y codificando cada
+bloque una sola vez. Los bloques codificados van a una caché compartida con
+un cursor por par: cada sesión avanza a su ritmo y un bloque se suelta cuando
+todos lo han enviado. La caché está acotada, así que un par lento frena la
+lectura (y a los demás solo cuando les saca la ventana entera); un par que
+falla suelta su cursor y no afecta al resto. El tiempo total se acerca al del
+enlace más lento, no a la suma de todos.
+"""
+import os
+import threading
+import time
+import traceback
+
+import integrity
+import tracing
+import transfer
+from batch import COALESCE_SIZE, batch_size
+from iocore import IOCore
+from protocol import (
+    FRAME_CODEC, FRAME_DATA, FRAME_END, FRAME_FILE,
+    CoalescingStream, FrameWriter,
+)
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+BLOCK_SIZE = 256 * 1024  # Bytes de archivo por bloque de la caché
+CACHE_BYTES = 16 * 1024 * 1024  # Bytes codificados en la caché como máximo
+
+# Elementos del flujo compartido
+ITEM_FILE = "file"  # (tipo, ruta, nombre, cabecera, códec)
+ITEM_DATA = "data"  # (tipo, carga codificada, bytes del archivo que cubre)
+ITEM_END = "end"  # (tipo, ruta, nombre, resumen)
+ITEM_SKIP = "skip"  # (tipo, ruta, error) archivo ilegible
+
+
+# =============================================================================
+# CODIFICACIÓN (UNA VEZ PARA TODOS)
+# =============================================================================
+def encode_batch(entries, compress=None, block_size=BLOCK_SIZE):
+    """
+    Genera el flujo de elementos del lote: lee cada archivo una vez, calcula
+    su resumen y lo comprime si conviene. Todos los pares empiezan desde cero
+    con las mismas opciones, así que la salida del compresor vale para todos.
+    """
+    for path, name in entries:
+        try:
+            f = open(path, "rb")
+        except OSError as e:
+            yield (ITEM_SKIP, path, e)
+            continue
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            first = f.read(block_size)
+            codec_name, compressor = transfer.choose_compressor(path, first, compress)
+            header = {"name": name, "size": size, "meta": {}}
+            yield (ITEM_FILE, path, name, header, codec_name)
+            digest = integrity.StreamDigest()
+            block = first
+            sent = 0
+            while block:
+                digest.update(block)
+                sent += len(block)
+                payload = compressor.compress(block) if compressor else block
+                if payload:
+                    yield (ITEM_DATA, payload, len(block))
+                block = f.read(block_size)
+            if compressor:
+                tail = compressor.flush()
+                if tail:
+                    yield (ITEM_DATA, tail, 0)
+            trailer = digest.trailer()
+            trailer["size"] = sent
+            yield (ITEM_END, path, name, trailer)
+
+
+# =============================================================================
+# CACHÉ DE BLOQUES
+# =============================================================================
+class BlockCache:
+    """
+    Ventana de elementos codificados compartida por varios lectores. Un hilo
+    productor consume `source` mientras quepa en `max_bytes`; cada lector
+    tiene su cursor y lo ya leído por todos se descarta.
+    """
+
+    def __init__(self, source, max_bytes=CACHE_BYTES):
+        self.source = source
+        self.max_bytes = max_bytes
+        self._items = {}  # índice -> (elemento, bytes)
+        self._cursors = {}
+        self._base = 0  # Índice más antiguo aún retenido
+        self._produced = 0
+        self._bytes = 0
+        self._done = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self.stats = {"items": 0, "bytes": 0, "peak_bytes": 0, "stalls": 0}
+
+    def register(self, reader):
+        """Añade un lector; debe hacerse antes de start()"""
+        with self._cond:
+            self._cursors[reader] = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._produce, name="difusion-lectura",
+                                        daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            for item in self.source:
+                size = len(item[1]) if item[0] == ITEM_DATA else 0
+                with self._cond:
+                    # Contrapresión: espera a que el lector más atrasado libere sitio
+                    if self._full(size):
+                        self.stats["stalls"] += 1
+                    while self._full(size):
+                        self._cond.wait()
+                    if not self._cursors:
+                        break
+                    self._items[self._produced] = (item, size)
+                    self._produced += 1
+                    self._bytes += size
+                    self.stats["items"] += 1
+                    self.stats["bytes"] += size
+                    self.stats["peak_bytes"] = max(self.stats["peak_bytes"], self._bytes)
+                    self._cond.notify_all()
+        except Exception as e:
+            traceback.print_exc()
+            self._error = e
+        finally:
+            close = getattr(self.source, "close", None)
+            if close:
+                close()
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def _full(self, size):
+        # Un elemento mayor que la ventana entra si la caché está vacía
+        return bool(self._cursors) and self._bytes > 0 and self._bytes + size > self.max_bytes
+
+    def read(self, reader):
+        """Siguiente elemento para `reader` (espera si aún no se ha leído); None al final"""
+        with self._cond:
+            index = self._cursors[reader]
+            while index >= self._produced and not self._done:
+                self._cond.wait()
+            if index >= self._produced:
+                if self._error is not None:
+                    raise self._error
+                return None
+            item = self._items[index][0]
+            self._cursors[reader] = index + 1
+            self._trim()
+            return item
+
+    def drop(self, reader):
+        """Retira un lector (terminado o fallido); deja de retener bloques"""
+        with self._cond:
+            if self._cursors.pop(reader, None) is not None:
+                self._trim()
+
+    def _trim(self):
+        oldest = min(self._cursors.values(), default=self._produced)
+        if oldest > self._base:
+            while self._base < oldest:
+                self._bytes -= self._items.pop(self._base)[1]
+                self._base += 1
+            self._cond.notify_all()
+
+
+# =============================================================================
+# DIFUSIÓN
+# =============================================================================
+class Broadcast:
+    """
+    Envía `entries` a todas las `addresses` usando las conexiones persistentes
+    de un ConnectionManager. on_file(mac, ruta, nombre) y
+    on_progress(mac, enviados, total) llegan desde los hilos de cada par;
+    on_file, solo cuando las tramas del archivo ya se han vaciado.
+    run() devuelve por MAC {"error", "files", "bytes", "elapsed"}.
+    """
+
+    def __init__(self, connections, addresses, entries, on_file=None, on_progress=None,
+                 cache_bytes=CACHE_BYTES, core=None):
+        self.connections = connections
+        self.addresses = list(dict.fromkeys(addresses))
+        self.entries = entries
+        self.on_file = on_file
+        self.on_progress = on_progress
+        self.cache_bytes = cache_bytes
+        self.core = core
+        self.cache = None
+        self.failed = []  # (ruta, error) de los archivos ilegibles
+        self.results = {address: {"error": None, "files": 0, "bytes": 0, "elapsed": 0.0}
+                        for address in self.addresses}
+
+    def run(self):
+        """Versión bloqueante; sin `core` usa un IOCore propio con un hilo por par"""
+        core = self.core
+        own_core = core is None
+        if own_core:
+            core = IOCore(max_blocking=len(self.addresses) + 1, name="difusion").start()
+        try:
+            return core.run(self.run_async(core))
+        finally:
+            if own_core:
+                core.stop()
+
+    async def run_async(self, core):
+        """Corrutina de la difusión para quien ya tiene un IOCore en marcha"""
+        total = batch_size(self.entries)
+        tracing.event("broadcast.start", peers=len(self.addresses),
+                      files=len(self.entries), bytes=total)
+        # Fase 1: conexiones en paralelo; un par inalcanzable no detiene a los demás
+        outcomes = await core.scope(
+            [core.blocking(self.connections.connect, address) for address in self.addresses],
+            cancel_on_error=False)
+        connected = []
+        for address, outcome in zip(self.addresses, outcomes):
+            if isinstance(outcome, BaseException):
+                self.results[address]["error"] = str(outcome)
+            else:
+                connected.append(outcome)
+        if not connected:
+            return self.results
+
+        # Todos reciben los mismos bloques: se comprime solo si todos aceptan el mismo códec
+        codecs = {repr(conn.options["compression"]) for conn in connected}
+        compress = connected[0].options["compression"] if len(codecs) == 1 else None
+        self.cache = BlockCache(self._source(compress), self.cache_bytes)
+        for conn in connected:
+            self.cache.register(conn.address)
+        self.cache.start()
+
+        # Fase 2: un envío por par, todos leyendo de la caché
+        await core.scope(
+            [core.blocking(self._send_peer, conn.address, total,
+                           on_cancel=lambda conn=conn: conn.socket.close())
+             for conn in connected],
+            cancel_on_error=False)
+        tracing.event("broadcast.end", **self.cache.stats)
+        return self.results
+
+    def _source(self, compress):
+        for item in encode_batch(self.entries, compress):
+            if item[0] == ITEM_SKIP:
+                self.failed.append((item[1], item[2]))
+            yield item
+
+    def _send_peer(self, address, total):
+        result = self.results[address]
+        start = time.monotonic()
+        try:
+            with tracing.span("broadcast.peer", address=address) as span, \
+                    self.connections.use(address) as conn:
+                self._stream(conn, result, total)
+                span.set(bytes=result["bytes"], files=result["files"])
+        except Exception as e:
+            result["error"] = str(e)
+            traceback.print_exc()
+        finally:
+            result["elapsed"] = time.monotonic() - start
+            self.cache.drop(address)
+
+    def _stream(self, conn, result, total):
+        tuner = conn.tuner
+        writer = FrameWriter(CoalescingStream(conn.writer.stream, COALESCE_SIZE))
+        sent = 0
+        unflushed = []  # (ruta, nombre) terminados pero aún sin vaciar
+        while True:
+            item = self.cache.read(conn.address)
+            if item is None:
+                break
+            kind = item[0]
+            if kind == ITEM_FILE:
+                writer.write_json(FRAME_FILE, item[3])
+                if item[4]:
+                    writer.write_json(FRAME_CODEC, {"codec": item[4]})
+            elif kind == ITEM_DATA:
+                started = time.monotonic()
+                writer.write_frame(FRAME_DATA, item[1])
+                if tuner.should_flush():
+                    writer.flush()
+                    tuner.flushed()
+                    self._report(conn.address, unflushed)
+                tuner.record_write(item[2], time.monotonic() - started)
+                sent += item[2]
+                if self.on_progress:
+                    self.on_progress(conn.address, sent, total)
+            elif kind == ITEM_END:
+                writer.write_json(FRAME_END, item[3])
+                result["files"] += 1
+                result["bytes"] += item[3]["size"]
+                unflushed.append((item[1], item[2]))
+        writer.flush()
+        tuner.flushed()
+        self._report(conn.address, unflushed)
+
+    def _report(self, address, entries):
+        """Anuncia y olvida los archivos cuyas tramas ya se han vaciado"""
+        if self.on_file:
+            for path, name in entries:
+                self.on_file(address, path, name)
+        entries.clear()
+
+
+def broadcast(connections, addresses, entries, **kwargs):
+    """Atajo: Broadcast(...).run()"""
+    return Broadcast(connections, addresses, entries, **kwargs).run()
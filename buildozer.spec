@@ -4,6 +4,7 @@ package.name = bluetoothdirecto
 package.domain = org.edgardo
 source.dir = .
 source.include_exts = py,png,jpg,kv,atlas
+source.exclude_dirs = tools
 version = 0.1
 requirements = python3, kivy==2.3.0, kivymd==1.1.1, pyjnius, plyer, android
 
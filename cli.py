@@ -0,0 +1,334 @@
+"""
+MODO SIN INTERFAZ (DEMONIO / LÍNEA DE COMANDOS)
+Usa el mismo motor de transferencia que la app sin importar Kivy ni KivyMD,
+pensado para receptores siempre encendidos.
+
+Uso:
+    python cli.py serve --dir /datos/recibidos [--max-sessions 4] [--durability archivo]
+    python cli.py send --address AA:BB:CC:DD:EE:FF foto1.jpg carpeta/
+    python cli.py queue --address AA:BB:CC:DD:EE:FF carpeta/ [--watch]
+    python cli.py --transport tcp --port 9000 serve --dir /tmp/rx   # pruebas
+    python cli.py --transport tcp --port 9000 send --address 127.0.0.1 archivo
+    python cli.py --trace trazas.jsonl --profile send --address ... archivo
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+import tracing
+import transport
+from batch import expand_selection, send_batch
+from broadcast import Broadcast
+from connection import AndroidConnector, ConnectionManager, RfcommConnector, TcpConnector
+from dedup import HASH_CACHE_FILE, HashCache
+from progress import ProgressReporter, format_progress
+from mux import MuxConnector, MuxServerSocket
+from scheduler import (
+    ORDER_PRIORITY, ORDER_SHORTEST, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL,
+    QUEUE_FILE, STATE_DONE, STATE_FAILED, STATE_PENDING, STATE_SENDING, Scheduler,
+    TransferQueue,
+)
+from server import MAX_SESSIONS, SessionServer
+from storage import DURABILITY_GROUP, DURABILITY_MODES, GROUP_BYTES, GROUP_FILES, Durability
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+LOG_PROGRESS_INTERVAL = 2.0  # Segundos entre líneas de progreso en el registro
+
+log = logging.getLogger("btd")
+
+
+def _log_progress(snapshots):
+    for snapshot in snapshots:
+        log.info("%s", format_progress(snapshot))
+
+
+def _pick_transport(name):
+    if name != "auto":
+        return name
+    if transport.on_android():
+        return "android"
+    if transport.rfcomm_available():
+        return "rfcomm"
+    return "tcp"
+
+
+# =============================================================================
+# SERVIDOR
+# =============================================================================
+def serve(args):
+    kind = _pick_transport(args.transport)
+    os.makedirs(args.dir, exist_ok=True)
+    if kind == "android":
+        listener = transport.android_listen()
+    elif kind == "rfcomm":
+        listener = transport.RfcommServerSocket(args.channel)
+    else:
+        listener = transport.LoopbackServerSocket(host=args.host, port=args.port)
+    # Detecta por el preámbulo si el cliente multiplexa; los antiguos siguen valiendo
+    listener = MuxServerSocket(listener)
+
+    progress = ProgressReporter(_log_progress, LOG_PROGRESS_INTERVAL)
+
+    def session_start(session):
+        progress.add(session.meter)
+        log.info("Sesión %s: cliente %s conectado", session.session_id, session.peer)
+
+    server = SessionServer(
+        listener, args.dir, max_sessions=args.max_sessions,
+        on_file=lambda session, path, header: log.info(
+            "Recibido %s (%s bytes) de %s", path, header.get("size"), session.peer),
+        on_session_start=session_start,
+        on_session_end=lambda session: log.info(
+            "Sesión %s terminada: %s", session.session_id, session.stats),
+        durability=Durability(args.durability, args.group_files,
+                              args.group_mb * 1024 * 1024))
+
+    def shutdown(signum, frame):
+        log.info("Deteniendo servidor (señal %s)", signum)
+        progress.stop()
+        server.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    log.info("Servidor %s escuchando; guardando en %s", kind, os.path.abspath(args.dir))
+    server.serve_forever()
+    return 0
+
+
+# =============================================================================
+# CLIENTE
+# =============================================================================
+def _make_connector(kind, args):
+    if kind == "android":
+        connector = AndroidConnector()
+    elif kind == "rfcomm":
+        connector = RfcommConnector(args.channel)
+    else:
+        connector = TcpConnector(args.port)
+    if not args.no_mux:
+        connector = MuxConnector(connector)
+    return connector
+
+
+def _hash_cache(args):
+    """Caché de resúmenes para la deduplicación, salvo con --no-dedup"""
+    return None if args.no_dedup else HashCache(args.hash_cache)
+
+
+def send(args):
+    kind = _pick_transport(args.transport)
+    entries = expand_selection(args.paths)
+    if not entries:
+        log.error("No hay archivos que enviar")
+        return 2
+
+    if len(args.address) > 1:
+        return send_broadcast(args, kind, entries)
+    address = args.address[0]
+    progress = ProgressReporter(_log_progress, LOG_PROGRESS_INTERVAL)
+    meter = progress.track("envío")
+    start = time.monotonic()
+    connector = _make_connector(kind, args)
+    # Reintentos con espera aleatorizada si el receptor aún no escucha
+    manager = ConnectionManager(connector)
+    try:
+        with manager.use(address) as conn:
+            log.info("Conectado a %s: %s", address, conn.timings)
+            tuner = conn.tuner
+            hashes = _hash_cache(args) if conn.options["dedup"] else None
+            failed = send_batch(conn.writer, entries, reader=conn.reader, tuner=tuner,
+                                compress=conn.options["compression"],
+                                verify=conn.options["verify"], hashes=hashes,
+                                on_file=lambda path, name: log.info("Enviado %s", name),
+                                on_progress=meter.update)
+    finally:
+        meter.finish()
+        progress.stop()
+        manager.close()
+        if not args.no_mux:
+            connector.close()
+
+    for path, error in failed:
+        log.error("No se pudo leer %s: %s", path, error)
+    log.info("%d archivos en %.2f s; parámetros de envío %s",
+             len(entries) - len(failed), time.monotonic() - start, tuner.params)
+    return 1 if failed else 0
+
+
+def send_broadcast(args, kind, entries):
+    """El mismo lote a varios receptores a la vez desde una caché de bloques compartida"""
+    progress = ProgressReporter(_log_progress, LOG_PROGRESS_INTERVAL)
+    meters = {address: progress.track(f"envío {address}") for address in args.address}
+    start = time.monotonic()
+    connector = _make_connector(kind, args)
+    manager = ConnectionManager(connector)
+    try:
+        sender = Broadcast(
+            manager, args.address, entries,
+            on_file=lambda address, path, name: log.info("Enviado %s a %s", name, address),
+            on_progress=lambda address, sent, total: meters[address].update(sent, total))
+        results = sender.run()
+    finally:
+        progress.stop()
+        manager.close()
+        if not args.no_mux:
+            connector.close()
+
+    for path, error in sender.failed:
+        log.error("No se pudo leer %s: %s", path, error)
+    for address, result in results.items():
+        meters[address].finish(result["error"])
+        if result["error"]:
+            log.error("Difusión a %s fallida: %s", address, result["error"])
+        else:
+            log.info("%s: %d archivos en %.2f s", address, result["files"], result["elapsed"])
+    if sender.cache:
+        log.info("Caché de difusión: %s", sender.cache.stats)
+    log.info("Difusión a %d receptores en %.2f s", len(results), time.monotonic() - start)
+    failed = sender.failed or any(result["error"] for result in results.values())
+    return 1 if failed else 0
+
+
+# =============================================================================
+# COLA
+# =============================================================================
+PRIORITIES = {"alta": PRIORITY_HIGH, "normal": PRIORITY_NORMAL, "baja": PRIORITY_LOW}
+
+
+def run_queue(args):
+    """Añade `paths` a la cola y la envía hasta vaciarla (o sin fin con --watch)"""
+    kind = _pick_transport(args.transport)
+    entries = expand_selection(args.paths)
+    if args.paths and not args.address:
+        log.error("Para encolar archivos hace falta --address")
+        return 2
+    if args.paths and not entries:
+        log.error("No hay archivos que encolar")
+        return 2
+
+    finished = threading.Event()
+
+    def on_change(item):
+        if item.state == STATE_DONE:
+            log.info("Enviado %s a %s", item.name, item.address)
+        elif item.state == STATE_FAILED:
+            log.error("Fallido %s tras %d intentos: %s", item.name, item.attempts, item.error)
+        elif item.state == STATE_PENDING and item.error:
+            log.warning("Reintento de %s en %.0f s: %s", item.name,
+                        max(0, item.not_before - time.time()), item.error)
+        counts = queue.counts()
+        if not counts[STATE_PENDING] and not counts[STATE_SENDING] and not args.watch:
+            finished.set()
+
+    queue = TransferQueue(args.file, on_change=on_change)
+    if entries:
+        queue.add(entries, args.address, PRIORITIES[args.priority])
+    counts = queue.counts()
+    log.info("Cola %s: %s", os.path.abspath(args.file), counts)
+    if not counts[STATE_PENDING] and not args.watch:
+        return 0
+
+    progress = ProgressReporter(_log_progress, LOG_PROGRESS_INTERVAL)
+    connector = _make_connector(kind, args)
+    manager = ConnectionManager(connector)
+    scheduler = Scheduler(queue, manager, order=args.order, progress=progress,
+                          hashes=_hash_cache(args)).start()
+
+    def shutdown(signum, frame):
+        log.info("Deteniendo la cola (señal %s); lo pendiente se conserva", signum)
+        finished.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    while not finished.wait(1.0):
+        pass
+    scheduler.stop()
+    progress.stop()
+    manager.close()
+    if not args.no_mux:
+        connector.close()
+    counts = queue.counts()
+    log.info("Cola %s: %s", os.path.abspath(args.file), counts)
+    return 1 if counts[STATE_FAILED] else 0
+
+
+def _add_dedup_arguments(parser):
+    parser.add_argument("--hash-cache", default=HASH_CACHE_FILE,
+                        help="Caché de resúmenes de los archivos de origen")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Enviar todo aunque el receptor ya tenga el contenido")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bluetooth Directo sin interfaz")
+    parser.add_argument("--transport", choices=("auto", "android", "rfcomm", "tcp"),
+                        default="auto")
+    parser.add_argument("--channel", type=int, default=transport.DEFAULT_RFCOMM_CHANNEL,
+                        help="Canal RFCOMM (Linux)")
+    parser.add_argument("--port", type=int, default=9000, help="Puerto TCP (modo tcp)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--trace", metavar="ARCHIVO",
+                        help=f"Trazas JSON por líneas (también con {tracing.TRACE_ENV})")
+    parser.add_argument("--profile", action="store_true",
+                        help="Añade a las trazas un perfilador por muestreo")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Recibir archivos indefinidamente")
+    serve_parser.add_argument("--dir", default=".", help="Carpeta de recepción")
+    serve_parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS)
+    serve_parser.add_argument("--host", default="0.0.0.0", help="Interfaz TCP (modo tcp)")
+    serve_parser.add_argument("--durability", choices=DURABILITY_MODES, default=DURABILITY_GROUP,
+                              help="Cuándo se hace fsync de lo recibido: nunca, por archivo "
+                                   "o en grupo")
+    serve_parser.add_argument("--group-files", type=int, default=GROUP_FILES,
+                              help="Archivos por fsync en grupo")
+    serve_parser.add_argument("--group-mb", type=int, default=GROUP_BYTES // (1024 * 1024),
+                              help="MB por fsync en grupo")
+    serve_parser.set_defaults(func=serve)
+
+    send_parser = commands.add_parser("send", help="Enviar archivos o carpetas")
+    send_parser.add_argument("--address", required=True, action="append",
+                             help="MAC del receptor (o host en tcp); repetido, el lote "
+                                  "se difunde a todos a la vez leyendo cada archivo una vez")
+    send_parser.add_argument("--no-mux", action="store_true",
+                             help="Usar el socket directamente, sin canales multiplexados")
+    _add_dedup_arguments(send_parser)
+    send_parser.add_argument("paths", nargs="+")
+    send_parser.set_defaults(func=send)
+
+    queue_parser = commands.add_parser(
+        "queue", help="Encolar archivos en la cola persistente y enviarla")
+    queue_parser.add_argument("--file", default=QUEUE_FILE, help="Archivo de la cola")
+    queue_parser.add_argument("--address", help="MAC del receptor (o host en tcp)")
+    queue_parser.add_argument("--priority", choices=sorted(PRIORITIES), default="normal")
+    queue_parser.add_argument("--order", choices=(ORDER_PRIORITY, ORDER_SHORTEST),
+                              default=ORDER_PRIORITY)
+    queue_parser.add_argument("--watch", action="store_true",
+                              help="Seguir atendiendo la cola en lugar de salir al vaciarla")
+    queue_parser.add_argument("--no-mux", action="store_true",
+                              help="Usar el socket directamente, sin canales multiplexados")
+    _add_dedup_arguments(queue_parser)
+    queue_parser.add_argument("paths", nargs="*")
+    queue_parser.set_defaults(func=run_queue)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    if args.trace:
+        tracing.start(args.trace, tracing.PROFILE_INTERVAL if args.profile else None)
+    else:
+        tracing.start_from_env()
+    try:
+        return args.func(args)
+    finally:
+        tracing.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
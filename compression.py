@@ -0,0 +1,142 @@
+"""
+COMPRESIÓN EN STREAMING
+Códecs negociados en el saludo y detección de contenido ya comprimido
+"""
+import os
+import zlib
+
+try:
+    import lzma
+except ImportError:  # No todas las compilaciones de python-for-android lo incluyen
+    lzma = None
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+DEFAULT_CODEC = "zlib"
+DEFAULT_LEVEL = 6
+SAMPLE_SIZE = 4 * 1024  # Bytes iniciales que se analizan de cada archivo
+TRIAL_LEVEL = 1  # Nivel de la compresión de prueba sobre la muestra
+TRIAL_RATIO = 0.95  # Proporción comprimida/original a partir de la cual no se comprime
+DECOMPRESS_CHUNK = 256 * 1024  # Límite de salida por llamada al descomprimir
+
+# Formatos que ya van comprimidos: no merece la pena ni muestrear
+INCOMPRESSIBLE_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp4", ".mkv", ".mov",
+    ".avi", ".webm", ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac", ".zip",
+    ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".apk", ".jar", ".docx",
+    ".xlsx", ".pptx", ".odt", ".pdf", ".zst",
+}
+
+
+# =============================================================================
+# CÓDECS
+# =============================================================================
+class _ZlibCodec:
+    name = "zlib"
+
+    def compressor(self, level):
+        return zlib.compressobj(level)
+
+    def decompressor(self):
+        return _ZlibDecompressor()
+
+
+class _ZlibDecompressor:
+    def __init__(self):
+        self._obj = zlib.decompressobj()
+
+    def decompress(self, data):
+        """Genera la salida en trozos acotados para no disparar la memoria"""
+        while data:
+            out = self._obj.decompress(data, DECOMPRESS_CHUNK)
+            if out:
+                yield out
+            data = self._obj.unconsumed_tail
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class _LzmaCodec:
+    name = "xz"
+
+    def compressor(self, level):
+        return lzma.LZMACompressor(preset=min(level, 9))
+
+    def decompressor(self):
+        return _LzmaDecompressor()
+
+
+class _LzmaDecompressor:
+    def __init__(self):
+        self._obj = lzma.LZMADecompressor()
+
+    def decompress(self, data):
+        out = self._obj.decompress(data, DECOMPRESS_CHUNK)
+        if out:
+            yield out
+        while not self._obj.needs_input and not self._obj.eof:
+            out = self._obj.decompress(b"", DECOMPRESS_CHUNK)
+            if not out:
+                break
+            yield out
+
+    def flush(self):
+        return b""
+
+
+CODECS = {"zlib": _ZlibCodec()}
+if lzma is not None:
+    CODECS["xz"] = _LzmaCodec()
+
+# Orden de preferencia: zlib es lo bastante rápido en ARM para no frenar el envío
+PREFERENCE = [name for name in ("zlib", "xz") if name in CODECS]
+
+
+def capabilities():
+    """Capacidades de compresión que se anuncian en el saludo"""
+    return {"codecs": list(PREFERENCE)}
+
+
+def negotiate(client_caps, server_caps, level=DEFAULT_LEVEL):
+    """
+    Elige el primer códec del cliente que también soporte el servidor.
+    Ambos extremos llegan al mismo resultado sin un intercambio adicional.
+    """
+    offered = (client_caps or {}).get("codecs", [])
+    supported = set((server_caps or {}).get("codecs", []))
+    for name in offered:
+        if name in supported and name in CODECS:
+            return {"codec": name, "level": level}
+    return {"codec": None, "level": 0}
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Códec no soportado: {name}")
+
+
+# =============================================================================
+# DETECCIÓN DE CONTENIDO INCOMPRIMIBLE
+# =============================================================================
+def trial_ratio(sample):
+    """
+    Proporción a la que queda la muestra con una compresión rápida de prueba.
+    Todo ocurre en C: un histograma de bytes en Python costaba más por
+    archivo pequeño que lo que ahorraba no comprimirlo.
+    """
+    sample = sample[:SAMPLE_SIZE]
+    if not sample:
+        return 1.0
+    return len(zlib.compress(sample, TRIAL_LEVEL)) / len(sample)
+
+
+def should_compress(path, sample):
+    """Decide a partir de la extensión y de la muestra inicial si comprimir"""
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext in INCOMPRESSIBLE_EXTENSIONS:
+        return False
+    return trial_ratio(sample) < TRIAL_RATIO
@@ -0,0 +1,281 @@
+"""
+GESTOR DE CONEXIONES
+Conexiones de cliente persistentes por MAC: se reutilizan entre envíos, se
+mantienen vivas con tramas PING, recuerdan el canal RFCOMM resuelto para no
+repetir la consulta SDP y se restablecen con espera exponencial aleatorizada.
+"""
+import contextlib
+import random
+import threading
+import time
+import traceback
+
+import tracing
+import transfer
+import transport
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+KEEPALIVE_INTERVAL = 15.0  # Segundos de inactividad antes de enviar un PING
+RECONNECT_ATTEMPTS = 5
+RECONNECT_BASE_DELAY = 0.5  # Segundos antes del segundo intento
+RECONNECT_MAX_DELAY = 30.0
+CONNECT_TIMEOUT = 60.0  # Segundos que la app espera a connect() con todos sus reintentos
+
+
+def backoff_delay(attempt, base=RECONNECT_BASE_DELAY, cap=RECONNECT_MAX_DELAY):
+    """Espera exponencial con jitter completo, para no reintentar todos a la vez"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# =============================================================================
+# CONECTORES
+# =============================================================================
+class AndroidConnector:
+    """connect(mac, canal) -> (socket, canal resuelto o None)"""
+
+    resolve = "sdp"  # Cómo se encuentra el canal cuando no está en caché
+
+    def __init__(self, adapter=None):
+        self.adapter = adapter
+
+    def connect(self, address, channel=None):
+        sock = transport.android_connect(address, self.adapter, channel)
+        return sock, channel or transport.android_channel(sock)
+
+
+class RfcommConnector:
+    resolve = "fijo"
+
+    def __init__(self, channel=transport.DEFAULT_RFCOMM_CHANNEL):
+        self.channel = channel
+
+    def connect(self, address, channel=None):
+        channel = channel or self.channel
+        return transport.rfcomm_connect(address, channel), channel
+
+
+class TcpConnector:
+    resolve = None
+
+    def __init__(self, port):
+        self.port = port
+
+    def connect(self, address, channel=None):
+        return transport.tcp_connect(address, self.port), None
+
+
+# =============================================================================
+# CONEXIÓN CON UN PAR
+# =============================================================================
+class PeerConnection:
+    """Sesión abierta con un receptor; `lock` la reserva para un envío o un PING"""
+
+    def __init__(self, address, socket, reader, writer, options, timings):
+        self.address = address
+        self.socket = socket
+        self.reader = reader
+        self.writer = writer
+        self.options = options
+        self.timings = timings
+        # El ajuste del envío se conserva entre lotes de la misma conexión
+        self.tuner = transfer.SendTuner()
+        self.lock = threading.Lock()
+        self.alive = True
+        self.last_used = time.monotonic()
+
+    def ping(self):
+        transfer.keepalive(self.writer)
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.alive:
+            self.alive = False
+            try:
+                transfer.end_session(self.writer)
+            except Exception:
+                pass
+        try:
+            self.socket.close()
+        except Exception:
+            pass
+
+
+# =============================================================================
+# GESTOR
+# =============================================================================
+class ConnectionManager:
+    """
+    Una conexión viva por MAC. on_state(mac, estado) informa de
+    "conectado", "reconectando" y "desconectado" desde hilos propios.
+    """
+
+    def __init__(self, connector, keepalive_interval=KEEPALIVE_INTERVAL,
+                 attempts=RECONNECT_ATTEMPTS, on_state=None):
+        self.connector = connector
+        self.keepalive_interval = keepalive_interval
+        self.attempts = attempts
+        self.on_state = on_state
+        self.timings = {}  # MAC -> tiempos de la última conexión
+        self._peers = {}
+        self._channels = {}  # MAC -> canal RFCOMM resuelto por SDP
+        self._lock = threading.Lock()
+        self._dial_locks = {}  # MAC -> lock que ordena solo las conexiones con ese par
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _dial_lock(self, address):
+        with self._lock:
+            return self._dial_locks.setdefault(address, threading.Lock())
+
+    def connect(self, address):
+        """
+        Devuelve la conexión viva con `address`, abriéndola si hace falta.
+        Las conexiones con pares distintos avanzan en paralelo: un par
+        inalcanzable (reintentos, espera exponencial) no frena a los demás.
+        """
+        with self._dial_lock(address):
+            with self._lock:
+                conn = self._peers.get(address)
+            if conn and conn.alive:
+                return conn
+            conn = self._connect_with_retries(address)
+            with self._lock:
+                self._peers[address] = conn
+            self._start_keepalive()
+        self._notify(address, "conectado")
+        return conn
+
+    @contextlib.contextmanager
+    def use(self, address):
+        """Reserva la conexión para un envío; si falla, se descarta y se reconectará"""
+        conn = self.connect(address)
+        with conn.lock:
+            try:
+                yield conn
+            except Exception:
+                self._drop(conn)
+                raise
+            finally:
+                conn.last_used = time.monotonic()
+
+    def _connect_with_retries(self, address):
+        for attempt in range(self.attempts):
+            try:
+                return self._open(address)
+            except Exception:
+                if attempt + 1 == self.attempts:
+                    raise
+                traceback.print_exc()
+                self._notify(address, "reconectando")
+                if self._stop.wait(backoff_delay(attempt)):
+                    raise
+        raise ConnectionError(f"Sin intentos de conexión para {address}")
+
+    def _open(self, address):
+        channel = self._channels.get(address)
+        start = time.monotonic()
+        try:
+            with tracing.span("conn.connect", address=address, channel=channel):
+                sock, resolved = self.connector.connect(address, channel)
+        except Exception:
+            if channel is None:
+                raise
+            # El canal guardado ya no vale (p. ej. el receptor se reinició): SDP
+            self._channels.pop(address, None)
+            channel = None
+            start = time.monotonic()
+            with tracing.span("conn.connect", address=address, channel=None):
+                sock, resolved = self.connector.connect(address, None)
+        connected = time.monotonic()
+        try:
+            with tracing.span("conn.handshake", address=address):
+                reader, writer = transfer.open_session(sock)
+                hello = transfer.client_handshake(reader, writer)
+        except Exception:
+            sock.close()
+            raise
+        first_byte = time.monotonic()
+        if resolved:
+            self._channels[address] = resolved
+
+        timings = {
+            # En Android la consulta SDP ocurre dentro de connect(): con canal
+            # en caché, la diferencia de "connect" entre ambos casos es su coste
+            "resolve": "cache" if channel else self.connector.resolve,
+            "connect": connected - start,
+            "first_byte": first_byte - connected,
+        }
+        self.timings[address] = timings
+        tracing.event("conn.open", address=address, **timings)
+        options = transfer.negotiate(transfer.local_capabilities(), hello.get("caps"))
+        return PeerConnection(address, sock, reader, writer, options, timings)
+
+    def _drop(self, conn):
+        conn.alive = False
+        try:
+            conn.socket.close()
+        except Exception:
+            pass
+        with self._lock:
+            if self._peers.get(conn.address) is conn:
+                del self._peers[conn.address]
+
+    def _notify(self, address, state):
+        if self.on_state:
+            self.on_state(address, state)
+
+    # -------------------------------------------------------------------------
+    # MANTENIMIENTO
+    # -------------------------------------------------------------------------
+    def _start_keepalive(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._keepalive_loop, daemon=True)
+            self._thread.start()
+
+    def _keepalive_loop(self):
+        while not self._stop.wait(self.keepalive_interval / 2):
+            with self._lock:
+                peers = list(self._peers.values())
+            now = time.monotonic()
+            for conn in peers:
+                if not conn.options.get("keepalive"):
+                    continue
+                if now - conn.last_used < self.keepalive_interval:
+                    continue
+                if not conn.lock.acquire(blocking=False):
+                    continue  # Hay un envío en curso: ya mantiene el enlace
+                try:
+                    conn.ping()
+                except Exception:
+                    self._drop(conn)
+                    threading.Thread(target=self._reconnect, args=(conn.address,),
+                                     daemon=True).start()
+                finally:
+                    conn.lock.release()
+
+    def _reconnect(self, address):
+        self._notify(address, "reconectando")
+        try:
+            self.connect(address)
+        except Exception:
+            self._notify(address, "desconectado")
+
+    def addresses(self):
+        """MAC de las conexiones vivas"""
+        with self._lock:
+            return [address for address, conn in self._peers.items() if conn.alive]
+
+    def close(self, address=None):
+        """Cierra la conexión con `address`, o todas y el mantenimiento"""
+        with self._lock:
+            if address is None:
+                peers = list(self._peers.values())
+                self._peers.clear()
+                self._stop.set()
+            else:
+                peers = [self._peers.pop(address)] if address in self._peers else []
+        for conn in peers:
+            with conn.lock:
+                conn.close()
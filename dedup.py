@@ -0,0 +1,182 @@
+"""
+DEDUPLICACIÓN POR CONTENIDO
+El receptor guarda un índice persistente de lo recibido (resumen SHA-256 y
+tamaño -> ruta) y el emisor una caché de resúmenes de sus archivos (ruta,
+mtime y tamaño -> resumen). Antes de cada lote el emisor ofrece los
+resúmenes (OFFER) y el receptor contesta con los que ya tiene (HAVE): esos
+archivos se resuelven en local con un enlace o una copia y no viajan.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+import integrity
+from storage import atomic_write_json
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+INDEX_FILE = ".indice_contenido.json"  # En la carpeta de recepción
+HASH_CACHE_FILE = "resumenes_envio.json"
+DEDUP_MIN_SIZE = 64 * 1024  # Por debajo se envía sin ofrecer: cuesta poco más que la oferta
+SAVE_EVERY = 64  # Cambios acumulados antes de guardar sin esperar al final
+SAVE_INTERVAL = 5.0  # Segundos como máximo con cambios sin guardar (al llegar otro)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def content_key(digest, size):
+    return f"{digest}:{size}"
+
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+# =============================================================================
+# ÍNDICE DEL RECEPTOR
+# =============================================================================
+class ContentIndex:
+    """
+    Archivos recibidos en `dest_dir` por contenido. Una entrada solo vale si
+    el archivo sigue ahí con el mismo tamaño y mtime; si no, se descarta al
+    consultarla. Hay uno por carpeta, compartido por todas las sesiones.
+    """
+
+    def __init__(self, dest_dir):
+        self.dest_dir = dest_dir
+        self.path = os.path.join(dest_dir, INDEX_FILE)
+        self._entries = _load(self.path)
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self._saved_at = time.monotonic()
+
+    @classmethod
+    def for_dir(cls, dest_dir):
+        key = os.path.abspath(dest_dir)
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = _indexes[key] = cls(dest_dir)
+            return index
+
+    def add(self, path, digest, size):
+        """Anota un archivo ya en su sitio definitivo"""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        entry = {"path": os.path.relpath(path, self.dest_dir), "mtime_ns": mtime_ns}
+        with self._lock:
+            self._entries[content_key(digest, size)] = entry
+            self._dirty += 1
+            save = (self._dirty >= SAVE_EVERY
+                    or time.monotonic() - self._saved_at >= SAVE_INTERVAL)
+        if save:
+            self.save()
+
+    def lookup(self, digest, size):
+        """Ruta de un archivo recibido con ese contenido, o None"""
+        key = content_key(digest, size)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        path = os.path.join(self.dest_dir, entry["path"])
+        try:
+            stat = os.stat(path)
+            valid = stat.st_size == size and stat.st_mtime_ns == entry["mtime_ns"]
+        except OSError:
+            valid = False
+        if not valid:
+            # Borrado o modificado desde que se recibió
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                    self._dirty += 1
+            return None
+        return path
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = dict(self._entries)
+            self._dirty = 0
+            self._saved_at = time.monotonic()
+        try:
+            atomic_write_json(self.path, entries)
+        except OSError:
+            pass  # El índice es una optimización: sin él se reciben los datos
+
+
+def materialize(source, target):
+    """Crea `target` con el contenido de `source`: enlace duro o, si no se puede, copia"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        # Sin enlaces duros (FAT, almacenamiento compartido de Android): copia
+        shutil.copyfile(source, target)
+
+
+# =============================================================================
+# CACHÉ DE RESÚMENES DEL EMISOR
+# =============================================================================
+class HashCache:
+    """
+    Resumen de cada archivo de origen, válido mientras no cambien su tamaño
+    ni su mtime; así un archivo grande solo se relee entero la primera vez.
+    Cuando cambia se recuerda el resumen anterior, que identifica ante el
+    receptor la versión de la que puede partir un envío delta.
+    Con `path` None la caché vive solo en memoria.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = _load(path) if path else {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def digest(self, path):
+        """Resumen de `path` (de la caché si el archivo no ha cambiado)"""
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["digest"]
+        digest = integrity.file_digest(path)
+        updated = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest}
+        if entry:
+            # La versión anterior sirve de base para un envío delta
+            updated["previous"] = {"digest": entry["digest"], "size": entry["size"]}
+        with self._lock:
+            self._entries[key] = updated
+            self._dirty = True
+        return digest
+
+    def previous(self, path):
+        """{"digest", "size"} de la versión de `path` vista antes de la actual, o None"""
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(path))
+        return entry.get("previous") if entry else None
+
+    def save(self):
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            entries = dict(self._entries)
+            self._dirty = False
+        try:
+            atomic_write_json(self.path, entries)
+        except OSError:
+            pass
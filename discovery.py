@@ -0,0 +1,194 @@
+"""
+DESCUBRIMIENTO DE DISPOSITIVOS
+Caché en memoria indexada por MAC que se alimenta fuera del hilo de la UI
+(emparejados y descubrimiento real de Android) y entrega solo las diferencias.
+"""
+import threading
+import time
+import traceback
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+NO_RSSI = -32768  # Valor de BluetoothDevice.EXTRA_RSSI cuando no viene
+
+
+class DeviceInfo:
+    """Lo que se sabe de un dispositivo visto o emparejado"""
+
+    def __init__(self, address, name=None):
+        self.address = address
+        self.name = name
+        self.rssi = None
+        self.bonded = False
+        self.last_seen = None
+        self.connect_latency = None  # Segundos del último connect() que funcionó
+
+
+class DeviceCache:
+    """
+    Dispositivos por MAC. Los cambios se acumulan y on_change() se llama solo
+    una vez hasta que alguien los recoge con take_changes(), así una ráfaga de
+    resultados del escaneo produce una única actualización de la UI.
+    """
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._changed = set()
+        self._removed = set()
+        self._scan_started = None
+
+    def get(self, address):
+        with self._lock:
+            return self._devices.get(address)
+
+    def devices(self):
+        with self._lock:
+            return list(self._devices.values())
+
+    def upsert(self, address, name=None, rssi=None, bonded=None):
+        """Añade o actualiza un dispositivo; solo cuenta como cambio si algo difiere"""
+        if not address:
+            return
+        now = time.time()
+        with self._lock:
+            info = self._devices.get(address)
+            changed = info is None
+            if changed:
+                info = self._devices[address] = DeviceInfo(address)
+            for attr, value in (("name", name), ("rssi", rssi), ("bonded", bonded)):
+                if value is not None and getattr(info, attr) != value:
+                    setattr(info, attr, value)
+                    changed = True
+            info.last_seen = now
+            if changed:
+                self._mark(address)
+
+    def record_connect(self, address, latency):
+        with self._lock:
+            info = self._devices.get(address)
+            if info is None:
+                info = self._devices[address] = DeviceInfo(address)
+            info.connect_latency = latency
+            self._mark(address)
+
+    def begin_scan(self):
+        self._scan_started = time.time()
+
+    def end_scan(self, prune=True):
+        """Con `prune`, olvida los no emparejados que no han aparecido en este escaneo"""
+        if self._scan_started is None or not prune:
+            self._scan_started = None
+            return
+        with self._lock:
+            for address, info in list(self._devices.items()):
+                if not info.bonded and (info.last_seen or 0) < self._scan_started:
+                    del self._devices[address]
+                    self._mark(address, removed=True)
+        self._scan_started = None
+
+    def _mark(self, address, removed=False):
+        # Con el cerrojo tomado; se avisa si no había ya cambios sin recoger,
+        # así que hay que mirarlo antes de tocar los conjuntos
+        notify = not self._changed and not self._removed
+        if removed:
+            self._changed.discard(address)
+            self._removed.add(address)
+        else:
+            self._removed.discard(address)
+            self._changed.add(address)
+        if notify and self.on_change:
+            self.on_change()
+
+    def take_changes(self):
+        """Devuelve (actualizados, MACs eliminadas) desde la última llamada"""
+        with self._lock:
+            updated = [self._devices[a] for a in self._changed if a in self._devices]
+            removed = list(self._removed)
+            self._changed.clear()
+            self._removed.clear()
+        return updated, removed
+
+
+# =============================================================================
+# ANDROID
+# =============================================================================
+class AndroidDiscovery:
+    """
+    Lee los emparejados y lanza el descubrimiento del adaptador en un hilo
+    propio; los resultados (ACTION_FOUND) llegan por un BroadcastReceiver.
+    """
+
+    def __init__(self, adapter, cache, on_finished=None):
+        self.adapter = adapter
+        self.cache = cache
+        self.on_finished = on_finished
+        self._receiver = None
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            self.cache.begin_scan()
+            self.adapter.cancelDiscovery()
+            bonded = self.adapter.getBondedDevices()
+            if bonded:
+                for device in bonded.toArray():
+                    self.cache.upsert(device.getAddress(), device.getName(), bonded=True)
+            self._register()
+            if not self.adapter.startDiscovery():
+                self.stop()
+        except Exception:
+            traceback.print_exc()
+            self.stop()
+
+    def _register(self):
+        from android.broadcast import BroadcastReceiver
+
+        self._receiver = BroadcastReceiver(self._on_broadcast, actions=[
+            "android.bluetooth.device.action.FOUND",
+            "android.bluetooth.adapter.action.DISCOVERY_FINISHED",
+        ])
+        self._receiver.start()
+
+    def _on_broadcast(self, context, intent):
+        action = intent.getAction()
+        if action == "android.bluetooth.adapter.action.DISCOVERY_FINISHED":
+            self.stop(finished=True)
+            return
+        device = intent.getParcelableExtra("android.bluetooth.device.extra.DEVICE")
+        if device is None:
+            return
+        rssi = intent.getShortExtra("android.bluetooth.device.extra.RSSI", NO_RSSI)
+        self.cache.upsert(device.getAddress(), device.getName(),
+                          rssi=None if rssi == NO_RSSI else rssi,
+                          bonded=device.getBondState() == 12)  # BOND_BONDED
+
+    def stop(self, finished=False):
+        """
+        Termina el escaneo. Solo un escaneo completo da de baja a los que ya
+        no se ven; uno interrumpido no ha tenido tiempo de verlos a todos.
+        """
+        if not self.running:
+            return
+        self.running = False
+        try:
+            self.adapter.cancelDiscovery()
+        except Exception:
+            pass
+        if self._receiver:
+            try:
+                self._receiver.stop()
+            except Exception:
+                pass
+            self._receiver = None
+        self.cache.end_scan(prune=finished)
+        if self.on_finished:
+            self.on_finished(self)
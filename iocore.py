@@ -0,0 +1,329 @@
+"""
+NÚCLEO DE E/S
+Un único bucle asyncio en su propio hilo que coordina las operaciones de red.
+Las llamadas bloqueantes (accept/read/write de JNI, connect) se ejecutan en un
+executor acotado; cancelar o agotar el tiempo de una de ellas cierra el
+recurso que la bloquea, que es la única forma de desbloquear un hilo metido
+en JNI. También define la máquina de estados de una sesión.
+"""
+import asyncio
+import itertools
+import queue
+import threading
+from concurrent.futures import Executor, Future
+
+import tracing
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+MAX_BLOCKING_CALLS = 8  # Hilos del executor: llamadas bloqueantes simultáneas
+STOP_TIMEOUT = 5  # Segundos que stop() espera a que terminen las tareas canceladas
+
+# Estados de una sesión
+STATE_PENDING = "pendiente"
+STATE_ACTIVE = "activa"
+STATE_CANCELLING = "cancelando"
+STATE_DONE = "terminada"
+STATE_FAILED = "error"
+STATE_CANCELLED = "cancelada"
+
+TRANSITIONS = {
+    STATE_PENDING: {STATE_ACTIVE, STATE_CANCELLED},
+    STATE_ACTIVE: {STATE_DONE, STATE_FAILED, STATE_CANCELLING},
+    STATE_CANCELLING: {STATE_CANCELLED, STATE_DONE},
+    STATE_DONE: set(),
+    STATE_FAILED: set(),
+    STATE_CANCELLED: set(),
+}
+FINAL_STATES = {STATE_DONE, STATE_FAILED, STATE_CANCELLED}
+
+
+class StateError(RuntimeError):
+    pass
+
+
+# =============================================================================
+# MÁQUINA DE ESTADOS
+# =============================================================================
+class SessionStateMachine:
+    """
+    Estado de una sesión con transiciones explícitas (TRANSITIONS). Una sesión
+    cancelada mientras estaba activa pasa por "cancelando" y termina en
+    "cancelada" aunque la operación interrumpida acabe con un error de socket.
+    """
+
+    def __init__(self, on_change=None):
+        self.state = STATE_PENDING
+        self.on_change = on_change
+        self._lock = threading.Lock()
+
+    def to(self, state):
+        with self._lock:
+            previous = self.state
+            if state not in TRANSITIONS[previous]:
+                raise StateError(f"Transición no permitida: {previous} -> {state}")
+            self.state = state
+        if self.on_change:
+            self.on_change(previous, state)
+
+    def finish(self, error=None):
+        """Estado final según cómo acabó la operación; devuelve el estado"""
+        with self._lock:
+            previous = self.state
+            if previous == STATE_CANCELLING:
+                state = STATE_CANCELLED
+            elif error is None:
+                state = STATE_DONE
+            else:
+                state = STATE_FAILED
+            if state not in TRANSITIONS[previous]:
+                raise StateError(f"Transición no permitida: {previous} -> {state}")
+            self.state = state
+        if self.on_change:
+            self.on_change(previous, state)
+        return state
+
+    def cancel(self):
+        """Marca la cancelación; False si la sesión ya había terminado"""
+        with self._lock:
+            previous = self.state
+            if previous == STATE_PENDING:
+                self.state = STATE_CANCELLED
+            elif previous == STATE_ACTIVE:
+                self.state = STATE_CANCELLING
+            else:
+                return False
+            state = self.state
+        if self.on_change:
+            self.on_change(previous, state)
+        return True
+
+    @property
+    def cancelled(self):
+        return self.state in (STATE_CANCELLING, STATE_CANCELLED)
+
+    @property
+    def finished(self):
+        return self.state in FINAL_STATES
+
+
+# =============================================================================
+# EXECUTOR DE LLAMADAS BLOQUEANTES
+# =============================================================================
+class BlockingExecutor(Executor):
+    """
+    Executor acotado con hilos daemon que se crean según hacen falta. A
+    diferencia de ThreadPoolExecutor, una llamada colgada en JNI (un accept()
+    que nadie cancela) no impide que el proceso termine.
+    """
+
+    def __init__(self, max_workers, name="bloqueo"):
+        self.max_workers = max_workers
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._idle = threading.Semaphore(0)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Executor cerrado")
+            future = Future()
+            self._queue.put((future, fn, args, kwargs))
+            if not self._idle.acquire(blocking=False) and len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._worker, daemon=True,
+                                          name=f"{self.name}-{len(self._threads) + 1}")
+                self._threads.append(thread)
+                thread.start()
+        return future
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+                del future, item
+            self._idle.release()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._lock:
+            self._shutdown = True
+            threads = list(self._threads)
+        if cancel_futures:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[0].cancel()
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+
+def _discard(future):
+    if not future.cancelled():
+        future.exception()
+
+
+# =============================================================================
+# NÚCLEO
+# =============================================================================
+class IOCore:
+    """
+    Bucle asyncio en un hilo propio más un executor con `max_blocking` hilos.
+    Desde cualquier hilo: submit() programa una corrutina y devuelve un
+    concurrent.futures.Future cuyo cancel() cancela la tarea en el bucle.
+    Dentro del bucle: blocking() ejecuta una llamada bloqueante con timeout y
+    cancelación estructurada.
+    """
+
+    def __init__(self, max_blocking=MAX_BLOCKING_CALLS, name="io"):
+        self.max_blocking = max_blocking
+        self.name = name
+        self.loop = None
+        self._executor = None
+        self._thread = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+        self._calls = itertools.count(1)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._executor = BlockingExecutor(self.max_blocking, name=f"{self.name}-bloqueo")
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        self._started.wait()
+        return self
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    @property
+    def running(self):
+        return self.loop is not None and self.loop.is_running()
+
+    def in_loop(self):
+        return threading.get_ident() == (self._thread.ident if self._thread else None)
+
+    # -------------------------------------------------------------------------
+    # DESDE OTROS HILOS
+    # -------------------------------------------------------------------------
+    def submit(self, coro):
+        """Programa `coro` en el bucle; devuelve un concurrent.futures.Future"""
+        if not self.running:
+            coro.close()
+            raise RuntimeError("El núcleo de E/S no está en marcha")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Ejecuta `coro` en el bucle y espera su resultado desde otro hilo"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def call(self, func, *args, timeout=None, on_cancel=None):
+        """Versión síncrona de blocking() para hilos que no son el del bucle"""
+        return self.run(self.blocking(func, *args, timeout=timeout, on_cancel=on_cancel))
+
+    # -------------------------------------------------------------------------
+    # DENTRO DEL BUCLE
+    # -------------------------------------------------------------------------
+    async def blocking(self, func, *args, timeout=None, on_cancel=None):
+        """
+        Ejecuta func(*args) en el executor. Si la tarea se cancela o pasa
+        `timeout`, llama a on_cancel() (p. ej. cerrar el socket) para que la
+        llamada bloqueada vuelva, y espera a que el hilo quede libre antes de
+        propagar la cancelación: ninguna llamada sigue viva tras el await.
+        Sin on_cancel no hay forma de interrumpirla; se abandona el hilo, que
+        sigue ocupando un hueco del executor hasta que la llamada vuelva.
+        """
+        call_id = next(self._calls)
+        future = self.loop.run_in_executor(self._executor, func, *args)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+            tracing.event("io.cancel", call=call_id, func=getattr(func, "__qualname__", str(func)),
+                          reason="timeout" if isinstance(e, asyncio.TimeoutError) else "cancel")
+            if on_cancel is not None:
+                try:
+                    on_cancel()
+                except Exception:
+                    pass
+                # Con el recurso cerrado la llamada termina enseguida (normalmente con error)
+                await asyncio.wait([future])
+            # Su resultado o error ya no interesan a nadie
+            future.add_done_callback(_discard)
+            if isinstance(e, asyncio.TimeoutError):
+                raise TimeoutError(f"Tiempo agotado ({timeout} s)") from None
+            raise
+
+    async def scope(self, coros, cancel_on_error=True):
+        """
+        Ejecuta varias corrutinas como un grupo: si se cancela el grupo (o una
+        falla y cancel_on_error), se cancelan todas y se espera a que acaben.
+        Devuelve los resultados en orden.
+        """
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        try:
+            if cancel_on_error:
+                return await asyncio.gather(*tasks)
+            return await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+    # -------------------------------------------------------------------------
+    # PARADA
+    # -------------------------------------------------------------------------
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Cancela todas las tareas, espera hasta `timeout` y para el bucle"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None or self.loop is None:
+            return
+        if self.loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(
+                    self._cancel_all(timeout), self.loop).result(timeout + 1)
+            except Exception:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if threading.current_thread() is not thread:
+            thread.join(timeout)
+        self._executor.shutdown(wait=False)
+        self._started.clear()
+
+    async def _cancel_all(self, timeout):
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
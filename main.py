@@ -1,600 +1,858 @@
-"""
-APLICACIÓN BLUETOOTH CLIENTE/SERVIDOR PARA ANDROID
-Envío y recepción de archivos por RFCOMM
-Versión mejorada con lista de dispositivos vinculados y transferencia funcional
-"""
-import os
-import threading
-import traceback
-from datetime import datetime
-from kivy.lang import Builder
-from kivy.clock import Clock
-from kivy.utils import platform
-from kivymd.app import MDApp
-from kivymd.uix.button import MDRaisedButton, MDFlatButton
-from kivymd.uix.label import MDLabel
-from kivymd.uix.list import TwoLineListItem, MDList
-from kivymd.uix.scrollview import MDScrollView
-from kivymd.uix.dialog import MDDialog
-from kivymd.toast import toast
-
-# =============================================================================
-# IMPORTACIONES ESPECÍFICAS DE ANDROID
-# =============================================================================
-if platform == 'android':
-    from android.permissions import request_permissions, Permission, check_permission
-    from android import api_version
-    from plyer import filechooser
-    from jnius import autoclass, cast, JavaException
-else:
-    # Simulación para pruebas en PC
-    def request_permissions(*args, **kwargs):
-        print("[Simulación] Permisos solicitados")
-
-    class Permission:
-        READ_EXTERNAL_STORAGE = "dummy"
-        READ_MEDIA_IMAGES = "dummy"
-        READ_MEDIA_VIDEO = "dummy"
-        READ_MEDIA_AUDIO = "dummy"
-        BLUETOOTH_CONNECT = "dummy"
-        BLUETOOTH_SCAN = "dummy"
-        ACCESS_FINE_LOCATION = "dummy"
-        ACCESS_COARSE_LOCATION = "dummy"
-
-    from plyer import filechooser
-
-# =============================================================================
-# CONSTANTES
-# =============================================================================
-UUID_SPP = "00001101-0000-1000-8000-00805F9B34FB"  # Estándar para RFCOMM
-CHUNK_SIZE = 1024  # Tamaño de fragmento para envío
-
-# =============================================================================
-# INTERFAZ DE USUARIO (KV)
-# =============================================================================
-KV = '''
-MDScreen:
-    MDBoxLayout:
-        orientation: "vertical"
-        spacing: "10dp"
-        padding: "10dp"
-
-        MDTopAppBar:
-            title: "Bluetooth Directo"
-            elevation: 4
-            md_bg_color: app.theme_cls.primary_color
-            left_action_items: [["menu", lambda x: app.open_menu()]]
-
-        MDLabel:
-            id: status_label
-            text: "Desconectado"
-            halign: "center"
-            theme_text_color: "Secondary"
-            size_hint_y: None
-            height: "40dp"
-
-        MDBoxLayout:
-            size_hint_y: None
-            height: "60dp"
-            spacing: "10dp"
-
-            MDRaisedButton:
-                id: btn_server
-                text: "MODO SERVIDOR"
-                on_release: app.start_server_mode()
-                md_bg_color: app.theme_cls.primary_color
-                disabled: True
-
-            MDRaisedButton:
-                id: btn_client
-                text: "MODO CLIENTE"
-                on_release: app.start_client_mode()
-                md_bg_color: app.theme_cls.primary_color
-                disabled: True
-
-        ScrollView:
-            MDList:
-                id: device_list
-
-        MDCard:
-            orientation: "vertical"
-            size_hint: 1, None
-            height: "180dp"
-            padding: "10dp"
-            spacing: "10dp"
-            elevation: 3
-
-            MDLabel:
-                id: file_label
-                text: "Ningún archivo seleccionado"
-                halign: "center"
-                theme_text_color: "Hint"
-
-            MDBoxLayout:
-                orientation: "horizontal"
-                spacing: "10dp"
-                size_hint_x: None
-                width: self.minimum_width
-                pos_hint: {"center_x": 0.5}
-
-                MDRectangleFlatButton:
-                    id: btn_select_file
-                    text: "SELECCIONAR ARCHIVO"
-                    on_release: app.select_file()
-                    disabled: True
-
-                MDRaisedButton:
-                    id: btn_send
-                    text: "ENVIAR"
-                    on_release: app.start_sending()
-                    disabled: True
-
-        MDBoxLayout:
-            size_hint_y: None
-            height: "50dp"
-            spacing: "10dp"
-            padding: "10dp"
-
-            MDRectangleFlatButton:
-                id: btn_scan
-                text: "ESCANEAR"
-                on_release: app.scan_devices()
-                disabled: True
-
-            MDRectangleFlatButton:
-                id: btn_stop_server
-                text: "DETENER SERVIDOR"
-                on_release: app.stop_server()
-                disabled: True
-                md_bg_color: "red"
-'''
-
-# =============================================================================
-# CLASE PRINCIPAL DE LA APLICACIÓN
-# =============================================================================
-class AplicacionBluetoothDirecto(MDApp):
-    def build(self):
-        self.theme_cls.primary_palette = "Blue"
-        self.screen = Builder.load_string(KV)
-        self.device_list_widget = self.screen.ids.device_list
-
-        # Variables de estado
-        self.is_server = False
-        self.is_client = False
-        self.connected = False
-        self.selected_file = None
-        self.selected_device_mac = None
-        self.selected_device_name = None
-
-        # Objetos Bluetooth (inicializados en Android)
-        self.bluetooth_adapter = None
-        self.server_socket = None
-        self.client_socket = None
-        self.connected_thread = None
-
-        # Para UI
-        self.dialog = None
-
-        if platform == 'android':
-            self.request_permissions()
-        else:
-            self.update_status("MODO PC - Simulación")
-
-        return self.screen
-
-    # -------------------------------------------------------------------------
-    # MANEJO DE PERMISOS
-    # -------------------------------------------------------------------------
-    def request_permissions(self):
-        """Solicita todos los permisos necesarios según la versión de Android"""
-        permissions = [
-            Permission.READ_EXTERNAL_STORAGE,
-            Permission.READ_MEDIA_IMAGES,
-            Permission.READ_MEDIA_VIDEO,
-            Permission.READ_MEDIA_AUDIO,
-        ]
-
-        # Permisos de Bluetooth según API level
-        if api_version >= 31:  # Android 12+
-            permissions.extend([
-                Permission.BLUETOOTH_CONNECT,
-                Permission.BLUETOOTH_SCAN,
-            ])
-            # No es obligatorio, pero por compatibilidad
-            permissions.append(Permission.ACCESS_FINE_LOCATION)
-        else:
-            # Android 11 y anteriores
-            permissions.extend([
-                Permission.BLUETOOTH,
-                Permission.BLUETOOTH_ADMIN,
-                Permission.ACCESS_FINE_LOCATION,
-                Permission.ACCESS_COARSE_LOCATION,
-            ])
-
-        request_permissions(permissions, self.on_permissions_result)
-
-    def on_permissions_result(self, permissions, results):
-        if all(results):
-            self.update_status("Permisos concedidos")
-            self.init_bluetooth()
-        else:
-            toast("Faltan permisos necesarios. Revisa ajustes.")
-
-    # -------------------------------------------------------------------------
-    # INICIALIZACIÓN DE BLUETOOTH
-    # -------------------------------------------------------------------------
-    def init_bluetooth(self):
-        """Inicializa el adaptador Bluetooth de Android"""
-        try:
-            BluetoothAdapter = autoclass('android.bluetooth.BluetoothAdapter')
-            self.bluetooth_adapter = BluetoothAdapter.getDefaultAdapter()
-
-            if not self.bluetooth_adapter:
-                toast("Este dispositivo no soporta Bluetooth")
-                return
-
-            if not self.bluetooth_adapter.isEnabled():
-                # Intentar encender Bluetooth
-                self.bluetooth_adapter.enable()
-                toast("Activando Bluetooth...")
-
-            self.update_status("Bluetooth listo")
-            # Habilitar botones según modo
-            self.screen.ids.btn_server.disabled = False
-            self.screen.ids.btn_client.disabled = False
-
-        except Exception as e:
-            toast(f"Error al iniciar Bluetooth: {str(e)}")
-
-    # -------------------------------------------------------------------------
-    # UTILIDADES DE UI
-    # -------------------------------------------------------------------------
-    def update_status(self, text):
-        Clock.schedule_once(lambda dt: setattr(self.screen.ids.status_label, 'text', text))
-
-    def show_dialog(self, title, text):
-        if not self.dialog:
-            self.dialog = MDDialog(
-                title=title,
-                text=text,
-                buttons=[MDFlatButton(text="OK", on_release=lambda x: self.dialog.dismiss())]
-            )
-        else:
-            self.dialog.title = title
-            self.dialog.text = text
-        self.dialog.open()
-
-    # -------------------------------------------------------------------------
-    # MODO SERVIDOR
-    # -------------------------------------------------------------------------
-    def start_server_mode(self):
-        """Inicia el modo servidor: espera conexiones entrantes"""
-        if not self.bluetooth_adapter:
-            toast("Bluetooth no disponible")
-            return
-
-        self.is_server = True
-        self.is_client = False
-        self.screen.ids.btn_server.md_bg_color = "green"
-        self.screen.ids.btn_client.md_bg_color = self.theme_cls.primary_color
-        self.screen.ids.btn_stop_server.disabled = False
-        self.screen.ids.btn_select_file.disabled = True  # El servidor no selecciona archivo
-        self.screen.ids.btn_scan.disabled = True  # El servidor no escanea
-
-        self.update_status("Servidor: Esperando conexión...")
-        threading.Thread(target=self._server_thread, daemon=True).start()
-
-    def _server_thread(self):
-        """Hilo del servidor: crea socket y acepta conexión"""
-        try:
-            UUID = autoclass('java.util.UUID')
-            uuid = UUID.fromString(UUID_SPP)
-
-            # Crear socket servidor
-            self.server_socket = self.bluetooth_adapter.listenUsingRfcommWithServiceRecord(
-                "AppBluetoothServer", uuid)
-
-            # Aceptar conexión (bloqueante)
-            self.client_socket = self.server_socket.accept()
-
-            # Conexión establecida
-            Clock.schedule_once(lambda dt: self._on_server_connected())
-
-        except Exception as e:
-            error_msg = f"Error en servidor: {str(e)}"
-            Clock.schedule_once(lambda dt: toast(error_msg))
-            traceback.print_exc()
-        finally:
-            # Cerramos el server socket después de aceptar uno
-            if self.server_socket:
-                try:
-                    self.server_socket.close()
-                except:
-                    pass
-
-    def _on_server_connected(self):
-        """Se llama cuando un cliente se conecta al servidor"""
-        self.connected = True
-        self.update_status("Servidor: Cliente conectado")
-        toast("¡Cliente conectado!")
-
-        # Iniciar hilo de recepción (el servidor recibe archivos)
-        self.connected_thread = threading.Thread(
-            target=self._receive_file_thread, daemon=True)
-        self.connected_thread.start()
-
-    def stop_server(self):
-        """Detiene el servidor y cierra sockets"""
-        self.is_server = False
-        self.connected = False
-        self.screen.ids.btn_stop_server.disabled = True
-        self.screen.ids.btn_server.md_bg_color = self.theme_cls.primary_color
-
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
-            self.server_socket = None
-
-        if self.client_socket:
-            try:
-                self.client_socket.close()
-            except:
-                pass
-            self.client_socket = None
-
-        self.update_status("Servidor detenido")
-
-    # -------------------------------------------------------------------------
-    # MODO CLIENTE
-    # -------------------------------------------------------------------------
-    def start_client_mode(self):
-        """Activa modo cliente: permite escanear y conectarse"""
-        if not self.bluetooth_adapter:
-            toast("Bluetooth no disponible")
-            return
-
-        self.is_client = True
-        self.is_server = False
-        self.screen.ids.btn_client.md_bg_color = "green"
-        self.screen.ids.btn_server.md_bg_color = self.theme_cls.primary_color
-        self.screen.ids.btn_stop_server.disabled = True  # No aplica en cliente
-        self.screen.ids.btn_select_file.disabled = False
-        self.screen.ids.btn_scan.disabled = False  # Habilitar escaneo
-        self.screen.ids.device_list.clear_widgets()
-
-        self.update_status("Cliente: Busca dispositivos")
-        toast("Modo cliente activado")
-
-    def scan_devices(self):
-        """Escanea y muestra dispositivos emparejados"""
-        if not self.is_client:
-            toast("Activa modo cliente primero")
-            return
-
-        if not self.bluetooth_adapter:
-            return
-
-        # Verificar permisos según API (opcional pero recomendado)
-        if platform == 'android':
-            if api_version >= 31:
-                if not check_permission(Permission.BLUETOOTH_CONNECT):
-                    toast("Permiso BLUETOOTH_CONNECT no concedido")
-                    self.request_permissions()
-                    return
-            else:
-                if not check_permission(Permission.BLUETOOTH):
-                    toast("Permiso BLUETOOTH no concedido")
-                    self.request_permissions()
-                    return
-
-        self.update_status("Escaneando...")
-        self.screen.ids.device_list.clear_widgets()
-
-        try:
-            # Cancelar descubrimiento si está activo
-            self.bluetooth_adapter.cancelDiscovery()
-
-            # Obtener dispositivos emparejados
-            bonded_devices = self.bluetooth_adapter.getBondedDevices()
-            if bonded_devices:
-                devices_array = bonded_devices.toArray()
-                for device in devices_array:
-                    name = device.getName()
-                    mac = device.getAddress()
-                    item = TwoLineListItem(
-                        text=name if name else "Sin nombre",
-                        secondary_text=mac,
-                        on_release=lambda x, d=device: self.connect_to_device(d)
-                    )
-                    self.screen.ids.device_list.add_widget(item)
-
-                self.update_status(f"{len(devices_array)} dispositivos encontrados")
-            else:
-                self.update_status("No hay dispositivos emparejados")
-
-        except Exception as e:
-            toast(f"Error al escanear: {str(e)}")
-            traceback.print_exc()
-
-    def connect_to_device(self, device):
-        """Intenta conectar a un dispositivo seleccionado"""
-        if not self.is_client:
-            return
-
-        self.selected_device_mac = device.getAddress()
-        self.selected_device_name = device.getName() or "Desconocido"
-
-        self.update_status(f"Conectando a {self.selected_device_name}...")
-        threading.Thread(target=self._connect_thread, args=(device,), daemon=True).start()
-
-    def _connect_thread(self, device):
-        """Hilo de conexión del cliente"""
-        try:
-            UUID = autoclass('java.util.UUID')
-            uuid = UUID.fromString(UUID_SPP)
-
-            # Cancelar descubrimiento
-            self.bluetooth_adapter.cancelDiscovery()
-
-            # Crear socket
-            socket = device.createRfcommSocketToServiceRecord(uuid)
-            socket.connect()
-
-            self.client_socket = socket
-
-            Clock.schedule_once(lambda dt: self._on_client_connected())
-
-        except Exception as e:
-            error_msg = f"Error al conectar: {str(e)}"
-            Clock.schedule_once(lambda dt: toast(error_msg))
-            traceback.print_exc()
-
-    def _on_client_connected(self):
-        """Se llama cuando el cliente se conecta exitosamente"""
-        self.connected = True
-        self.update_status(f"Conectado a {self.selected_device_name}")
-        toast("¡Conectado!")
-
-        # Habilitar botón de enviar
-        self.screen.ids.btn_send.disabled = False
-
-        # El cliente no inicia hilo de recepción porque solo envía archivos.
-        # Si se quisiera comunicación bidireccional, habría que iniciarlo.
-
-    # -------------------------------------------------------------------------
-    # SELECCIÓN DE ARCHIVO (Cliente)
-    # -------------------------------------------------------------------------
-    def select_file(self):
-        """Abre el selector de archivos nativo"""
-        if not self.is_client:
-            toast("Activa modo cliente primero")
-            return
-
-        try:
-            filechooser.open_file(on_selection=self._on_file_selected)
-        except Exception as e:
-            toast(f"Error al abrir selector: {str(e)}")
-
-    def _on_file_selected(self, selection):
-        if selection and len(selection) > 0:
-            self.selected_file = selection[0]
-            file_name = os.path.basename(str(self.selected_file))
-            Clock.schedule_once(lambda dt: setattr(
-                self.screen.ids.file_label, 'text', f"Archivo: {file_name}"))
-            toast("Archivo seleccionado")
-
-            # Si ya estamos conectados, habilitar envío
-            if self.connected and self.is_client:
-                self.screen.ids.btn_send.disabled = False
-
-    # -------------------------------------------------------------------------
-    # ENVÍO DE ARCHIVO (Cliente)
-    # -------------------------------------------------------------------------
-    def start_sending(self):
-        """Inicia el envío del archivo en un hilo separado"""
-        if not self.connected:
-            toast("No hay conexión")
-            return
-
-        if not self.selected_file:
-            toast("Selecciona un archivo primero")
-            return
-
-        if not self.client_socket:
-            toast("Socket no disponible")
-            return
-
-        self.update_status("Enviando archivo...")
-        self.screen.ids.btn_send.disabled = True
-        threading.Thread(target=self._send_file_thread, daemon=True).start()
-
-    def _send_file_thread(self):
-        """Hilo que envía el archivo por el OutputStream"""
-        try:
-            output_stream = self.client_socket.getOutputStream()
-            file_size = os.path.getsize(self.selected_file)
-            sent_bytes = 0
-
-            with open(self.selected_file, "rb") as f:
-                while True:
-                    chunk = f.read(CHUNK_SIZE)
-                    if not chunk:
-                        break
-                    output_stream.write(chunk)
-                    output_stream.flush()
-                    sent_bytes += len(chunk)
-                    # Actualizar progreso (opcional)
-                    if sent_bytes % (CHUNK_SIZE * 100) == 0:
-                        print(f"Enviados {sent_bytes}/{file_size} bytes")
-
-            Clock.schedule_once(lambda dt: self._on_send_complete())
-
-        except Exception as e:
-            error_msg = f"Error al enviar: {str(e)}"
-            Clock.schedule_once(lambda dt: toast(error_msg))
-            traceback.print_exc()
-            Clock.schedule_once(lambda dt: setattr(self.screen.ids.btn_send, 'disabled', False))
-
-    def _on_send_complete(self):
-        """Se llama cuando el envío termina correctamente"""
-        self.update_status("Archivo enviado con éxito")
-        toast("¡Envío completado!")
-        self.screen.ids.btn_send.disabled = False
-
-    # -------------------------------------------------------------------------
-    # RECEPCIÓN DE ARCHIVO (Solo para el servidor)
-    # -------------------------------------------------------------------------
-    def _receive_file_thread(self):
-        """Hilo que escucha datos entrantes (para servidor)"""
-        if not self.client_socket:
-            return
-
-        try:
-            input_stream = self.client_socket.getInputStream()
-            buffer = bytearray(CHUNK_SIZE)
-
-            # Determinar ruta de guardado (directorio de Descargas)
-            # Usamos getExternalFilesDir para no requerir permisos extra
-            if platform == 'android':
-                from android.os import Environment
-                from jnius import autoclass
-                PythonActivity = autoclass('org.kivy.android.PythonActivity')
-                context = PythonActivity.mActivity
-                # Directorio privado de la app en almacenamiento externo
-                files_dir = context.getExternalFilesDir(None).getAbsolutePath()
-                # Si prefieres Descargas (requiere permiso WRITE_EXTERNAL_STORAGE), usa:
-                # downloads_path = Environment.getExternalStoragePublicDirectory(Environment.DIRECTORY_DOWNLOADS).getAbsolutePath()
-                # received_file_path = os.path.join(downloads_path, f"recibido_{timestamp}.bin")
-            else:
-                files_dir = "."  # directorio actual en PC
-
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            received_file_path = os.path.join(files_dir, f"recibido_{timestamp}.bin")
-
-            with open(received_file_path, "wb") as f:
-                while True:
-                    bytes_read = input_stream.read(buffer)
-                    if bytes_read <= 0:
-                        break
-                    f.write(buffer[:bytes_read])
-
-            Clock.schedule_once(lambda dt: self._on_receive_complete(received_file_path))
-
-        except Exception as e:
-            print(f"Error en recepción: {str(e)}")
-            traceback.print_exc()
-
-    def _on_receive_complete(self, file_path):
-        """Se llama cuando se recibe un archivo completamente"""
-        file_name = os.path.basename(file_path)
-        self.update_status(f"Archivo recibido: {file_name}")
-        toast(f"Archivo guardado en {file_name}")
-        # Podrías abrir el archivo con un Intent aquí
-
-# =============================================================================
-# PUNTO DE ENTRADA
-# =============================================================================
-if __name__ == '__main__':
-    AplicacionBluetoothDirecto().run()
+"""
+APLICACIÓN BLUETOOTH CLIENTE/SERVIDOR PARA ANDROID
+Envío y recepción de archivos por RFCOMM
+Versión mejorada con lista de dispositivos vinculados y transferencia funcional
+"""
+import os
+import time
+import traceback
+
+from startup import startup_timer  # Primero, para medir también las importaciones
+
+from kivy.lang import Builder
+from kivy.clock import Clock
+from kivy.utils import platform
+from kivymd.app import MDApp
+from kivymd.toast import toast
+# Los widgets del KV se resuelven por Factory al cargarlo; diálogos y elementos
+# de lista se importan solo cuando hacen falta. Lo mismo el motor de
+# transferencia (asyncio, json, hashlib...): se importa tras el primer frame
+# (_init_engine) o en el primer uso, nunca antes de pintar
+
+# =============================================================================
+# IMPORTACIONES ESPECÍFICAS DE ANDROID
+# =============================================================================
+if platform == 'android':
+    from android.permissions import request_permissions, Permission, check_permission
+    from android import api_version
+    from plyer import filechooser
+    from jnius import cast, JavaException
+else:
+    # Simulación para pruebas en PC
+    def request_permissions(*args, **kwargs):
+        print("[Simulación] Permisos solicitados")
+
+    class Permission:
+        READ_EXTERNAL_STORAGE = "dummy"
+        READ_MEDIA_IMAGES = "dummy"
+        READ_MEDIA_VIDEO = "dummy"
+        READ_MEDIA_AUDIO = "dummy"
+        BLUETOOTH_CONNECT = "dummy"
+        BLUETOOTH_SCAN = "dummy"
+        ACCESS_FINE_LOCATION = "dummy"
+        ACCESS_COARSE_LOCATION = "dummy"
+
+    from plyer import filechooser
+
+startup_timer.mark("importaciones")
+
+# =============================================================================
+# INTERFAZ DE USUARIO (KV)
+# =============================================================================
+KV = '''
+MDScreen:
+    MDBoxLayout:
+        orientation: "vertical"
+        spacing: "10dp"
+        padding: "10dp"
+
+        MDTopAppBar:
+            title: "Bluetooth Directo"
+            elevation: 4
+            md_bg_color: app.theme_cls.primary_color
+            left_action_items: [["menu", lambda x: app.open_menu(x)]]
+
+        MDLabel:
+            id: status_label
+            text: "Desconectado"
+            halign: "center"
+            theme_text_color: "Secondary"
+            size_hint_y: None
+            height: "40dp"
+
+        MDBoxLayout:
+            size_hint_y: None
+            height: "60dp"
+            spacing: "10dp"
+
+            MDRaisedButton:
+                id: btn_server
+                text: "MODO SERVIDOR"
+                on_release: app.start_server_mode()
+                md_bg_color: app.theme_cls.primary_color
+                disabled: True
+
+            MDRaisedButton:
+                id: btn_client
+                text: "MODO CLIENTE"
+                on_release: app.start_client_mode()
+                md_bg_color: app.theme_cls.primary_color
+                disabled: True
+
+        # Lista virtualizada: solo existen los widgets de las filas visibles
+        RecycleView:
+            id: device_list
+            viewclass: "TwoLineListItem"
+            RecycleBoxLayout:
+                default_size: None, dp(72)
+                default_size_hint: 1, None
+                size_hint_y: None
+                height: self.minimum_height
+                orientation: "vertical"
+
+        MDCard:
+            orientation: "vertical"
+            size_hint: 1, None
+            height: "180dp"
+            padding: "10dp"
+            spacing: "10dp"
+            elevation: 3
+
+            MDLabel:
+                id: file_label
+                text: "Ningún archivo seleccionado"
+                halign: "center"
+                theme_text_color: "Hint"
+
+            MDBoxLayout:
+                orientation: "horizontal"
+                spacing: "10dp"
+                size_hint_x: None
+                width: self.minimum_width
+                pos_hint: {"center_x": 0.5}
+
+                MDRectangleFlatButton:
+                    id: btn_select_file
+                    text: "ARCHIVOS"
+                    on_release: app.select_file()
+                    disabled: True
+
+                MDRectangleFlatButton:
+                    id: btn_select_dir
+                    text: "CARPETA"
+                    on_release: app.select_directory()
+                    disabled: True
+
+                MDRaisedButton:
+                    id: btn_send
+                    text: "ENVIAR"
+                    on_release: app.start_sending()
+                    disabled: True
+
+        MDBoxLayout:
+            size_hint_y: None
+            height: "50dp"
+            spacing: "10dp"
+            padding: "10dp"
+
+            MDRectangleFlatButton:
+                id: btn_scan
+                text: "ESCANEAR"
+                on_release: app.scan_devices()
+                disabled: True
+
+            MDRectangleFlatButton:
+                id: btn_stop_server
+                text: "DETENER SERVIDOR"
+                on_release: app.stop_server()
+                disabled: True
+                md_bg_color: "red"
+'''
+
+# =============================================================================
+# CLASE PRINCIPAL DE LA APLICACIÓN
+# =============================================================================
+class AplicacionBluetoothDirecto(MDApp):
+    def build(self):
+        self.theme_cls.primary_palette = "Blue"
+        self.screen = Builder.load_string(KV)
+        startup_timer.mark("carga_kv")
+        self.device_list_widget = self.screen.ids.device_list
+        # Dispositivos por MAC; las filas de la lista se actualizan por diferencias
+        # (la caché se crea con el motor, tras el primer frame)
+        self.device_cache = None
+        self.discovery = None
+        self._device_rows = {}
+
+        # Variables de estado
+        self.is_server = False
+        self.is_client = False
+        self.connected = False
+        self.selected_files = []
+        self.selected_device_mac = None
+        self.selected_device_name = None
+
+        # Objetos Bluetooth (inicializados en Android)
+        self.bluetooth_adapter = None
+        self.session_server = None
+        # Bucle de E/S único: servidor, conexiones y sesiones entrantes son
+        # tareas suyas que se cancelan de verdad (ver iocore.py); se crea con el motor
+        self.io = None
+        self.server_task = None
+        # Conexiones de cliente persistentes por MAC (se crea con el adaptador)
+        self.connections = None
+        self.connector = None
+        self.incoming_sessions = 0
+        # Cola persistente de envíos y su planificador (se crean con el adaptador)
+        self.transfer_queue = None
+        self.scheduler = None
+
+        # Para UI
+        self.dialog = None
+        self.menu = None
+        # Trazas JSON por líneas; se activan desde el menú (o con BTD_TRACE)
+        self.trace_path = None
+        # Progreso agrupado: como mucho una actualización de la UI por intervalo
+        self.progress = None
+
+        if platform != 'android':
+            self.update_status("MODO PC - Simulación")
+
+        startup_timer.mark("construccion")
+        return self.screen
+
+    def on_start(self):
+        # Los permisos se piden tras el primer frame para no retrasar la primera pintura
+        Clock.schedule_once(self._on_first_frame)
+
+    def _on_first_frame(self, dt):
+        startup_timer.mark("primer_frame")
+        self._init_engine()
+        print(startup_timer.report())
+        if platform == 'android':
+            self.request_permissions()
+
+    def _init_engine(self):
+        """Importa y arranca lo que la app necesita ya pintada: trazas, bucle de E/S,
+        progreso y caché de dispositivos"""
+        import tracing
+        from discovery import DeviceCache
+        from iocore import IOCore
+        from progress import ProgressReporter
+
+        self.trace_path = tracing.start_from_env()
+        self.io = IOCore().start()
+        self.progress = ProgressReporter(self._on_progress)
+        self.device_cache = DeviceCache(on_change=self._on_devices_changed)
+        startup_timer.mark("motor")
+
+    # -------------------------------------------------------------------------
+    # MANEJO DE PERMISOS
+    # -------------------------------------------------------------------------
+    def request_permissions(self):
+        """Solicita todos los permisos necesarios según la versión de Android"""
+        permissions = [
+            Permission.READ_EXTERNAL_STORAGE,
+            Permission.READ_MEDIA_IMAGES,
+            Permission.READ_MEDIA_VIDEO,
+            Permission.READ_MEDIA_AUDIO,
+        ]
+
+        # Permisos de Bluetooth según API level
+        if api_version >= 31:  # Android 12+
+            permissions.extend([
+                Permission.BLUETOOTH_CONNECT,
+                Permission.BLUETOOTH_SCAN,
+            ])
+            # No es obligatorio, pero por compatibilidad
+            permissions.append(Permission.ACCESS_FINE_LOCATION)
+        else:
+            # Android 11 y anteriores
+            permissions.extend([
+                Permission.BLUETOOTH,
+                Permission.BLUETOOTH_ADMIN,
+                Permission.ACCESS_FINE_LOCATION,
+                Permission.ACCESS_COARSE_LOCATION,
+            ])
+
+        request_permissions(permissions, self.on_permissions_result)
+
+    def on_permissions_result(self, permissions, results):
+        if all(results):
+            self.update_status("Permisos concedidos")
+            self.init_bluetooth()
+        else:
+            toast("Faltan permisos necesarios. Revisa ajustes.")
+
+    # -------------------------------------------------------------------------
+    # INICIALIZACIÓN DE BLUETOOTH
+    # -------------------------------------------------------------------------
+    def init_bluetooth(self):
+        """Inicializa el adaptador Bluetooth de Android"""
+        import tracing
+        import transport
+        from connection import AndroidConnector, ConnectionManager
+        from dedup import HASH_CACHE_FILE, HashCache
+        from mux import MuxConnector
+        from scheduler import QUEUE_FILE, Scheduler, TransferQueue
+
+        try:
+            with tracing.span("app.init_bluetooth"):
+                self.bluetooth_adapter = transport.android_adapter()
+
+                if not self.bluetooth_adapter:
+                    toast("Este dispositivo no soporta Bluetooth")
+                    return
+
+                if not self.bluetooth_adapter.isEnabled():
+                    # Intentar encender Bluetooth
+                    self.bluetooth_adapter.enable()
+                    toast("Activando Bluetooth...")
+
+                # Un único socket por MAC; cada envío abre su sesión (par de canales)
+                # y el receptor puede abrir las suyas hacia nosotros por la misma conexión
+                self.connector = MuxConnector(AndroidConnector(self.bluetooth_adapter),
+                                              on_channel=self._on_incoming_channel,
+                                              on_message=self._on_message)
+                self.connections = ConnectionManager(
+                    self.connector,
+                    on_state=lambda address, state: Clock.schedule_once(
+                        lambda dt: self._on_connection_state(address, state)))
+                # Lo que quedó pendiente en una ejecución anterior se retoma solo
+                self.transfer_queue = TransferQueue(
+                    os.path.join(self.user_data_dir, QUEUE_FILE),
+                    on_change=lambda item: Clock.schedule_once(
+                        lambda dt: self._on_queue_change(item)))
+                # Resúmenes de los archivos ya ofrecidos: no se recalculan si no cambian
+                self.scheduler = Scheduler(
+                    self.transfer_queue, self.connections, progress=self.progress,
+                    hashes=HashCache(os.path.join(self.user_data_dir, HASH_CACHE_FILE))).start()
+
+            self.update_status("Bluetooth listo")
+            # Habilitar botones según modo
+            self.screen.ids.btn_server.disabled = False
+            self.screen.ids.btn_client.disabled = False
+            # Incluye el tiempo que el usuario tarda en conceder los permisos
+            startup_timer.mark("bluetooth")
+            print(startup_timer.report())
+            tracing.event("app.startup", phases=startup_timer.phases)
+
+        except Exception as e:
+            toast(f"Error al iniciar Bluetooth: {str(e)}")
+
+    # -------------------------------------------------------------------------
+    # UTILIDADES DE UI
+    # -------------------------------------------------------------------------
+    def update_status(self, text):
+        Clock.schedule_once(lambda dt: setattr(self.screen.ids.status_label, 'text', text))
+
+    def show_dialog(self, title, text):
+        if not self.dialog:
+            from kivymd.uix.button import MDFlatButton
+            from kivymd.uix.dialog import MDDialog
+            self.dialog = MDDialog(
+                title=title,
+                text=text,
+                buttons=[MDFlatButton(text="OK", on_release=lambda x: self.dialog.dismiss())]
+            )
+        else:
+            self.dialog.title = title
+            self.dialog.text = text
+        self.dialog.open()
+
+    def open_menu(self, caller):
+        """Menú de la barra superior: difusión y trazas para diagnosticar envíos lentos"""
+        from kivymd.uix.menu import MDDropdownMenu
+        import tracing
+
+        items = []
+        if self.is_client and self.connections and len(self.connections.addresses()) > 1:
+            items.append(("Enviar a todos los conectados", self.start_broadcast))
+        if tracing.enabled():
+            items.append(("Desactivar trazas", lambda: self._toggle_tracing()))
+        else:
+            items += [("Activar trazas", lambda: self._toggle_tracing()),
+                      ("Trazas con perfilador", lambda: self._toggle_tracing(profile=True))]
+        if self.menu:
+            self.menu.dismiss()
+        self.menu = MDDropdownMenu(
+            caller=caller, width_mult=4,
+            items=[{"viewclass": "OneLineListItem", "text": text, "on_release": action}
+                   for text, action in items])
+        self.menu.open()
+
+    def _toggle_tracing(self, profile=False):
+        import tracing
+
+        self.menu.dismiss()
+        if tracing.enabled():
+            tracing.stop()
+            toast(f"Trazas guardadas en {os.path.basename(self.trace_path)}")
+            print(f"Trazas: {self.trace_path}")
+            return
+        self.trace_path = os.path.join(
+            self.user_data_dir, time.strftime("trazas-%Y%m%d-%H%M%S.jsonl"))
+        # Las conexiones ya abiertas no miden sus llamadas de red hasta reconectar
+        tracing.start(self.trace_path, tracing.PROFILE_INTERVAL if profile else None)
+        toast("Trazas activadas")
+
+    # -------------------------------------------------------------------------
+    # MODO SERVIDOR
+    # -------------------------------------------------------------------------
+    def start_server_mode(self):
+        """Inicia el modo servidor: espera conexiones entrantes"""
+        if not self.bluetooth_adapter:
+            toast("Bluetooth no disponible")
+            return
+
+        self.is_server = True
+        self.is_client = False
+        self.screen.ids.btn_server.md_bg_color = "green"
+        self.screen.ids.btn_client.md_bg_color = self.theme_cls.primary_color
+        self.screen.ids.btn_stop_server.disabled = False
+        self.screen.ids.btn_select_file.disabled = True  # El servidor no selecciona archivo
+        self.screen.ids.btn_select_dir.disabled = True
+        self.screen.ids.btn_scan.disabled = True  # El servidor no escanea
+
+        self.update_status("Servidor: Esperando conexión...")
+        self.server_task = self.io.submit(self._serve())
+
+    def _listen(self):
+        # Crear socket servidor (clase y UUID de Java ya en caché)
+        # Acepta clientes multiplexados (una sesión por envío) y antiguos; las
+        # conexiones multiplexadas se adoptan para enviar al cliente por ellas
+        import tracing
+        import transport
+        from mux import MuxServerSocket
+
+        with tracing.span("server.listen"):
+            return MuxServerSocket(transport.android_listen(self.bluetooth_adapter),
+                                   on_multiplexer=self.connector.adopt if self.connector else None,
+                                   on_message=self._on_message)
+
+    async def _serve(self):
+        """Tarea del servidor: crea el socket y acepta conexiones hasta cancelarla"""
+        from server import SessionServer
+
+        try:
+            server_socket = await self.io.blocking(self._listen)
+
+            # Cada cliente aceptado se atiende en su propia sesión; el socket
+            # servidor es de la tarea y stop_server() la cancela
+            self.session_server = SessionServer(
+                server_socket, self._receive_dir(), core=self.io,
+                on_file=lambda session, path, header: Clock.schedule_once(
+                    lambda dt: self._on_receive_complete(path)),
+                on_session_start=self._on_session_start,
+                on_session_end=lambda session: Clock.schedule_once(
+                    lambda dt: self._on_session_end(session)))
+            await self.session_server.serve()
+
+        except Exception as e:
+            error_msg = f"Error en servidor: {str(e)}"
+            Clock.schedule_once(lambda dt: toast(error_msg))
+            traceback.print_exc()
+
+    def _on_session_start(self, session):
+        # Hilo de la sesión: el medidor se registra antes de recibir nada
+        self.progress.add(session.meter)
+        Clock.schedule_once(lambda dt: self._on_server_connected(session))
+
+    def _on_server_connected(self, session):
+        """Se llama cuando un cliente se conecta al servidor"""
+        self.connected = True
+        self._update_server_status()
+        toast(f"¡Cliente conectado! ({session.peer or 'desconocido'})")
+
+    def _on_session_end(self, session):
+        """Se llama cuando termina la sesión de un cliente"""
+        stats = session.stats
+        print(f"Sesión {stats['id']} terminada: {stats}")
+        self._update_server_status()
+
+    def _update_server_status(self):
+        if not self.session_server or not self.is_server:
+            return
+        active = self.session_server.active_count
+        self.connected = active > 0
+        if active:
+            self.update_status(f"Servidor: {active} clientes conectados")
+        else:
+            self.update_status("Servidor: Esperando conexión...")
+
+    def stop_server(self):
+        """Detiene el servidor y cierra sockets"""
+        self.is_server = False
+        self.connected = False
+        self.screen.ids.btn_stop_server.disabled = True
+        self.screen.ids.btn_server.md_bg_color = self.theme_cls.primary_color
+
+        # Cancela accept() y las sesiones activas cerrando sus sockets
+        if self.session_server:
+            self.session_server.stop()
+            self.session_server = None
+        if self.server_task:
+            self.server_task.cancel()
+            self.server_task = None
+
+        self.update_status("Servidor detenido")
+
+    # -------------------------------------------------------------------------
+    # MODO CLIENTE
+    # -------------------------------------------------------------------------
+    def start_client_mode(self):
+        """Activa modo cliente: permite escanear y conectarse"""
+        if not self.bluetooth_adapter:
+            toast("Bluetooth no disponible")
+            return
+
+        self.is_client = True
+        self.is_server = False
+        self.screen.ids.btn_client.md_bg_color = "green"
+        self.screen.ids.btn_server.md_bg_color = self.theme_cls.primary_color
+        self.screen.ids.btn_stop_server.disabled = True  # No aplica en cliente
+        self.screen.ids.btn_select_file.disabled = False
+        self.screen.ids.btn_select_dir.disabled = False
+        self.screen.ids.btn_scan.disabled = False  # Habilitar escaneo
+
+        self.update_status("Cliente: Busca dispositivos")
+        toast("Modo cliente activado")
+
+    def scan_devices(self):
+        """Lanza el descubrimiento en segundo plano; la lista se actualiza sola"""
+        if not self.is_client:
+            toast("Activa modo cliente primero")
+            return
+
+        if not self.bluetooth_adapter:
+            return
+
+        # Verificar permisos según API (opcional pero recomendado)
+        if platform == 'android':
+            if api_version >= 31:
+                if not (check_permission(Permission.BLUETOOTH_CONNECT)
+                        and check_permission(Permission.BLUETOOTH_SCAN)):
+                    toast("Permisos BLUETOOTH_CONNECT/SCAN no concedidos")
+                    self.request_permissions()
+                    return
+            else:
+                if not check_permission(Permission.BLUETOOTH):
+                    toast("Permiso BLUETOOTH no concedido")
+                    self.request_permissions()
+                    return
+
+        if self.discovery and self.discovery.running:
+            toast("Ya se está escaneando")
+            return
+
+        from discovery import AndroidDiscovery
+
+        self.update_status("Escaneando...")
+        self.discovery = AndroidDiscovery(
+            self.bluetooth_adapter, self.device_cache,
+            on_finished=lambda discovery: Clock.schedule_once(
+                lambda dt: self._on_scan_finished(discovery)))
+        self.discovery.start()
+
+    def _on_scan_finished(self, discovery):
+        # Si se paró al elegir dispositivo, el estado ya muestra la conexión
+        if discovery is self.discovery:
+            self.update_status(f"{len(self._device_rows)} dispositivos encontrados")
+
+    def _on_devices_changed(self):
+        # Cualquier hilo: una sola llamada por ráfaga de cambios
+        Clock.schedule_once(lambda dt: self._apply_device_changes())
+
+    def _apply_device_changes(self):
+        """Aplica a la lista solo las filas nuevas, modificadas o eliminadas"""
+        updated, removed = self.device_cache.take_changes()
+        rv = self.screen.ids.device_list
+        data = list(rv.data)
+        if removed:
+            removed = set(removed)
+            data[:] = [row for row in data if row["address"] not in removed]
+            self._device_rows = {row["address"]: i for i, row in enumerate(data)}
+        for info in updated:
+            row = self._device_row(info)
+            index = self._device_rows.get(info.address)
+            if index is None:
+                self._device_rows[info.address] = len(data)
+                data.append(row)
+            else:
+                data[index] = row
+        # Una sola asignación: la RecycleView recalcula una vez por lote
+        rv.data = data
+
+        if self.discovery and self.discovery.running:
+            self.update_status(f"{len(data)} dispositivos (escaneando...)")
+
+    def _device_row(self, info):
+        details = [info.address]
+        if info.bonded:
+            details.append("emparejado")
+        if info.rssi is not None:
+            details.append(f"{info.rssi} dBm")
+        if info.connect_latency is not None:
+            details.append(f"conexión {info.connect_latency * 1000:.0f} ms")
+        return {
+            "address": info.address,
+            "text": info.name or "Sin nombre",
+            "secondary_text": " · ".join(details),
+            "on_release": lambda address=info.address: self._on_device_selected(address),
+        }
+
+    def _on_device_selected(self, address):
+        discovery, self.discovery = self.discovery, None
+        if discovery:
+            discovery.stop()
+        self.connect_to_device(self.bluetooth_adapter.getRemoteDevice(address))
+
+    def connect_to_device(self, device):
+        """Intenta conectar a un dispositivo seleccionado"""
+        if not self.is_client:
+            return
+
+        self.selected_device_mac = device.getAddress()
+        self.selected_device_name = device.getName() or "Desconocido"
+
+        self.update_status(f"Conectando a {self.selected_device_name}...")
+        self.io.submit(self._connect(device.getAddress()))
+
+    def _open_connection(self, address):
+        import tracing
+
+        with tracing.span("app.connect", address=address):
+            return self.connections.connect(address)
+
+    async def _connect(self, address):
+        """Tarea de conexión del cliente; una conexión viva con ese MAC se reutiliza"""
+        from connection import CONNECT_TIMEOUT
+
+        try:
+            conn = await self.io.blocking(self._open_connection, address,
+                                          timeout=CONNECT_TIMEOUT)
+            timings = conn.timings
+            print(f"Conexión con {address}: {timings}")
+            self.device_cache.record_connect(address, timings["connect"])
+            Clock.schedule_once(lambda dt: self._on_client_connected())
+
+        except Exception as e:
+            error_msg = f"Error al conectar: {str(e)}"
+            Clock.schedule_once(lambda dt: toast(error_msg))
+            traceback.print_exc()
+
+    def _on_connection_state(self, address, state):
+        """Cambios de la conexión gestionada (caídas y reconexiones automáticas)"""
+        if address != self.selected_device_mac or not self.is_client:
+            return
+        if state == "reconectando":
+            self.update_status(f"Reconectando con {self.selected_device_name}...")
+        elif state == "desconectado":
+            self.connected = False
+            self.screen.ids.btn_send.disabled = True
+            self.update_status(f"Conexión perdida con {self.selected_device_name}")
+        elif state == "conectado" and self.connected:
+            self.update_status(f"Conectado a {self.selected_device_name}")
+
+    def _on_client_connected(self):
+        """Se llama cuando el cliente se conecta exitosamente"""
+        self.connected = True
+        self.update_status(f"Conectado a {self.selected_device_name}")
+        toast("¡Conectado!")
+
+        # Habilitar botón de enviar
+        self.screen.ids.btn_send.disabled = False
+
+        # La recepción en el cliente llega por canales que abre el otro
+        # extremo sobre la misma conexión (_on_incoming_channel)
+
+    def _on_incoming_channel(self, channel):
+        """Sesión (par de canales) abierta por el par: se atiende como una recepción"""
+        from server import ReceiveSession
+
+        self.incoming_sessions += 1
+        session = ReceiveSession(
+            f"entrante {self.incoming_sessions}", channel, self._receive_dir(),
+            on_file=lambda session, path, header: Clock.schedule_once(
+                lambda dt: self._on_receive_complete(path)))
+        self.progress.add(session.meter)
+        self.io.submit(self.io.blocking(session.run, on_cancel=session.cancel))
+
+    def _on_message(self, address, message):
+        """Mensaje corto del par (hilo del multiplexor)"""
+        from progress import format_bytes
+
+        if message.get("tipo") != "envio":
+            print(f"Mensaje de {address}: {message}")
+            return
+        self.update_status(f"{message.get('archivos', 0)} archivos "
+                           f"({format_bytes(message.get('bytes', 0))}) en camino desde {address}")
+
+    # -------------------------------------------------------------------------
+    # SELECCIÓN DE ARCHIVOS (Cliente)
+    # -------------------------------------------------------------------------
+    def select_file(self):
+        """Abre el selector de archivos nativo (selección múltiple)"""
+        if not self.is_client:
+            toast("Activa modo cliente primero")
+            return
+
+        try:
+            filechooser.open_file(on_selection=self._on_file_selected, multiple=True)
+        except Exception as e:
+            toast(f"Error al abrir selector: {str(e)}")
+
+    def select_directory(self):
+        """Abre el selector de carpetas para enviar un directorio entero"""
+        if not self.is_client:
+            toast("Activa modo cliente primero")
+            return
+
+        try:
+            filechooser.choose_dir(on_selection=self._on_file_selected)
+        except Exception as e:
+            toast(f"Selector de carpetas no disponible: {str(e)}")
+
+    def _on_file_selected(self, selection):
+        from batch import expand_selection
+
+        if selection and len(selection) > 0:
+            self.selected_files = expand_selection(selection)
+            count = len(self.selected_files)
+            if count == 1:
+                text = f"Archivo: {self.selected_files[0][1]}"
+            else:
+                text = f"{count} archivos seleccionados"
+            Clock.schedule_once(lambda dt: setattr(
+                self.screen.ids.file_label, 'text', text))
+            toast(text)
+
+            # Si ya estamos conectados, habilitar envío
+            if self.connected and self.is_client:
+                self.screen.ids.btn_send.disabled = False
+
+    # -------------------------------------------------------------------------
+    # ENVÍO DE ARCHIVOS (Cliente)
+    # -------------------------------------------------------------------------
+    def start_sending(self):
+        """Encola los archivos seleccionados; el planificador los envía por su cuenta"""
+        if not self.connected:
+            toast("No hay conexión")
+            return
+
+        if not self.selected_files:
+            toast("Selecciona un archivo primero")
+            return
+
+        # El botón sigue activo: se puede encolar más mientras se envía
+        items = self.transfer_queue.add(self.selected_files, self.selected_device_mac)
+        self.scheduler.wake()
+        self._announce_sending(items)
+        self.update_status(f"{len(items)} archivos en cola para {self.selected_device_name}")
+
+    def _announce_sending(self, items):
+        """Avisa al receptor de lo que le va a llegar, aunque haya un envío en curso"""
+        # Por el canal de mensajes: adelanta a los datos de archivo ya en marcha
+        try:
+            self.connector.send_message(self.selected_device_mac, {
+                "tipo": "envio",
+                "archivos": len(items),
+                "bytes": sum(item.size or 0 for item in items),
+            })
+        except OSError:
+            pass  # Receptor sin multiplexación: el aviso es opcional
+
+    def start_broadcast(self):
+        """Envía la selección a la vez a todos los pares con conexión viva"""
+        self.menu.dismiss()
+        if not self.selected_files:
+            toast("Selecciona un archivo primero")
+            return
+        addresses = self.connections.addresses()
+        self.update_status(f"Difundiendo {len(self.selected_files)} archivos a "
+                           f"{len(addresses)} dispositivos...")
+        self.io.submit(self._broadcast(addresses, list(self.selected_files)))
+
+    async def _broadcast(self, addresses, entries):
+        """Tarea de difusión: cada archivo se lee una vez para todos los pares"""
+        from broadcast import Broadcast
+
+        meters = {address: self.progress.track(f"difusión {address}")
+                  for address in addresses}
+        results = await Broadcast(
+            self.connections, addresses, entries,
+            on_progress=lambda address, sent, total: meters[address].update(sent, total)
+        ).run_async(self.io)
+        for address, result in results.items():
+            meters[address].finish(result["error"])
+        failed = [address for address, result in results.items() if result["error"]]
+        if failed:
+            message = f"Difusión terminada; fallaron {len(failed)} de {len(results)}"
+        else:
+            message = f"Difusión completada a {len(results)} dispositivos"
+        Clock.schedule_once(lambda dt: self.update_status(message))
+        Clock.schedule_once(lambda dt: toast(message))
+
+    def _on_progress(self, snapshots):
+        """Hilo del informador: una sola llamada a la UI con todas las transferencias"""
+        from progress import format_progress
+
+        self.update_status("\n".join(format_progress(s) for s in snapshots))
+
+    def _on_queue_change(self, item):
+        """Cada cambio de estado de una entrada de la cola (hilo de la UI)"""
+        from scheduler import STATE_DONE, STATE_FAILED, STATE_PENDING, STATE_SENDING
+
+        if item.state == STATE_FAILED:
+            print(f"No se pudo enviar {item.path}: {item.error}")
+        if item.state not in (STATE_DONE, STATE_FAILED):
+            return
+        counts = self.transfer_queue.counts()
+        if counts[STATE_PENDING] or counts[STATE_SENDING]:
+            return
+        if counts[STATE_FAILED]:
+            self.update_status(f"Cola vacía; {counts[STATE_FAILED]} archivos fallidos")
+        else:
+            self.update_status("Archivos enviados con éxito")
+        toast("¡Envío completado!")
+
+    # -------------------------------------------------------------------------
+    # RECEPCIÓN DE ARCHIVOS (Solo para el servidor)
+    # -------------------------------------------------------------------------
+    def _receive_dir(self):
+        """Determina la ruta de guardado de los archivos recibidos"""
+        # Usamos getExternalFilesDir para no requerir permisos extra
+        if platform == 'android':
+            import transport
+            PythonActivity = transport.java_class('org.kivy.android.PythonActivity')
+            context = PythonActivity.mActivity
+            # Directorio privado de la app en almacenamiento externo.
+            # Si prefieres Descargas (requiere permiso WRITE_EXTERNAL_STORAGE), usa:
+            # Environment.getExternalStoragePublicDirectory(Environment.DIRECTORY_DOWNLOADS)
+            return context.getExternalFilesDir(None).getAbsolutePath()
+        return "."  # directorio actual en PC
+
+    def _on_receive_complete(self, file_path):
+        """Se llama cuando se recibe un archivo completamente"""
+        file_name = os.path.basename(file_path)
+        self.update_status(f"Archivo recibido: {file_name}")
+        toast(f"Archivo guardado en {file_name}")
+        # Podrías abrir el archivo con un Intent aquí
+
+    # -------------------------------------------------------------------------
+    # CIERRE DE LA APLICACIÓN
+    # -------------------------------------------------------------------------
+    def on_stop(self):
+        """Cierra la sesión de forma ordenada al salir"""
+        if self.scheduler:
+            self.scheduler.stop()
+        if self.progress:
+            self.progress.stop()
+        if self.session_server:
+            self.session_server.stop()
+        # Cancela lo que quede en el bucle (sesiones entrantes, conexiones)
+        if self.io:
+            self.io.stop()
+        if self.connections:
+            self.connections.close()
+        if self.connector:
+            self.connector.close()
+        if self.trace_path:
+            import tracing
+            tracing.stop()
+
+# =============================================================================
+# PUNTO DE ENTRADA
+# =============================================================================
+if __name__ == '__main__':
+    AplicacionBluetoothDirecto().run()
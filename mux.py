@@ -0,0 +1,639 @@
+"""
+MULTIPLEXACIÓN DE CANALES
+Varios canales lógicos en ambos sentidos sobre un único socket RFCOMM:
+varias sesiones de transferencia a la vez, abiertas por cualquiera de los
+dos extremos.
+
+Cada sesión es un par de canales que se comporta como un BluetoothSocket
+(getInputStream / getOutputStream / close), así que el motor de
+transferencia funciona igual que sobre el socket entero: los datos van por
+un canal masivo y las respuestas del receptor (ACCEPT, VERIFY, HAVE, firmas)
+por un canal de prioridad ACK, que no espera detrás de segmentos de archivo.
+Los mensajes cortos de la aplicación (chat, metadatos) van aparte, en un
+canal de mensajes por sentido con prioridad propia, también por delante
+de los datos (send_message / on_message).
+
+Formato:  preámbulo PREFACE en cada sentido y después segmentos
+          canal (2 bytes) | tipo (1 byte) | longitud (4 bytes) | carga útil
+Control de flujo por créditos: el emisor solo puede adelantar INITIAL_CREDIT
+bytes por canal sin que el receptor los haya leído (CREDIT devuelve lo leído).
+Planificación por prioridad estricta en segmentos de SEGMENT_SIZE, de modo
+que una respuesta o un mensaje espera como mucho un segmento de un archivo
+grande. Los segmentos de control del multiplexor (OPEN, CREDIT, CLOSE)
+adelantan a todos.
+"""
+import queue
+import struct
+import threading
+import traceback
+from collections import deque
+
+from protocol import (
+    FRAME_MESSAGE, MAX_FRAME_SIZE, READ_BUFFER_SIZE, CoalescingStream, FrameReader,
+    FrameWriter, ProtocolError, decode_json, encode_json,
+)
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+PREFACE = b"BTDMUX1\n"  # No empieza por un tipo de trama válido: se distingue de HELLO
+PREFACE_TIMEOUT = 10.0  # Segundos esperando el preámbulo del otro extremo
+
+MUX_HEADER = struct.Struct(">HBI")  # Canal, tipo, longitud
+CREDIT_ENTRY = struct.Struct(">I")
+
+MUX_OPEN = 0x01  # Apertura de canal con etiqueta y prioridad (JSON)
+MUX_DATA = 0x02
+MUX_CREDIT = 0x03  # Bytes que el receptor ya ha leído del canal
+MUX_CLOSE = 0x04  # El emisor no enviará más datos por el canal
+
+PRIORITY_ACK = 0  # Respuestas del receptor
+PRIORITY_MESSAGE = 1  # Mensajes cortos de la aplicación
+PRIORITY_BULK = 2  # Datos de archivo
+
+LABEL_FILES = "archivos"
+LABEL_REPLIES = "respuestas"  # Se entrega junto con el canal de datos que la nombra
+LABEL_MESSAGES = "mensajes"  # Lo lee el propio multiplexor y entrega a on_message
+
+MAX_MESSAGE_SIZE = 64 * 1024  # Un mensaje mayor es un archivo, no un mensaje
+
+SEGMENT_SIZE = 16 * 1024
+INITIAL_CREDIT = 256 * 1024  # Ventana de recepción por canal
+SEND_HIGH_WATER = 256 * 1024  # write() espera si el canal acumula más sin enviar
+
+
+# =============================================================================
+# CANAL
+# =============================================================================
+class Channel:
+    """Canal lógico con la interfaz de un BluetoothSocket conectado"""
+
+    def __init__(self, mux, channel_id, priority=PRIORITY_BULK, label=""):
+        self.mux = mux
+        self.channel_id = channel_id
+        self.priority = priority
+        self.label = label
+        self.send_credit = INITIAL_CREDIT
+        self.pending = 0
+        self.local_closed = False
+        self.remote_closed = False
+        self.close_sent = False
+        self._outgoing = deque()
+        self._incoming = bytearray()
+        self._unacked = 0
+
+    def getInputStream(self):
+        return self
+
+    def getOutputStream(self):
+        return self
+
+    def getRemoteDevice(self):
+        return self.mux.socket.getRemoteDevice()
+
+    def isConnected(self):
+        return self.mux.alive and not self.local_closed
+
+    # -------------------------------------------------------------------------
+    # InputStream
+    # -------------------------------------------------------------------------
+    def read(self, buffer, offset=0, length=None):
+        if length is None:
+            length = len(buffer) - offset
+        if length == 0:
+            return 0
+        cond = self.mux._cond
+        with cond:
+            while not self._incoming and not self.remote_closed and self.mux.alive:
+                cond.wait()
+            if not self._incoming:
+                return -1
+            n = min(length, len(self._incoming))
+            buffer[offset:offset + n] = self._incoming[:n]
+            del self._incoming[:n]
+            self._unacked += n
+            if self._unacked >= INITIAL_CREDIT // 2 and not self.remote_closed:
+                self.mux._queue_control(MUX_CREDIT, self.channel_id,
+                                        CREDIT_ENTRY.pack(self._unacked))
+                self._unacked = 0
+            return n
+
+    def _deliver(self, payload):
+        # Con el cerrojo tomado, desde el hilo lector
+        if len(self._incoming) + self._unacked + len(payload) > INITIAL_CREDIT:
+            raise ProtocolError(f"Canal {self.channel_id} excede su crédito")
+        self._incoming += payload
+
+    # -------------------------------------------------------------------------
+    # OutputStream
+    # -------------------------------------------------------------------------
+    def write(self, data):
+        cond = self.mux._cond
+        with cond:
+            if self.local_closed or not self.mux.alive:
+                raise OSError(f"Canal {self.channel_id} cerrado")
+            if not len(data):
+                return
+            self._outgoing.append(memoryview(bytes(data)))
+            self.pending += len(data)
+            cond.notify_all()
+            while self.pending > SEND_HIGH_WATER and self.mux.alive and not self.local_closed:
+                cond.wait()
+            if not self.mux.alive:
+                raise OSError("Conexión multiplexada cerrada")
+
+    def flush(self):
+        # El hilo escritor hace flush en cuanto no quedan segmentos listos
+        pass
+
+    def close(self):
+        """Lo ya escrito se envía y después va CLOSE; las lecturas pendientes terminan"""
+        with self.mux._cond:
+            if self.local_closed:
+                return
+            self.local_closed = True
+            self.remote_closed = self.remote_closed or not self.mux.alive
+            self.mux._cond.notify_all()
+
+    def _take_segment(self):
+        # Con el cerrojo tomado: hasta SEGMENT_SIZE bytes dentro del crédito
+        size = min(SEGMENT_SIZE, self.send_credit)
+        head = self._outgoing[0]
+        if len(head) <= size:
+            self._outgoing.popleft()
+            chunk = head
+        else:
+            chunk = head[:size]
+            self._outgoing[0] = head[size:]
+        self.pending -= len(chunk)
+        self.send_credit -= len(chunk)
+        return chunk
+
+
+class ChannelPair:
+    """
+    Sesión sobre dos canales con la interfaz de un BluetoothSocket: se lee
+    de `incoming` y se escribe en `outgoing`. El que la abre escribe en el
+    canal de datos y lee del de respuestas; el otro extremo, al revés.
+    """
+
+    def __init__(self, incoming, outgoing):
+        self.incoming = incoming
+        self.outgoing = outgoing
+
+    def getInputStream(self):
+        return self.incoming
+
+    def getOutputStream(self):
+        return self.outgoing
+
+    def getRemoteDevice(self):
+        return self.outgoing.getRemoteDevice()
+
+    def isConnected(self):
+        return self.incoming.isConnected() and self.outgoing.isConnected()
+
+    def close(self):
+        self.outgoing.close()
+        self.incoming.close()
+
+
+# =============================================================================
+# MULTIPLEXOR
+# =============================================================================
+class Multiplexer:
+    """
+    Reparte un socket entre canales. Un hilo lector entrega los segmentos a su
+    canal y un hilo escritor elige qué enviar según prioridad y crédito.
+    Los canales que abre el otro extremo salen por accept() o por on_channel;
+    los mensajes del otro extremo llegan a on_message(mac, mensaje) desde un
+    hilo propio.
+    """
+
+    def __init__(self, socket, initiator, on_channel=None, reader=None, on_message=None):
+        self.socket = socket
+        self.initiator = initiator
+        self.on_channel = on_channel
+        self.on_message = on_message
+        self.alive = True
+        self.error = None
+        self._reader = reader or FrameReader(socket.getInputStream())
+        self._cond = threading.Condition()
+        self._channels = {}
+        self._order = []  # Orden de turno para repartir entre canales de igual prioridad
+        self._control = deque()
+        self._next_id = 1 if initiator else 2
+        self._messages = None  # Canal de mensajes de salida, abierto al primer envío
+        self._accepted = queue.Queue()
+        self._ready = threading.Event()
+        self._peer_ok = not initiator  # El receptor ya leyó el preámbulo al detectarlo
+
+    def start(self):
+        threading.Thread(target=self._read_loop, daemon=True).start()
+        threading.Thread(target=self._write_loop, daemon=True).start()
+        return self
+
+    def wait_ready(self, timeout=PREFACE_TIMEOUT):
+        """True cuando el otro extremo ha respondido con su preámbulo"""
+        self._ready.wait(timeout)
+        return self.alive and self._peer_ok
+
+    def open_channel(self, label="", priority=PRIORITY_BULK):
+        with self._cond:
+            return self._open(label, priority)
+
+    def open_session(self, label=LABEL_FILES):
+        """Par de canales (respuestas, datos) para una sesión que inicia este extremo"""
+        with self._cond:
+            # El de respuestas se abre antes: el otro extremo ya lo tiene al emparejar
+            replies = self._open(LABEL_REPLIES, PRIORITY_ACK)
+            data = self._open(label, PRIORITY_BULK, replies=replies.channel_id)
+        return ChannelPair(replies, data)
+
+    def send_message(self, message):
+        """Envía un mensaje JSON corto por delante de los datos de archivo"""
+        payload = encode_json(message)
+        if len(payload) > MAX_MESSAGE_SIZE:
+            raise ValueError(f"Mensaje demasiado grande: {len(payload)} bytes")
+        with self._cond:
+            if self._messages is None:
+                self._messages = self._open(LABEL_MESSAGES, PRIORITY_MESSAGE)
+            channel = self._messages
+        # Cabecera y carga en una sola escritura: los envíos concurrentes no se mezclan
+        FrameWriter(channel).write_frame(FRAME_MESSAGE, payload)
+
+    def _open(self, label, priority, **info):
+        # Con el cerrojo tomado
+        if not self.alive:
+            raise OSError("Conexión multiplexada cerrada")
+        channel = self._register(self._next_id, priority, label)
+        self._next_id += 2
+        self._queue_control(MUX_OPEN, channel.channel_id,
+                            encode_json(dict(info, label=label, priority=priority)))
+        return channel
+
+    def accept(self):
+        """Siguiente canal abierto por el otro extremo (como BluetoothServerSocket)"""
+        channel = self._accepted.get()
+        if channel is None:
+            self._accepted.put(None)
+            raise OSError("Conexión multiplexada cerrada")
+        return channel
+
+    def _register(self, channel_id, priority, label):
+        channel = Channel(self, channel_id, priority, label)
+        self._channels[channel_id] = channel
+        self._order.append(channel)
+        return channel
+
+    def _unregister(self, channel):
+        self._channels.pop(channel.channel_id, None)
+        if channel in self._order:
+            self._order.remove(channel)
+
+    def _queue_control(self, kind, channel_id, payload=b""):
+        # Con el cerrojo tomado: los segmentos de control adelantan a todos los datos
+        self._control.append((kind, channel_id, payload))
+        self._cond.notify_all()
+
+    # -------------------------------------------------------------------------
+    # ESCRITURA
+    # -------------------------------------------------------------------------
+    def _next_segment(self):
+        """Con el cerrojo tomado: (tipo, canal, carga) a enviar ahora, o None"""
+        if self._control:
+            return self._control.popleft()
+        best = None
+        for channel in self._order:
+            if channel.pending and channel.send_credit > 0:
+                if best is None or channel.priority < best.priority:
+                    best = channel
+            elif channel.local_closed and not channel.pending and not channel.close_sent:
+                channel.close_sent = True
+                if channel.remote_closed:
+                    self._unregister(channel)
+                return MUX_CLOSE, channel.channel_id, b""
+        if best is None:
+            return None
+        # Al final del turno: el siguiente de su prioridad irá antes
+        self._order.remove(best)
+        self._order.append(best)
+        chunk = best._take_segment()
+        self._cond.notify_all()
+        return MUX_DATA, best.channel_id, chunk
+
+    def _write_loop(self):
+        out = CoalescingStream(self.socket.getOutputStream(), READ_BUFFER_SIZE)
+        unflushed = False
+        try:
+            out.write(PREFACE)
+            out.flush()
+            while True:
+                with self._cond:
+                    segment = self._next_segment()
+                    while segment is None and self.alive and not unflushed:
+                        self._cond.wait()
+                        segment = self._next_segment()
+                    if not self.alive:
+                        return
+                if segment is None:
+                    # Nada más listo: se entrega lo acumulado en una sola escritura
+                    out.flush()
+                    unflushed = False
+                    continue
+                kind, channel_id, payload = segment
+                out.write(MUX_HEADER.pack(channel_id, kind, len(payload)) + bytes(payload))
+                unflushed = True
+        except Exception as e:
+            self._shutdown(e)
+
+    # -------------------------------------------------------------------------
+    # LECTURA
+    # -------------------------------------------------------------------------
+    def _read_loop(self):
+        reader = self._reader
+        try:
+            if self.initiator:
+                if reader.peek(len(PREFACE)) != PREFACE:
+                    raise ProtocolError("El otro extremo no admite multiplexación")
+                reader.read_exact(len(PREFACE))
+                self._peer_ok = True
+            self._ready.set()
+            while reader.wait_data():
+                channel_id, kind, length = MUX_HEADER.unpack(reader.read_exact(MUX_HEADER.size))
+                if length > MAX_FRAME_SIZE:
+                    raise ProtocolError(f"Segmento demasiado grande: {length} bytes")
+                self._dispatch(channel_id, kind, reader.read_exact(length))
+            self._shutdown(None)
+        except Exception as e:
+            self._shutdown(e)
+
+    def _dispatch(self, channel_id, kind, payload):
+        new_channel = None
+        messages = None
+        with self._cond:
+            channel = self._channels.get(channel_id)
+            if kind == MUX_OPEN:
+                if channel is not None or channel_id % 2 == self._next_id % 2:
+                    raise ProtocolError(f"Apertura inválida del canal {channel_id}")
+                info = decode_json(payload)
+                new_channel = self._register(channel_id, info.get("priority", PRIORITY_BULK),
+                                             info.get("label", ""))
+                if new_channel.label == LABEL_REPLIES:
+                    new_channel = None  # Espera a su canal de datos
+                elif new_channel.label == LABEL_MESSAGES:
+                    messages, new_channel = new_channel, None
+                elif "replies" in info:
+                    replies = self._channels.get(info["replies"])
+                    if replies is None or replies.label != LABEL_REPLIES:
+                        raise ProtocolError(f"Canal de respuestas inválido: {info['replies']}")
+                    new_channel = ChannelPair(new_channel, replies)
+            elif channel is None:
+                return  # Segmento tardío de un canal ya cerrado por ambos lados
+            elif kind == MUX_DATA:
+                channel._deliver(payload)
+            elif kind == MUX_CREDIT:
+                channel.send_credit += CREDIT_ENTRY.unpack(payload)[0]
+            elif kind == MUX_CLOSE:
+                channel.remote_closed = True
+                if channel.close_sent:
+                    self._unregister(channel)
+            else:
+                raise ProtocolError(f"Segmento de tipo desconocido: {kind}")
+            self._cond.notify_all()
+        if messages is not None:
+            threading.Thread(target=self._message_loop, args=(messages,), daemon=True).start()
+        if new_channel is not None:
+            if self.on_channel:
+                self.on_channel(new_channel)
+            else:
+                self._accepted.put(new_channel)
+
+    def _message_loop(self, channel):
+        """Lee el canal de mensajes del otro extremo hasta que lo cierre"""
+        reader = FrameReader(channel)
+        try:
+            address = channel.getRemoteDevice().getAddress()
+            while True:
+                frame = reader.read_frame()
+                if frame is None:
+                    return
+                if frame[0] != FRAME_MESSAGE:
+                    raise ProtocolError(f"Se esperaba trama {FRAME_MESSAGE}, llegó {frame[0]}")
+                # Sin on_message se leen igual, para devolver el crédito
+                if self.on_message:
+                    self.on_message(address, decode_json(frame[1]))
+        except Exception:
+            if self.alive:
+                traceback.print_exc()
+        finally:
+            channel.close()
+
+    # -------------------------------------------------------------------------
+    # CIERRE
+    # -------------------------------------------------------------------------
+    def _shutdown(self, error):
+        with self._cond:
+            if not self.alive:
+                return
+            self.alive = False
+            self.error = error
+            for channel in self._channels.values():
+                channel.remote_closed = True
+            self._cond.notify_all()
+        self._ready.set()
+        self._accepted.put(None)
+        try:
+            self.socket.close()
+        except Exception:
+            pass
+
+    def close(self):
+        self._shutdown(None)
+
+
+# =============================================================================
+# INTEGRACIÓN CON SERVIDOR Y CLIENTE
+# =============================================================================
+class _ReaderStream:
+    """InputStream que entrega primero lo que ya leyó un FrameReader"""
+
+    def __init__(self, reader):
+        self._reader = reader
+
+    def read(self, buffer, offset=0, length=None):
+        if length is None:
+            length = len(buffer) - offset
+        if self._reader.buffered:
+            return self._reader.readinto(buffer, offset, min(length, self._reader.buffered))
+        return self._reader.stream.read(buffer, offset, length)
+
+
+class _LegacySocket:
+    """Socket de un cliente sin multiplexación cuyo primer byte ya se ha leído"""
+
+    def __init__(self, socket, reader):
+        self._socket = socket
+        self._input = _ReaderStream(reader)
+
+    def getInputStream(self):
+        return self._input
+
+    def getOutputStream(self):
+        return self._socket.getOutputStream()
+
+    def getRemoteDevice(self):
+        return self._socket.getRemoteDevice()
+
+    def close(self):
+        self._socket.close()
+
+
+class MuxServerSocket:
+    """
+    Envuelve un socket servidor: cada sesión que abra un cliente multiplexado,
+    y cada conexión de un cliente sin multiplexación, sale por accept() como
+    un socket independiente, así SessionServer atiende ambos igual.
+    on_multiplexer(mac, multiplexor) recibe cada conexión multiplexada
+    aceptada (MuxConnector.adopt) para enviar al cliente por ella misma;
+    on_message(mac, mensaje), los mensajes que lleguen por ellas.
+    """
+
+    def __init__(self, server_socket, on_multiplexer=None, on_message=None):
+        self.server_socket = server_socket
+        self.on_multiplexer = on_multiplexer
+        self.on_message = on_message
+        self._incoming = queue.Queue()
+        self._muxes = []
+        self._lock = threading.Lock()
+        self._closed = False
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        try:
+            while not self._closed:
+                socket = self.server_socket.accept()
+                threading.Thread(target=self._detect, args=(socket,), daemon=True).start()
+        except Exception:
+            if not self._closed:
+                traceback.print_exc()
+        finally:
+            self._incoming.put(None)
+
+    def _detect(self, socket):
+        reader = FrameReader(socket.getInputStream())
+        try:
+            start = reader.peek(len(PREFACE))
+        except Exception:
+            start = b""
+        if not start:
+            socket.close()
+        elif start == PREFACE:
+            reader.read_exact(len(PREFACE))
+            mux = Multiplexer(socket, initiator=False, reader=reader,
+                              on_channel=self._incoming.put, on_message=self.on_message)
+            with self._lock:
+                self._muxes = [m for m in self._muxes if m.alive] + [mux]
+            mux.start()
+            if self.on_multiplexer:
+                try:
+                    self.on_multiplexer(socket.getRemoteDevice().getAddress(), mux)
+                except Exception:
+                    traceback.print_exc()
+        else:
+            self._incoming.put(_LegacySocket(socket, reader))
+
+    def accept(self):
+        socket = self._incoming.get()
+        if socket is None:
+            self._incoming.put(None)
+            raise OSError("Servidor cerrado")
+        return socket
+
+    def close(self):
+        self._closed = True
+        try:
+            self.server_socket.close()
+        except Exception:
+            pass
+        with self._lock:
+            muxes, self._muxes = self._muxes, []
+        for mux in muxes:
+            mux.close()
+
+
+class MuxConnector:
+    """
+    Conector para ConnectionManager: una conexión multiplexada por MAC y una
+    sesión (par de canales) nueva por cada connect(). Si el receptor no
+    admite multiplexación se recuerda y se usa el socket directamente. Las
+    conexiones que el par abrió hacia nosotros (adopt) también sirven: se
+    le envía por ellas en sentido contrario, sin marcar otra.
+    send_message() usa la conexión viva con el par; on_message(mac, mensaje)
+    recibe los suyos por las conexiones que marcamos nosotros.
+    """
+
+    def __init__(self, inner, on_channel=None, on_message=None):
+        self.inner = inner
+        self.on_channel = on_channel
+        self.on_message = on_message
+        self.resolve = inner.resolve
+        self._muxes = {}
+        self._legacy = set()
+        self._dial_locks = {}
+        self._lock = threading.Lock()
+
+    def multiplexer(self, address):
+        """Multiplexor vivo con `address`, marcado por nosotros o adoptado"""
+        with self._lock:
+            mux = self._muxes.get(address)
+        return mux if mux and mux.alive else None
+
+    def _dial_lock(self, address):
+        with self._lock:
+            return self._dial_locks.setdefault(address, threading.Lock())
+
+    def connect(self, address, channel=None):
+        # Solo se serializa por par: conectar y esperar el preámbulo de uno
+        # no bloquea la conexión con los demás
+        with self._dial_lock(address):
+            with self._lock:
+                mux = self._muxes.get(address)
+                legacy = address in self._legacy
+            if mux is not None and mux.alive:
+                return mux.open_session(), channel
+            if legacy:
+                return self.inner.connect(address, channel)
+            sock, resolved = self.inner.connect(address, channel)
+            mux = Multiplexer(sock, initiator=True, on_channel=self.on_channel,
+                              on_message=self.on_message).start()
+            if not mux.wait_ready():
+                # Receptor antiguo: cierra al ver el preámbulo
+                mux.close()
+                with self._lock:
+                    self._legacy.add(address)
+                return self.inner.connect(address, channel)
+            with self._lock:
+                self._muxes[address] = mux
+        return mux.open_session(), resolved
+
+    def send_message(self, address, message):
+        """Mensaje corto al par por su conexión multiplexada viva (no marca)"""
+        mux = self.multiplexer(address)
+        if mux is None:
+            raise OSError(f"Sin conexión multiplexada con {address}")
+        mux.send_message(message)
+
+    def adopt(self, address, mux):
+        """Usa para `address` una conexión multiplexada que abrió el par"""
+        with self._lock:
+            current = self._muxes.get(address)
+            if current is None or not current.alive:
+                self._muxes[address] = mux
+                self._legacy.discard(address)
+
+    def close(self):
+        with self._lock:
+            muxes, self._muxes = list(self._muxes.values()), {}
+        for mux in muxes:
+            mux.close()
@@ -0,0 +1,290 @@
+"""
+TUBERÍA DE RECEPCIÓN
+El hilo de la sesión lee del socket en búferes preasignados y un hilo escritor
+los vuelca a disco, de modo que el enlace RFCOMM no espera a la memoria flash.
+Los archivos de tamaño conocido se reservan enteros al abrirlos (sin
+fragmentar y con el error de falta de espacio al principio) y los grandes se
+escriben a través de un mmap: sin llamada write() por búfer. Al terminar cada
+archivo se aplica la política de durabilidad (storage.Durability).
+"""
+import mmap
+import os
+import queue
+import threading
+
+import tracing
+from protocol import ProtocolError
+from storage import Durability, mark_mapped
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+RECEIVE_BUFFER_SIZE = 256 * 1024
+RECEIVE_POOL_SIZE = 8  # Búferes en vuelo como máximo entre socket y disco
+PREALLOCATE_MIN_SIZE = 1024 * 1024  # Tamaño anunciado a partir del cual se reserva
+MMAP_MIN_SIZE = 8 * 1024 * 1024  # Tamaño anunciado a partir del cual se usa mmap
+MMAP_WINDOW = 8 * 1024 * 1024  # Bytes escritos tras los que se sueltan sus páginas
+
+
+def preallocate(fd, size):
+    """Reserva `size` bytes en disco; devuelve False si el sistema no lo permite"""
+    if not hasattr(os, "posix_fallocate"):
+        return False
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError:
+        return False  # Sin espacio o sistema de archivos sin soporte
+    return True
+
+
+class BufferPool:
+    """Conjunto fijo de bytearray reutilizables; acquire() bloquea si no quedan"""
+
+    def __init__(self, count=RECEIVE_POOL_SIZE, size=RECEIVE_BUFFER_SIZE):
+        self.buffer_size = size
+        self._free = queue.Queue()
+        for _ in range(count):
+            self._free.put(bytearray(size))
+
+    def acquire(self):
+        return self._free.get()
+
+    def release(self, buffer):
+        self._free.put(buffer)
+
+
+class ReceivePipeline:
+    """
+    Etapa de escritura a disco con cola acotada.
+    Las operaciones se encolan en orden (abrir, escribir, terminar, abortar) y
+    un único hilo las ejecuta; si la cola está llena, el lector espera.
+    """
+
+    def __init__(self, pool=None, durability=None):
+        self.pool = pool or BufferPool()
+        self.durability = durability or Durability()
+        self._queue = queue.Queue(maxsize=self.pool._free.qsize())
+        self._file = None
+        self._map = None
+        self._reserved = False  # Espacio reservado más allá de lo escrito
+        self._position = 0
+        self._released = 0  # Inicio de las páginas mapeadas aún residentes
+        self._path = None
+        self._journal = None
+        self._hasher = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # -------------------------------------------------------------------------
+    # LADO DEL LECTOR (hilo de la sesión)
+    # -------------------------------------------------------------------------
+    def _put(self, item):
+        if self._error:
+            raise self._error
+        self._queue.put(item)
+
+    def open(self, path, offset=0, journal=None, hasher=None, size=None):
+        """
+        Abre el destino; con `offset` se continúa un archivo parcial.
+        `hasher` (o el diario) resume los bytes según se escriben.
+        `size` es el tamaño anunciado: si es grande se reserva y se mapea.
+        """
+        self._put((self._open, path, offset, journal, hasher, size))
+
+    def write_from(self, reader, length):
+        """Lee `length` bytes del socket directamente a búferes del pool"""
+        while length > 0:
+            # Esperar un búfer libre significa que el disco va por detrás del enlace
+            started = tracing.clock()
+            buffer = self.pool.acquire()
+            tracing.count_since("recv.pool_wait_s", started)
+            wanted = min(length, len(buffer))
+            bytes_read = reader.readinto(buffer, 0, wanted)
+            if bytes_read != wanted:
+                self.pool.release(buffer)
+                raise ProtocolError("Conexión cerrada a mitad de trama")
+            self._put((self._write, buffer, bytes_read))
+            length -= bytes_read
+
+    def write_bytes(self, data):
+        """Copia datos ya en memoria (p. ej. descomprimidos) a búferes del pool"""
+        with memoryview(data) as view:
+            while view:
+                buffer = self.pool.acquire()
+                n = min(len(view), len(buffer))
+                buffer[:n] = view[:n]
+                self._put((self._write, buffer, n))
+                view = view[n:]
+
+    def finish(self, callback=None):
+        """Cierra el archivo actual y ejecuta `callback` en el hilo escritor"""
+        self._put((self._finish, callback))
+
+    def sync(self):
+        """Espera a que el escritor procese todo lo encolado y relanza su error"""
+        done = threading.Event()
+        self._queue.put((self._sync, done))
+        done.wait()
+        if self._error:
+            raise self._error
+
+    def abort(self):
+        """Cierra y borra el archivo a medias (no lanza errores previos)"""
+        self._queue.put((self._abort,))
+
+    def close(self):
+        """Espera a que se vacíe la cola y relanza el error del escritor si lo hubo"""
+        self._queue.put(None)
+        self._thread.join()
+        if self._error:
+            raise self._error
+
+    # -------------------------------------------------------------------------
+    # LADO DEL ESCRITOR
+    # -------------------------------------------------------------------------
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            func, args = item[0], item[1:]
+            if self._error and func not in (self._abort, self._sync):
+                # Tras un error solo se devuelven los búferes al pool
+                if func == self._write:
+                    self.pool.release(args[0])
+                continue
+            try:
+                func(*args)
+            except Exception as e:
+                self._error = e
+        self._close_file()
+        try:
+            # Lo recibido en la sesión queda en disco al terminarla
+            self.durability.flush()
+        except OSError as e:
+            self._error = self._error or e
+
+    def _open(self, path, offset, journal, hasher=None, size=None):
+        self._close_file()
+        if offset:
+            self._file = open(path, "r+b")
+            self._file.seek(offset)
+            self._file.truncate()
+        else:
+            # Lectura y escritura: mmap con ACCESS_WRITE la necesita
+            self._file = open(path, "w+b")
+        self._position = offset
+        self._path = path
+        self._journal = journal
+        self._hasher = hasher
+        if not isinstance(size, int) or offset >= size:
+            return
+        if size >= MMAP_MIN_SIZE:
+            self._map_file(size)
+        elif size >= PREALLOCATE_MIN_SIZE:
+            self._reserved = preallocate(self._file.fileno(), size)
+
+    def _map_file(self, size):
+        # Solo se mapea con el espacio ya reservado: escribir en un hueco sin
+        # bloques con el disco lleno acabaría en SIGBUS en lugar de en un error
+        try:
+            if preallocate(self._file.fileno(), size):
+                self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_WRITE)
+                self._released = self._position - self._position % mmap.ALLOCATIONGRANULARITY
+                mark_mapped(self._path)
+                return
+        except (OSError, ValueError, OverflowError):
+            pass  # Sin espacio de direcciones: escritura normal
+        self._file.truncate(self._position)
+
+    def _write(self, buffer, length):
+        started = tracing.clock()
+        try:
+            with memoryview(buffer) as view:
+                if self._map is None:
+                    self._file.write(view[:length])
+                elif self._position + length > len(self._map):
+                    raise ProtocolError("El emisor envía más datos de los anunciados")
+                else:
+                    self._map[self._position:self._position + length] = view[:length]
+                self._position += length
+                if self._map is not None and self._position - self._released >= MMAP_WINDOW:
+                    self._release_pages()
+                if self._journal:
+                    self._journal.update(view[:length])
+                elif self._hasher:
+                    self._hasher.update(view[:length])
+        finally:
+            self.pool.release(buffer)
+        tracing.count_since("disk.write_s", started)
+        if self._journal and self._journal.should_commit():
+            self._commit_journal()
+
+    def _release_pages(self):
+        # Mapeo compartido: las páginas sucias siguen en la caché del sistema
+        # y se escriben igual; solo dejan de contar en la memoria del proceso
+        if hasattr(self._map, "madvise"):
+            end = self._position - self._position % mmap.ALLOCATIONGRANULARITY
+            self._map.madvise(mmap.MADV_DONTNEED, self._released, end - self._released)
+            self._released = end
+
+    def _commit_journal(self):
+        """Sincroniza el archivo y anota en el diario lo que ya es seguro"""
+        started = tracing.clock()
+        if self._map is not None:
+            self._map.flush()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        tracing.count_since("disk.fsync_s", started)
+        self._journal.commit()
+
+    def _sync(self, done):
+        done.set()
+
+    def _finish(self, callback):
+        self._close_file(completed=True)
+        self._path = None
+        self._journal = None
+        self._hasher = None
+        if callback:
+            callback()
+
+    def _abort(self):
+        path = self._path
+        if self._journal and self._file:
+            # Transferencia reanudable: se conserva lo recibido para continuar
+            try:
+                self._commit_journal()
+            except OSError:
+                pass
+            path = None
+        self._close_file()
+        self._path = None
+        self._journal = None
+        self._hasher = None
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _close_file(self, completed=False):
+        """Cierra el archivo actual; `completed` aplica la política de durabilidad"""
+        if self._map is not None:
+            # La reserva sobrante (envío más corto o interrumpido) se recorta
+            self._map.close()
+            self._map = None
+            self._file.truncate(self._position)
+            mark_mapped(self._path, False)
+        elif self._reserved:
+            self._file.truncate(self._position)
+        self._reserved = False
+        if self._file:
+            try:
+                if completed:
+                    self._file.flush()
+                    self.durability.closing(self._file, self._position)
+            finally:
+                self._file.close()
+                self._file = None
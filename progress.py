@@ -0,0 +1,180 @@
+"""
+PROGRESO Y MÉTRICAS
+Los hilos de transferencia solo actualizan contadores (TransferMeter); un hilo
+informador toma una instantánea de todos ellos cada `interval` segundos y la
+entrega de una vez, así la interfaz recibe unas pocas actualizaciones por
+segundo en lugar de una por fragmento.
+"""
+import threading
+import time
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+REPORT_INTERVAL = 0.25  # Segundos entre entregas de progreso
+STALL_TIMEOUT = 5.0  # Segundos sin bytes nuevos para considerar atascada una transferencia
+RATE_SMOOTHING = 0.3  # Peso de la última muestra en la velocidad suavizada
+
+
+class TransferMeter:
+    """
+    Contadores de una transferencia (un lote enviado o una sesión recibida).
+    Lo actualiza un único hilo; el informador solo lo lee.
+    """
+
+    def __init__(self, label, total=None):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.file = None
+        self.file_done = 0
+        self.file_size = None
+        self.finished = False
+        self.error = None
+        self.finished_at = None
+        self.started_at = time.monotonic()
+        self.last_change = self.started_at
+        self._base = 0  # Bytes de los archivos anteriores al actual
+        # Estado de muestreo, solo lo toca el informador
+        self._sample_time = self.started_at
+        self._sample_done = 0
+        self._rate = 0.0
+        self._reported = None
+
+    def update(self, done, total=None):
+        """Progreso acumulado de toda la transferencia"""
+        if total is not None:
+            self.total = total
+        if done != self.done:
+            self.done = done
+            self.last_change = time.monotonic()
+
+    def start_file(self, name, size=None):
+        self._base = self.done
+        self.file = name
+        self.file_size = size
+        self.file_done = 0
+
+    def file_progress(self, done):
+        """Progreso acumulado del archivo actual"""
+        self.file_done = done
+        self.update(self._base + done)
+
+    def finish(self, error=None):
+        self.error = error
+        self.finished_at = self.last_change = time.monotonic()
+        self.finished = True
+
+    def snapshot(self, now=None):
+        """Bytes, velocidad instantánea y media, tiempo restante y atasco"""
+        now = now or time.monotonic()
+        done = self.done
+        elapsed = now - self._sample_time
+        if elapsed > 0:
+            instant = (done - self._sample_done) / elapsed
+            self._rate += RATE_SMOOTHING * (instant - self._rate)
+            self._sample_time, self._sample_done = now, done
+        total_elapsed = (self.finished_at or now) - self.started_at
+        eta = None
+        if self.total and self._rate > 0:
+            eta = max(0, self.total - done) / self._rate
+        return {
+            "label": self.label,
+            "bytes": done,
+            "total": self.total,
+            "file": self.file,
+            "file_bytes": self.file_done,
+            "file_size": self.file_size,
+            "rate": self._rate,
+            "average": done / total_elapsed if total_elapsed > 0 else 0.0,
+            "eta": eta,
+            "elapsed": total_elapsed,
+            "stalled": not self.finished and now - self.last_change >= STALL_TIMEOUT,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class ProgressReporter:
+    """
+    Hilo que agrupa las instantáneas de los medidores registrados y llama a
+    on_update(lista) como mucho una vez por intervalo, solo si algo cambió.
+    """
+
+    def __init__(self, on_update, interval=REPORT_INTERVAL):
+        self.on_update = on_update
+        self.interval = interval
+        self._meters = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, meter):
+        with self._lock:
+            self._meters.append(meter)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return meter
+
+    def track(self, label, total=None):
+        """Crea y registra un medidor nuevo"""
+        return self.add(TransferMeter(label, total))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def tick(self):
+        """Toma las instantáneas pendientes y las entrega (también se puede llamar a mano)"""
+        now = time.monotonic()
+        with self._lock:
+            meters = list(self._meters)
+            self._meters = [m for m in meters if not m.finished]
+        updates = []
+        for meter in meters:
+            state = (meter.done, meter.finished, now - meter.last_change >= STALL_TIMEOUT)
+            if state == meter._reported:
+                continue
+            meter._reported = state
+            updates.append(meter.snapshot(now))
+        if updates:
+            self.on_update(updates)
+
+    def stop(self):
+        """Detiene el hilo y entrega lo pendiente (p. ej. el final de una transferencia)"""
+        self._stop.set()
+        self.tick()
+
+
+# =============================================================================
+# PRESENTACIÓN
+# =============================================================================
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def format_progress(snapshot):
+    """Una línea legible: etiqueta, bytes, velocidad y tiempo restante o estado"""
+    done = format_bytes(snapshot["bytes"])
+    if snapshot["total"]:
+        done += f" / {format_bytes(snapshot['total'])}"
+    if snapshot["finished"]:
+        state = "error" if snapshot["error"] else "completado"
+        return f"{snapshot['label']}: {done} · {state} · media {format_bytes(snapshot['average'])}/s"
+    text = f"{snapshot['label']}: {done} · {format_bytes(snapshot['rate'])}/s"
+    if snapshot["stalled"]:
+        text += " · sin datos"
+    elif snapshot["eta"] is not None:
+        text += f" · quedan {format_duration(snapshot['eta'])}"
+    return text
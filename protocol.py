@@ -0,0 +1,221 @@
+"""
+PROTOCOLO DE SESIÓN SOBRE RFCOMM
+Tramas con prefijo de longitud para enviar varios archivos por una misma conexión
+
+Formato de trama:  tipo (1 byte) | longitud (4 bytes, big-endian) | carga útil
+Secuencia típica:  HELLO -> (OFFER <- HAVE | FILE [<- ACCEPT] [-> CODEC] -> DATA* -> END | PING)* -> BYE
+(ACCEPT solo se envía si la cabecera pide reanudación; CODEC solo si los
+datos van comprimidos. En modo delta (el receptor aún tiene la versión
+anterior que nombra la cabecera), ACCEPT va seguido de SIGNATURES y las DATA
+se mezclan con tramas COPY que remiten a bloques de la copia del receptor.
+PING solo va entre archivos, sin respuesta, y si el receptor lo anunció.
+END lleva el resumen del archivo; si la cabecera pide verificación, el
+receptor contesta VERIFY y el emisor reenvía los bloques dañados con
+REPAIR + DATA seguidos de un nuevo END. OFFER precede a un lote si el
+receptor anunció deduplicación: lleva los resúmenes de sus archivos y HAVE
+dice cuáles ya tiene el receptor, que no se envían)
+MESSAGE no forma parte de la sesión: solo viaja por el canal de mensajes
+de una conexión multiplexada (ver mux.py).
+
+Los flujos usados son los de Java (getInputStream / getOutputStream):
+    input_stream.read(buffer, offset, length) -> bytes leídos o -1 al final
+    output_stream.write(bytes), output_stream.flush()
+"""
+import json
+import struct
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+PROTOCOL_NAME = "btd"
+PROTOCOL_VERSION = 1
+
+FRAME_HELLO = 0x01  # Saludo con versión y capacidades (JSON)
+FRAME_FILE = 0x02   # Cabecera de archivo: nombre, tamaño, metadatos (JSON)
+FRAME_DATA = 0x03   # Fragmento de contenido del archivo actual
+FRAME_END = 0x04    # Fin del archivo actual (JSON)
+FRAME_BYE = 0x05    # Cierre ordenado de la sesión
+FRAME_ACCEPT = 0x06  # Respuesta del receptor con el desplazamiento acordado (JSON)
+FRAME_CODEC = 0x07  # Códec con el que van comprimidas las DATA del archivo (JSON)
+FRAME_SIGNATURES = 0x08  # Firmas de bloques de la copia del receptor (binario)
+FRAME_COPY = 0x09  # Referencia a bloques que el receptor ya tiene (binario)
+FRAME_PING = 0x0A  # Mantenimiento de una conexión inactiva (sin carga ni respuesta)
+FRAME_VERIFY = 0x0B  # Veredicto del receptor sobre el resumen y bloques a reenviar (JSON)
+FRAME_REPAIR = 0x0C  # Desplazamiento de las DATA reenviadas a continuación (JSON)
+FRAME_OFFER = 0x0D  # Resúmenes de los archivos del lote que se va a enviar (JSON)
+FRAME_HAVE = 0x0E  # Archivos ofrecidos que el receptor ya tiene (JSON)
+FRAME_MESSAGE = 0x0F  # Mensaje corto de la aplicación por el canal de mensajes (JSON)
+
+FRAME_HEADER = struct.Struct(">BI")
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # Protección ante datos corruptos
+READ_BUFFER_SIZE = 64 * 1024
+
+
+class ProtocolError(Exception):
+    """Error de formato o de secuencia en el protocolo"""
+
+
+def encode_json(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def decode_json(payload):
+    try:
+        return json.loads(bytes(payload).decode("utf-8"))
+    except ValueError as e:
+        raise ProtocolError(f"JSON inválido en trama: {e}")
+
+
+# =============================================================================
+# LECTURA DE TRAMAS
+# =============================================================================
+class FrameReader:
+    """Lee tramas de un InputStream con un búfer propio para reducir llamadas JNI"""
+
+    def __init__(self, input_stream, buffer_size=READ_BUFFER_SIZE):
+        self.stream = input_stream
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)  # Copias sin objetos intermedios
+        self._start = 0
+        self._end = 0
+
+    def _fill(self):
+        """Lee más datos del flujo al búfer interno; devuelve False al final"""
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            pending = self._end - self._start
+            self._buffer[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+
+        bytes_read = self.stream.read(
+            self._buffer, self._end, len(self._buffer) - self._end)
+        if bytes_read <= 0:
+            return False
+        self._end += bytes_read
+        return True
+
+    @property
+    def buffered(self):
+        """Bytes ya leídos del flujo y aún sin consumir"""
+        return self._end - self._start
+
+    def wait_data(self):
+        """Espera a que haya al menos un byte; devuelve False si el flujo terminó"""
+        return self._start != self._end or self._fill()
+
+    def peek(self, length):
+        """Los próximos `length` bytes sin consumirlos (menos si el flujo termina)"""
+        while self._end - self._start < length and self._fill():
+            pass
+        return bytes(self._view[self._start:min(self._end, self._start + length)])
+
+    def readinto(self, target, offset, length):
+        """Lee exactamente `length` bytes en `target[offset:]`; devuelve los leídos"""
+        done = 0
+        while done < length:
+            available = self._end - self._start
+            if available:
+                n = min(available, length - done)
+                target[offset + done:offset + done + n] = \
+                    self._view[self._start:self._start + n]
+                self._start += n
+                done += n
+            elif length - done >= len(self._buffer) // 2:
+                # Bloques grandes: lectura directa sin pasar por el búfer interno
+                bytes_read = self.stream.read(target, offset + done, length - done)
+                if bytes_read <= 0:
+                    break
+                done += bytes_read
+            elif not self._fill():
+                break
+        return done
+
+    def read_exact(self, length):
+        """Lee exactamente `length` bytes o lanza ProtocolError si el flujo termina"""
+        if self._end - self._start >= length:
+            data = bytes(self._buffer[self._start:self._start + length])
+            self._start += length
+            return data
+        data = bytearray(length)
+        if self.readinto(data, 0, length) != length:
+            raise ProtocolError("Conexión cerrada a mitad de trama")
+        return bytes(data)
+
+    def read_header(self):
+        """Lee la cabecera de la siguiente trama; devuelve None si la conexión terminó"""
+        if not self.wait_data():
+            return None
+        while self._end - self._start < FRAME_HEADER.size:
+            if not self._fill():
+                raise ProtocolError("Conexión cerrada a mitad de cabecera")
+        frame_type, length = FRAME_HEADER.unpack_from(self._buffer, self._start)
+        self._start += FRAME_HEADER.size
+        if length > MAX_FRAME_SIZE:
+            raise ProtocolError(f"Trama demasiado grande: {length} bytes")
+        return frame_type, length
+
+    def read_frame(self):
+        """Devuelve (tipo, carga útil) o None si la conexión terminó limpiamente"""
+        header = self.read_header()
+        if header is None:
+            return None
+        frame_type, length = header
+        return frame_type, self.read_exact(length)
+
+    def expect(self, frame_type):
+        """Lee una trama JSON del tipo indicado"""
+        frame = self.read_frame()
+        if frame is None:
+            raise ProtocolError("Conexión cerrada por el otro extremo")
+        if frame[0] != frame_type:
+            raise ProtocolError(f"Se esperaba trama {frame_type}, llegó {frame[0]}")
+        return decode_json(frame[1])
+
+
+# =============================================================================
+# ESCRITURA DE TRAMAS
+# =============================================================================
+class FrameWriter:
+    """Escribe tramas en un OutputStream (cabecera y carga en una sola llamada)"""
+
+    def __init__(self, output_stream):
+        self.stream = output_stream
+
+    def write_frame(self, frame_type, payload=b""):
+        self.stream.write(FRAME_HEADER.pack(frame_type, len(payload)) + payload)
+
+    def write_json(self, frame_type, obj):
+        self.write_frame(frame_type, encode_json(obj))
+
+    def flush(self):
+        self.stream.flush()
+
+
+class CoalescingStream:
+    """
+    Envoltorio de OutputStream que junta escrituras pequeñas en una sola
+    llamada JNI; flush() vacía lo acumulado antes de hacer flush real.
+    """
+
+    def __init__(self, output_stream, threshold=READ_BUFFER_SIZE):
+        self.stream = output_stream
+        self.threshold = threshold
+        self._pending = bytearray()
+
+    def write(self, data):
+        if not self._pending and len(data) >= self.threshold:
+            self.stream.write(data)
+            return
+        self._pending += data
+        if len(self._pending) >= self.threshold:
+            self._drain()
+
+    def _drain(self):
+        if self._pending:
+            self.stream.write(bytes(self._pending))
+            self._pending.clear()
+
+    def flush(self):
+        self._drain()
+        self.stream.flush()
@@ -0,0 +1,408 @@
+"""
+COLA DE ENVÍOS
+Cola persistente en disco (JSON) con prioridad, destino, intentos y estado de
+cada archivo, y un planificador que la vacía solo: elige el siguiente envío
+por prioridad o el más corto primero, atiende a varios receptores a la vez,
+reintenta con espera exponencial y retoma lo pendiente al reiniciar la app.
+"""
+import collections
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+
+import tracing
+from batch import send_batch
+from connection import backoff_delay
+from storage import atomic_write_json
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+QUEUE_FILE = "cola_envios.json"
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+STATE_PENDING = "pendiente"
+STATE_SENDING = "enviando"
+STATE_DONE = "enviado"
+STATE_FAILED = "fallido"
+
+ORDER_PRIORITY = "prioridad"  # Prioridad y, a igualdad, el más corto
+ORDER_SHORTEST = "corto"  # El más corto y, a igualdad, la prioridad
+
+MAX_ATTEMPTS = 8  # Intentos por archivo antes de darlo por fallido
+RETRY_BASE_DELAY = 2.0  # Segundos antes del segundo intento
+RETRY_MAX_DELAY = 300.0
+MAX_ACTIVE_PEERS = 3  # Receptores atendidos a la vez (uno o ningún envío por MAC)
+BATCH_MAX_ITEMS = 64  # Archivos por lote sobre una misma conexión
+BATCH_MAX_BYTES = 64 * 1024 * 1024
+KEEP_FINISHED = 200  # Entradas terminadas que se conservan como historial
+
+
+class QueueItem:
+    """Un archivo pendiente de enviar a un receptor concreto"""
+
+    FIELDS = ("item_id", "path", "name", "address", "priority", "size", "state",
+              "attempts", "not_before", "error", "added_at", "finished_at")
+
+    def __init__(self, path, name, address, priority=PRIORITY_NORMAL, size=None):
+        self.item_id = uuid.uuid4().hex[:16]
+        self.path = path
+        self.name = name
+        self.address = address
+        self.priority = priority
+        self.size = size
+        self.state = STATE_PENDING
+        self.attempts = 0
+        self.not_before = 0.0  # Hora (time.time) antes de la que no se reintenta
+        self.error = None
+        self.added_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        item = cls(data["path"], data["name"], data["address"])
+        for field in cls.FIELDS:
+            if field in data:
+                setattr(item, field, data[field])
+        return item
+
+
+# =============================================================================
+# COLA PERSISTENTE
+# =============================================================================
+class TransferQueue:
+    """
+    Entradas en memoria respaldadas por un archivo JSON que se reescribe de
+    forma atómica en cada cambio de estado. on_change(entrada) se llama sin
+    el cerrojo tomado y desde el hilo que hizo el cambio.
+    """
+
+    def __init__(self, path, on_change=None):
+        self.path = path
+        self.on_change = on_change
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            traceback.print_exc()
+            return
+        for data in saved.get("items", []):
+            try:
+                item = QueueItem.from_dict(data)
+            except (KeyError, TypeError):
+                continue
+            if item.state == STATE_SENDING:
+                # La app se cerró a mitad de envío: vuelve a la cola
+                item.state = STATE_PENDING
+            self._items[item.item_id] = item
+
+    def _save(self):
+        # Con el cerrojo tomado
+        finished = [i for i in self._items.values() if i.state in (STATE_DONE, STATE_FAILED)]
+        for item in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+            del self._items[item.item_id]
+        atomic_write_json(self.path, {"items": [i.to_dict() for i in self._items.values()]})
+
+    def _changed(self, items):
+        if self.on_change:
+            for item in items:
+                self.on_change(item)
+
+    def add(self, entries, address, priority=PRIORITY_NORMAL):
+        """Encola [(ruta, nombre)] para `address`; devuelve las entradas creadas"""
+        added = []
+        for path, name in entries:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = None
+            added.append(QueueItem(os.path.abspath(path), name, address, priority, size))
+        with self._lock:
+            for item in added:
+                self._items[item.item_id] = item
+            self._save()
+        self._changed(added)
+        return added
+
+    def items(self):
+        with self._lock:
+            return list(self._items.values())
+
+    def counts(self):
+        """Entradas por estado"""
+        counter = collections.Counter(item.state for item in self.items())
+        return {state: counter.get(state, 0)
+                for state in (STATE_PENDING, STATE_SENDING, STATE_DONE, STATE_FAILED)}
+
+    def remove(self, item_id):
+        """Quita una entrada que no se esté enviando"""
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is None or item.state == STATE_SENDING:
+                return False
+            del self._items[item_id]
+            self._save()
+        return True
+
+    def retry(self, item_id):
+        """Devuelve a la cola una entrada fallida, con los intentos a cero"""
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is None or item.state != STATE_FAILED:
+                return False
+            item.state = STATE_PENDING
+            item.attempts = 0
+            item.not_before = 0.0
+            item.error = None
+            self._save()
+        self._changed([item])
+        return True
+
+    def clear_finished(self):
+        with self._lock:
+            for item_id in [i.item_id for i in self._items.values() if i.state == STATE_DONE]:
+                del self._items[item_id]
+            self._save()
+
+    # -------------------------------------------------------------------------
+    # PLANIFICACIÓN
+    # -------------------------------------------------------------------------
+    def take(self, busy=(), available=None, order=ORDER_PRIORITY, now=None):
+        """
+        Reserva el siguiente lote listo para un receptor libre: la mejor entrada
+        según `order` y, tras ella, otras del mismo receptor hasta llenar el lote.
+        Devuelve (mac, entradas) o (None, []) si no hay nada que enviar ya.
+        """
+        now = now or time.time()
+        with self._lock:
+            ready = [item for item in self._items.values()
+                     if item.state == STATE_PENDING and item.not_before <= now
+                     and item.address not in busy
+                     and (available is None or available(item.address))]
+            if not ready:
+                return None, []
+            ready.sort(key=lambda item: _sort_key(item, order))
+            address = ready[0].address
+            batch = []
+            total = 0
+            for item in ready:
+                if item.address != address:
+                    continue
+                if batch and (len(batch) >= BATCH_MAX_ITEMS
+                              or total + (item.size or 0) > BATCH_MAX_BYTES):
+                    break
+                batch.append(item)
+                total += item.size or 0
+            for item in batch:
+                item.state = STATE_SENDING
+                item.attempts += 1
+            self._save()
+        self._changed(batch)
+        return address, batch
+
+    def finish(self, item, error=None, retry=True):
+        """Anota el resultado; con error se reintenta más tarde si quedan intentos"""
+        with self._lock:
+            item.error = error
+            if error is None:
+                item.state = STATE_DONE
+                item.finished_at = time.time()
+            elif retry and item.attempts < MAX_ATTEMPTS:
+                item.state = STATE_PENDING
+                item.not_before = time.time() + backoff_delay(
+                    item.attempts - 1, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+            else:
+                item.state = STATE_FAILED
+                item.finished_at = time.time()
+            self._save()
+        self._changed([item])
+
+    def defer(self, items, until, error):
+        """Devuelve entradas a la cola sin gastar intento (el receptor no estaba)"""
+        with self._lock:
+            for item in items:
+                item.state = STATE_PENDING
+                item.attempts -= 1
+                item.not_before = until
+                item.error = error
+            self._save()
+        self._changed(items)
+
+    def next_wakeup(self, busy=(), now=None):
+        """
+        Hora del próximo reintento pendiente, o None si no hay ninguno. Las
+        entradas ya listas no cuentan: si no se han tomado es porque su
+        receptor está ocupado o apartado, y eso avisa por su cuenta.
+        """
+        now = now or time.time()
+        with self._lock:
+            times = [item.not_before for item in self._items.values()
+                     if item.state == STATE_PENDING and item.not_before > now
+                     and item.address not in busy]
+        return min(times) if times else None
+
+
+def _sort_key(item, order):
+    size = item.size if item.size is not None else float("inf")
+    if order == ORDER_SHORTEST:
+        return (size, item.priority, item.added_at)
+    return (item.priority, size, item.added_at)
+
+
+# =============================================================================
+# PLANIFICADOR
+# =============================================================================
+class Scheduler:
+    """
+    Hilo que reparte la cola entre receptores: como mucho un lote en curso
+    por MAC y MAX_ACTIVE_PEERS receptores a la vez. Un receptor que falla al
+    conectar se aparta con espera exponencial, sin bloquear a los demás.
+    is_available(mac) permite excluir receptores que se sabe que no están;
+    cuando uno vuelva hay que llamar a wake().
+    Con `hashes` (dedup.HashCache) no se envía lo que el receptor ya tiene.
+    """
+
+    def __init__(self, queue, connections, order=ORDER_PRIORITY,
+                 max_peers=MAX_ACTIVE_PEERS, is_available=None, progress=None,
+                 hashes=None):
+        self.queue = queue
+        self.hashes = hashes
+        self.connections = connections
+        self.order = order
+        self.max_peers = max_peers
+        self.is_available = is_available
+        self.progress = progress
+        self._busy = set()
+        self._peer_failures = {}  # MAC -> fallos de conexión seguidos
+        self._peer_retry_at = {}  # MAC -> hora (time.time) del próximo intento
+        self._cond = threading.Condition()
+        self._wake = False
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def wake(self):
+        """Avisa de que hay trabajo nuevo (p. ej. tras encolar)"""
+        with self._cond:
+            self._wake = True
+            self._cond.notify_all()
+
+    def stop(self):
+        """Deja de lanzar lotes; los que están en curso terminan por su cuenta"""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+    def _available(self, address):
+        if time.time() < self._peer_retry_at.get(address, 0):
+            return False
+        return self.is_available is None or self.is_available(address)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stop:
+                    return
+                self._wake = False
+                busy = set(self._busy)
+            address, items = None, []
+            if len(busy) < self.max_peers:
+                address, items = self.queue.take(busy, self._available, self.order)
+            if items:
+                with self._cond:
+                    self._busy.add(address)
+                threading.Thread(target=self._send, args=(address, items), daemon=True).start()
+                continue
+            with self._cond:
+                if not self._wake and not self._stop:
+                    self._cond.wait(self._timeout(busy))
+
+    def _timeout(self, busy):
+        # Con todos los receptores ocupados solo sirve esperar a que acabe un
+        # lote (_send avisa); si no, hasta el próximo reintento de una entrada
+        # o de un receptor apartado
+        if len(busy) >= self.max_peers:
+            return None
+        now = time.time()
+        times = [t for t in self._peer_retry_at.values() if t > now]
+        wakeup = self.queue.next_wakeup(busy, now)
+        if wakeup is not None:
+            times.append(wakeup)
+        if not times:
+            return None
+        return max(0.05, min(times) - time.time())
+
+    def _send(self, address, items):
+        meter = None
+        if self.progress:
+            meter = self.progress.track(f"Cola → {address}", sum(i.size or 0 for i in items))
+        pending = collections.defaultdict(collections.deque)
+        for item in items:
+            pending[(item.path, item.name)].append(item)
+
+        def on_file(path, name):
+            self.queue.finish(pending[(path, name)].popleft())
+
+        error = None
+        connected = False
+        try:
+            with tracing.span("queue.batch", address=address, items=len(items)), \
+                    self.connections.use(address) as conn:
+                connected = True
+                failed = send_batch(conn.writer, [(i.path, i.name) for i in items],
+                                    reader=conn.reader, tuner=conn.tuner,
+                                    compress=conn.options.get("compression"),
+                                    verify=conn.options.get("verify"),
+                                    on_file=on_file,
+                                    on_progress=meter.update if meter else None,
+                                    hashes=self.hashes if conn.options.get("dedup") else None)
+            # Origen ilegible: reintentar no sirve de nada
+            for path, reason in failed:
+                for item in [i for i in items if i.path == path and i.state == STATE_SENDING]:
+                    self.queue.finish(item, str(reason), retry=False)
+            self._peer_failures.pop(address, None)
+            self._peer_retry_at.pop(address, None)
+        except Exception as e:
+            traceback.print_exc()
+            error = str(e)
+            unsent = [item for item in items if item.state == STATE_SENDING]
+            if connected:
+                for item in unsent:
+                    self.queue.finish(item, error)
+            else:
+                # Receptor inalcanzable: se aparta entero y sus entradas esperan
+                # juntas, sin gastar intentos, para conservar su orden
+                failures = self._peer_failures.get(address, 0) + 1
+                self._peer_failures[address] = failures
+                retry_at = time.time() + backoff_delay(
+                    failures - 1, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+                self._peer_retry_at[address] = retry_at
+                self.queue.defer(unsent, retry_at, error)
+        finally:
+            if meter:
+                meter.finish(error)
+            with self._cond:
+                self._busy.discard(address)
+                self._wake = True
+                self._cond.notify_all()
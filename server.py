@@ -0,0 +1,248 @@
+"""
+SERVIDOR DE RECEPCIÓN MULTICLIENTE
+Bucle de accept() en el núcleo de E/S que reparte cada conexión a un número
+acotado de sesiones; parar el servidor cancela el accept y las sesiones.
+"""
+import asyncio
+import itertools
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import CancelledError
+
+import tracing
+import transfer
+from iocore import STATE_ACTIVE, STATE_CANCELLED, STATE_FAILED, IOCore, SessionStateMachine, StateError
+from progress import TransferMeter
+from storage import Durability
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+MAX_SESSIONS = 4  # Sesiones de recepción simultáneas por defecto
+FINISHED_HISTORY = 100  # Estadísticas de sesiones terminadas que se conservan
+
+
+def _remote_address(socket):
+    """Dirección MAC del otro extremo, si el socket la expone"""
+    try:
+        return socket.getRemoteDevice().getAddress()
+    except Exception:
+        return None
+
+
+# =============================================================================
+# SESIÓN DE RECEPCIÓN
+# =============================================================================
+class ReceiveSession:
+    """Estado y estadísticas de un cliente aceptado; no comparte atributos con la app"""
+
+    def __init__(self, session_id, socket, dest_dir, on_file=None, durability=None):
+        self.session_id = session_id
+        self.socket = socket
+        self.dest_dir = dest_dir
+        self.on_file = on_file
+        self.durability = durability
+        self.peer = _remote_address(socket)
+        self.machine = SessionStateMachine()
+        self.files = 0
+        self.bytes = 0
+        self.error = None
+        self.started_at = None
+        self.ended_at = None
+        self.meter = TransferMeter(f"sesión {session_id}")
+        self._header = None
+
+    @property
+    def state(self):
+        return self.machine.state
+
+    def run(self):
+        """Atiende al cliente hasta el fin de sesión (bloqueante)"""
+        try:
+            self.machine.to(STATE_ACTIVE)
+        except StateError:
+            # Cancelada antes de empezar
+            self.close()
+            return
+        self.started_at = time.time()
+        error = None
+        try:
+            with tracing.span("server.session", session=self.session_id, peer=self.peer):
+                reader, writer = transfer.open_session(self.socket)
+                transfer.server_handshake(reader, writer)
+                transfer.receive_session(reader, writer, self.dest_dir,
+                                         on_file=self._file_done, on_progress=self._progress,
+                                         durability=self.durability)
+        except Exception as e:
+            error = e
+        finally:
+            self.ended_at = time.time()
+            # Una sesión cancelada acaba con error de socket: no es un fallo
+            state = self.machine.finish(error)
+            if state == STATE_FAILED:
+                self.error = str(error)
+                # Ya fuera del except: la excepción en curso se ha perdido
+                traceback.print_exception(type(error), error, error.__traceback__)
+            self.meter.finish(self.error or (state if state == STATE_CANCELLED else None))
+            self.close()
+
+    def cancel(self):
+        """Interrumpe la sesión cerrando su socket (desbloquea read/write de JNI)"""
+        if self.machine.cancel():
+            self.close()
+
+    def _progress(self, received, header):
+        if header is not self._header:
+            self._header = header
+            self.meter.start_file(header.get("name"), header.get("size"))
+        self.meter.file_progress(received)
+
+    def _file_done(self, path, header):
+        self.files += 1
+        self.bytes += header.get("size") or 0
+        if self.on_file:
+            self.on_file(self, path, header)
+
+    def close(self):
+        try:
+            self.socket.close()
+        except Exception:
+            pass
+
+    @property
+    def stats(self):
+        end = self.ended_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "id": self.session_id,
+            "peer": self.peer,
+            "state": self.state,
+            "files": self.files,
+            "bytes": self.bytes,
+            "elapsed": round(elapsed, 3),
+            "throughput": round(self.bytes / elapsed) if elapsed else 0,
+            "error": self.error,
+        }
+
+
+# =============================================================================
+# SERVIDOR
+# =============================================================================
+class SessionServer:
+    """
+    Acepta conexiones sin cerrar el socket servidor y atiende hasta
+    `max_sessions` a la vez; el resto espera en la cola de escucha del sistema.
+    El bucle corre en un IOCore (el que se pase o uno propio): accept() y cada
+    sesión son llamadas bloqueantes del executor que stop() cancela cerrando
+    sus sockets, y el servidor no vuelve hasta que han terminado todas.
+    """
+
+    def __init__(self, server_socket, dest_dir, max_sessions=MAX_SESSIONS,
+                 on_file=None, on_session_start=None, on_session_end=None, core=None,
+                 durability=None):
+        self.server_socket = server_socket
+        self.dest_dir = dest_dir
+        self.max_sessions = max_sessions
+        self.on_file = on_file
+        self.on_session_start = on_session_start
+        self.on_session_end = on_session_end
+        # Compartida: el fsync en grupo abarca los archivos de todas las sesiones
+        self.durability = durability or Durability()
+        self.running = False
+        # Un hilo por sesión más el del accept
+        self.core = core or IOCore(max_blocking=max_sessions + 1, name="servidor")
+        self._own_core = core is None
+        self._task = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._active = {}
+        self._finished = deque(maxlen=FINISHED_HISTORY)
+
+    def serve_forever(self):
+        """Bucle de aceptación; vuelve cuando se llama a stop() o falla el socket"""
+        if self._own_core:
+            self.core.start()
+        try:
+            self.core.run(self.serve())
+        except CancelledError:
+            pass
+        finally:
+            if self._own_core:
+                self.core.stop()
+
+    async def serve(self):
+        """Corrutina del servidor para quien ya tiene un IOCore en marcha"""
+        self.running = True
+        self._task = asyncio.current_task()
+        slots = asyncio.Semaphore(self.max_sessions)
+        sessions = set()
+        try:
+            while self.running:
+                await slots.acquire()
+                try:
+                    socket = await self.core.blocking(self.server_socket.accept,
+                                                      on_cancel=self._close_listener)
+                except Exception:
+                    slots.release()
+                    if self.running:
+                        raise
+                    break
+                session = ReceiveSession(next(self._ids), socket, self.dest_dir,
+                                         on_file=self.on_file, durability=self.durability)
+                with self._lock:
+                    self._active[session.session_id] = session
+                task = asyncio.ensure_future(self._run_session(session, slots))
+                sessions.add(task)
+                task.add_done_callback(sessions.discard)
+        finally:
+            self.running = False
+            self._close_listener()
+            # Estructurado: el servidor no termina con sesiones vivas
+            for task in list(sessions):
+                task.cancel()
+            if sessions:
+                await asyncio.wait(list(sessions))
+
+    async def _run_session(self, session, slots):
+        try:
+            if self.on_session_start:
+                self.on_session_start(session)
+            await self.core.blocking(session.run, on_cancel=session.cancel)
+        finally:
+            with self._lock:
+                self._active.pop(session.session_id, None)
+                self._finished.append(session.stats)
+            slots.release()
+            if self.on_session_end:
+                self.on_session_end(session)
+
+    def _close_listener(self):
+        try:
+            self.server_socket.close()
+        except Exception:
+            pass
+
+    def stop(self):
+        """Deja de aceptar y cancela las sesiones activas (cierra sus sockets)"""
+        self.running = False
+        self._close_listener()
+        task = self._task
+        if task is not None and self.core.running:
+            self.core.loop.call_soon_threadsafe(task.cancel)
+        with self._lock:
+            sessions = list(self._active.values())
+        for session in sessions:
+            session.cancel()
+
+    @property
+    def active_count(self):
+        with self._lock:
+            return len(self._active)
+
+    def stats(self):
+        """Estadísticas de las sesiones activas y de las ya terminadas"""
+        with self._lock:
+            active = [session.stats for session in self._active.values()]
+            return {"active": active, "finished": list(self._finished)}
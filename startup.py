@@ -0,0 +1,30 @@
+"""
+MEDICIÓN DEL ARRANQUE
+Marca fases del arranque (importaciones, KV, construcción, primer frame...)
+para ver dónde se va el tiempo hasta que la app responde.
+"""
+import time
+
+
+class PhaseTimer:
+    """Cronómetro por fases; el origen es el momento en que se importa este módulo"""
+
+    def __init__(self):
+        self.origin = time.monotonic()
+        self._last = self.origin
+        self.phases = []
+
+    def mark(self, name):
+        """Cierra la fase `name` con el tiempo transcurrido desde la marca anterior"""
+        now = time.monotonic()
+        self.phases.append((name, now - self._last, now - self.origin))
+        self._last = now
+
+    def report(self):
+        lines = ["Arranque (ms):  fase / acumulado"]
+        for name, duration, total in self.phases:
+            lines.append(f"  {name:<20} {duration * 1000:8.1f} {total * 1000:10.1f}")
+        return "\n".join(lines)
+
+
+startup_timer = PhaseTimer()
@@ -0,0 +1,264 @@
+"""
+ALMACENAMIENTO DE RECEPCIÓN
+Diario de transferencias parciales para poder reanudarlas tras un corte y
+política de durabilidad de los archivos terminados
+"""
+import hashlib
+import json
+import os
+import threading
+
+import tracing
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+PARTIAL_DIR = ".parciales"  # Subcarpeta de dest_dir con archivos a medias
+JOURNAL_INTERVAL = 4 * 1024 * 1024  # Bytes entre confirmaciones del diario
+HASH_BLOCK = 1024 * 1024
+UNMAP_TIMEOUT = 10.0  # Segundos esperando a que otra sesión suelte un parcial mapeado
+
+# Durabilidad de los archivos terminados (antes de darlos por recibidos)
+DURABILITY_NONE = "ninguna"  # Lo decide el sistema; lo más rápido
+DURABILITY_FILE = "archivo"  # fsync de cada archivo y de su carpeta tras renombrarlo
+DURABILITY_GROUP = "grupo"  # Un fsync conjunto cada GROUP_FILES archivos o GROUP_BYTES
+DURABILITY_MODES = (DURABILITY_NONE, DURABILITY_FILE, DURABILITY_GROUP)
+GROUP_FILES = 64
+GROUP_BYTES = 64 * 1024 * 1024
+
+# Parciales que alguna sesión de este proceso tiene mapeados en memoria:
+# recortarlos mientras tanto mataría el proceso con SIGBUS
+_mapped = set()
+_mapped_cond = threading.Condition()
+
+
+def atomic_write_json(path, obj):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def mark_mapped(path, mapped=True):
+    path = os.path.abspath(path)
+    with _mapped_cond:
+        if mapped:
+            _mapped.add(path)
+        else:
+            _mapped.discard(path)
+            _mapped_cond.notify_all()
+
+
+def wait_unmapped(path, timeout=UNMAP_TIMEOUT):
+    """
+    Espera a que ninguna sesión tenga `path` mapeado (p. ej. la de una conexión
+    caída que aún vacía su cola) antes de truncarlo o reescribirlo
+    """
+    path = os.path.abspath(path)
+    with _mapped_cond:
+        if not _mapped_cond.wait_for(lambda: path not in _mapped, timeout):
+            raise TimeoutError(f"{os.path.basename(path)} sigue en uso por otra sesión")
+
+
+def fsync_dir(path):
+    """Hace duraderos los renombrados dentro de la carpeta `path`"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # Algunos sistemas de archivos no permiten fsync de carpetas
+    finally:
+        os.close(fd)
+
+
+# =============================================================================
+# DURABILIDAD
+# =============================================================================
+class Durability:
+    """
+    Cuándo se fuerzan a disco los archivos recibidos. El escritor llama a
+    closing() con el archivo aún abierto y a renamed() tras darle su nombre
+    definitivo. En modo grupo se guarda un duplicado del descriptor y el
+    fsync se hace de una vez para todo el grupo, así que una ráfaga de
+    archivos pequeños no paga un fsync por archivo. Se puede compartir entre
+    sesiones; flush() cierra el grupo pendiente (p. ej. al acabar la sesión).
+    Los diarios de archivos reanudables se siguen confirmando con fsync en
+    cualquier modo: su desplazamiento solo vale si los datos están en disco.
+    """
+
+    def __init__(self, mode=DURABILITY_GROUP, group_files=GROUP_FILES,
+                 group_bytes=GROUP_BYTES):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Durabilidad desconocida: {mode}")
+        self.mode = mode
+        self.group_files = group_files
+        self.group_bytes = group_bytes
+        self._lock = threading.Lock()
+        self._fds = []
+        self._dirs = set()
+        self._bytes = 0
+
+    def closing(self, file, size):
+        """El archivo terminado aún está abierto: fsync o se apunta al grupo"""
+        if self.mode == DURABILITY_FILE:
+            started = tracing.clock()
+            os.fsync(file.fileno())
+            tracing.count_since("disk.fsync_s", started)
+        elif self.mode == DURABILITY_GROUP:
+            with self._lock:
+                self._fds.append(os.dup(file.fileno()))
+                self._bytes += size
+
+    def renamed(self, path):
+        """El archivo ya tiene su nombre definitivo"""
+        if self.mode == DURABILITY_FILE:
+            fsync_dir(os.path.dirname(os.path.abspath(path)))
+        elif self.mode == DURABILITY_GROUP:
+            with self._lock:
+                self._dirs.add(os.path.dirname(os.path.abspath(path)))
+                full = (len(self._fds) >= self.group_files
+                        or self._bytes >= self.group_bytes)
+            if full:
+                self.flush()
+
+    def flush(self):
+        """fsync de todo el grupo pendiente y de sus carpetas"""
+        with self._lock:
+            fds, self._fds = self._fds, []
+            dirs, self._dirs = self._dirs, set()
+            self._bytes = 0
+        if not fds and not dirs:
+            return
+        started = tracing.clock()
+        error = None
+        with tracing.span("disk.group_sync", files=len(fds)):
+            for fd in fds:
+                try:
+                    os.fsync(fd)
+                except OSError as e:
+                    error = error or e
+                finally:
+                    os.close(fd)
+            for path in dirs:
+                fsync_dir(path)
+        tracing.count_since("disk.fsync_s", started)
+        if error:
+            raise error
+
+
+class TransferJournal:
+    """
+    Estado persistente de una transferencia reanudable: identificador, tamaño
+    esperado, bytes confirmados en disco y hash SHA-256 de ese prefijo.
+    """
+
+    def __init__(self, dest_dir, header):
+        self.transfer_id = str(header["id"])
+        if not self.transfer_id.isalnum():
+            raise ValueError(f"Identificador de transferencia inválido: {self.transfer_id}")
+        self.name = header.get("name", "")
+        self.size = header.get("size")
+        directory = os.path.join(dest_dir, PARTIAL_DIR)
+        os.makedirs(directory, exist_ok=True)
+        self.partial_path = os.path.join(directory, self.transfer_id + ".part")
+        self.journal_path = os.path.join(directory, self.transfer_id + ".journal")
+        self.committed = 0
+        self.written = 0
+        self._hasher = hashlib.sha256()
+
+    @classmethod
+    def open(cls, dest_dir, header):
+        """Carga el diario existente y comprueba el archivo parcial; si no cuadra, empieza de cero"""
+        journal = cls(dest_dir, header)
+        wait_unmapped(journal.partial_path)
+        journal._restore()
+        return journal
+
+    def _restore(self):
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            self._reset()
+            return
+
+        committed = saved.get("committed", 0)
+        if (saved.get("size") != self.size or committed > (self.size or 0)
+                or not os.path.exists(self.partial_path)
+                or os.path.getsize(self.partial_path) < committed):
+            self._reset()
+            return
+
+        # Se recalcula el hash del prefijo para recuperar el estado del hasher
+        hasher = hashlib.sha256()
+        remaining = committed
+        with open(self.partial_path, "rb") as f:
+            while remaining:
+                block = f.read(min(HASH_BLOCK, remaining))
+                if not block:
+                    break
+                hasher.update(block)
+                remaining -= len(block)
+        if remaining or hasher.hexdigest() != saved.get("sha256"):
+            self._reset()
+            return
+
+        self._hasher = hasher
+        self.committed = self.written = committed
+
+    def _reset(self):
+        self.committed = self.written = 0
+        self._hasher = hashlib.sha256()
+        open(self.partial_path, "wb").close()
+        self.save()
+
+    @property
+    def offset(self):
+        return self.committed
+
+    @property
+    def hasher(self):
+        """SHA-256 de todo lo escrito hasta ahora, prefijo reanudado incluido"""
+        return self._hasher
+
+    def update(self, data):
+        """Añade al hash los bytes que el escritor acaba de volcar"""
+        self._hasher.update(data)
+        self.written += len(data)
+
+    def should_commit(self):
+        return self.written - self.committed >= JOURNAL_INTERVAL
+
+    def commit(self):
+        """Confirma lo escrito; el archivo debe estar ya sincronizado en disco"""
+        self.committed = self.written
+        self.save()
+
+    def save(self):
+        atomic_write_json(self.journal_path, {
+            "id": self.transfer_id,
+            "name": self.name,
+            "size": self.size,
+            "committed": self.committed,
+            "sha256": self._hasher.hexdigest(),
+        })
+
+    def discard(self):
+        """Abandona la transferencia: borra diario y archivo parcial"""
+        for path in (self.journal_path, self.partial_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def complete(self):
+        """Borra el diario; el archivo parcial ya ha sido movido a su destino"""
+        try:
+            os.remove(self.journal_path)
+        except OSError:
+            pass
@@ -0,0 +1,187 @@
+"""
+BANCO DE PRUEBAS DE RENDIMIENTO
+Ejecuta el código real de envío (send_batch) y recepción (SessionServer)
+sobre el transporte local, con ancho de banda y latencia simulados opcionales.
+
+Cada caso corre en un proceso propio para que el pico de RSS sea el suyo.
+Métricas: MB/s, tiempo hasta el primer byte en el receptor (conexión + saludo),
+tiempo hasta el primer archivo completo, CPU del proceso y pico de RSS.
+
+Uso:
+    python tools/benchmark.py
+    python tools/benchmark.py --sizes 64K,10M --chunks auto,16K,256K --counts 1,200
+    python tools/benchmark.py --bandwidth 250K --latency 0.03 --content text --json
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import transfer  # noqa: E402
+from batch import expand_selection, send_batch  # noqa: E402
+from server import SessionServer  # noqa: E402
+from transport import LoopbackServerSocket  # noqa: E402
+
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1:] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def _make_files(directory, size, count, content):
+    block = os.urandom(min(size, 1024 * 1024)) if content == "random" else \
+        b"".join(b"%08d;sensor;%d;ok\n" % (i, i * 31 % 977) for i in range(40000))
+    for index in range(count):
+        path = os.path.join(directory, f"archivo_{index:05d}.bin")
+        with open(path, "wb") as f:
+            remaining = size
+            while remaining:
+                piece = block[:remaining]
+                f.write(piece)
+                remaining -= len(piece)
+
+
+class _TimedServerSocket(LoopbackServerSocket):
+    """Registra el instante en que el receptor lee su primer byte"""
+
+    first_byte_at = None
+
+    def accept(self):
+        sock = super().accept()
+        stream = sock.getInputStream()
+        read = stream.read
+        owner = self
+
+        def timed_read(buffer, offset=0, length=None):
+            n = read(buffer, offset, length)
+            if n > 0 and owner.first_byte_at is None:
+                owner.first_byte_at = time.monotonic()
+            return n
+
+        stream.read = timed_read
+        return sock
+
+
+def run_case(size, count, chunk, bandwidth, latency, content, compress):
+    """Ejecuta un caso en este proceso y devuelve sus métricas"""
+    work_dir = tempfile.mkdtemp(prefix="btd_bench_")
+    src_dir = os.path.join(work_dir, "src")
+    dst_dir = os.path.join(work_dir, "dst")
+    os.makedirs(src_dir)
+    os.makedirs(dst_dir)
+    try:
+        _make_files(src_dir, size, count, content)
+        entries = expand_selection([os.path.join(src_dir, n) for n in sorted(os.listdir(src_dir))])
+
+        listener = _TimedServerSocket(bandwidth=bandwidth, latency=latency)
+        done = threading.Event()
+        first_file = []
+        server = SessionServer(
+            listener, dst_dir, max_sessions=1,
+            on_file=lambda s, p, h: first_file or first_file.append(time.monotonic()),
+            on_session_end=lambda s: done.set())
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+
+        cpu_start = time.process_time()
+        start = time.monotonic()
+        sock = listener.connect()
+        reader, writer = transfer.open_session(sock)
+        hello = transfer.client_handshake(reader, writer)
+        options = transfer.negotiate(transfer.local_capabilities(), hello.get("caps"))
+        tuner = transfer.SendTuner() if chunk is None else \
+            transfer.SendTuner(chunk_size=chunk, adaptive=False)
+        send_batch(writer, entries, reader=reader, tuner=tuner,
+                   compress=options["compression"] if compress else None)
+        transfer.end_session(writer)
+        done.wait()
+        elapsed = time.monotonic() - start
+        cpu = time.process_time() - cpu_start
+        sock.close()
+        server.stop()
+
+        total = size * count
+        return {
+            "size": size,
+            "count": count,
+            "chunk": chunk or "auto",
+            "final_chunk": tuner.chunk_size,
+            "mb_s": round(total / elapsed / 1e6, 3),
+            "ttfb_ms": round((listener.first_byte_at - start) * 1000, 2),
+            "first_file_ms": round((first_file[0] - start) * 1000, 2) if first_file else None,
+            "elapsed_s": round(elapsed, 3),
+            "cpu_s": round(cpu, 3),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _run_isolated(case):
+    """Lanza un caso en un subproceso y recoge su resultado en JSON"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+        capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banco de pruebas de transferencia")
+    parser.add_argument("--sizes", default="64K,1M,32M", help="Tamaños de archivo")
+    parser.add_argument("--chunks", default="auto,16K,256K", help="Fragmentos ('auto' = ajuste)")
+    parser.add_argument("--counts", default="1,100", help="Número de archivos por caso")
+    parser.add_argument("--bandwidth", default=None, help="Ancho de banda simulado (p. ej. 250K)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia en un sentido (s)")
+    parser.add_argument("--content", choices=("random", "text"), default="random")
+    parser.add_argument("--no-compress", action="store_true", help="Desactiva la compresión")
+    parser.add_argument("--max-bytes", default="256M", help="Omite casos más grandes")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON por líneas")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        print(json.dumps(run_case(**json.loads(args.case))))
+        return 0
+
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    chunks = [None if c == "auto" else parse_size(c) for c in args.chunks.split(",")]
+    counts = [int(c) for c in args.counts.split(",")]
+    bandwidth = parse_size(args.bandwidth) if args.bandwidth else None
+    max_bytes = parse_size(args.max_bytes)
+
+    columns = ("size", "count", "chunk", "final_chunk", "mb_s", "ttfb_ms",
+               "first_file_ms", "elapsed_s", "cpu_s", "peak_rss_mb")
+    if not args.json:
+        print(" ".join(f"{c:>13}" for c in columns))
+    for size, count, chunk in itertools.product(sizes, counts, chunks):
+        if size * count > max_bytes:
+            continue
+        result = _run_isolated({
+            "size": size, "count": count, "chunk": chunk, "bandwidth": bandwidth,
+            "latency": args.latency, "content": args.content,
+            "compress": not args.no_compress,
+        })
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(" ".join(f"{str(result[c]):>13}" for c in columns))
+        sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
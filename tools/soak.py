@@ -0,0 +1,438 @@
+"""
+PRUEBA DE RESISTENCIA DEL MODO SERVIDOR
+Monta un receptor como el de la app (SessionServer sobre MuxServerSocket en un
+IOCore compartido) encima del transporte local y le lanza miles de ciclos:
+envíos completos, cortes bruscos a mitad de archivo, conexiones que se cierran
+sin decir nada, envíos por un canal multiplexado persistente, reconexiones de
+ConnectionManager tras perder el enlace y paradas y arranques del servidor.
+
+Cada cierto número de ciclos mide RSS, memoria de Python (tracemalloc),
+descriptores abiertos e hilos vivos. La línea base se toma tras el
+calentamiento; si al final alguna medida ha crecido más que su umbral, muestra
+qué hilos, descriptores y asignaciones han aparecido y sale con código 1.
+
+Uso:
+    python tools/soak.py
+    python tools/soak.py --cycles 20000 --sample-every 500 --json > muestras.jsonl
+    python tools/soak.py --duration 3600 --kinds corte,reconexion --max-threads 2
+"""
+import argparse
+import collections
+import contextlib
+import gc
+import json
+import os
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import CancelledError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import transfer  # noqa: E402
+from batch import expand_selection, send_batch  # noqa: E402
+from connection import ConnectionManager  # noqa: E402
+from dedup import INDEX_FILE, HashCache  # noqa: E402
+from iocore import STOP_TIMEOUT, IOCore  # noqa: E402
+from mux import MuxConnector, MuxServerSocket  # noqa: E402
+from server import MAX_SESSIONS, SessionServer  # noqa: E402
+from storage import PARTIAL_DIR  # noqa: E402
+from transport import LoopbackServerSocket  # noqa: E402
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+KINDS = ("envio", "corte", "mudo", "canal", "reconexion")
+PEER_ADDRESS = "02:00:00:00:00:10"  # MAC ficticia del receptor para ConnectionManager
+SMALL_FILES = 8
+SMALL_SIZE = 16 * 1024
+IDLE_TIMEOUT = 10.0  # Segundos que se espera a que terminen las sesiones antes de medir
+
+
+def _rss_bytes():
+    """RSS actual; sin /proc, el pico (ru_maxrss) como aproximación"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _fd_dir():
+    for path in ("/proc/self/fd", "/dev/fd"):
+        if os.path.isdir(path):
+            return path
+    return None
+
+
+def _open_fds():
+    """Descriptores abiertos por tipo (socket, pipe, archivo...)"""
+    directory = _fd_dir()
+    if directory is None:
+        return collections.Counter()
+    kinds = collections.Counter()
+    for name in os.listdir(directory):
+        try:
+            target = os.readlink(os.path.join(directory, name))
+        except OSError:
+            continue  # El propio listdir, ya cerrado
+        kinds[target.split(":", 1)[0] if ":" in target else "archivo"] += 1
+    return kinds
+
+
+def _live_threads():
+    """Hilos vivos por nombre sin números (servidor-bloqueo-3 -> servidor-bloqueo-N)"""
+    return collections.Counter(re.sub(r"\d+", "N", thread.name)
+                               for thread in threading.enumerate())
+
+
+def _growth(before, after):
+    return {key: after[key] - before.get(key, 0)
+            for key in after if after[key] > before.get(key, 0)}
+
+
+def _make_files(directory, big_size):
+    small = os.path.join(directory, "lote")
+    os.makedirs(small)
+    for index in range(SMALL_FILES):
+        with open(os.path.join(small, f"pequeno_{index}.bin"), "wb") as f:
+            f.write(os.urandom(SMALL_SIZE))
+    big = os.path.join(directory, "grande.bin")
+    with open(big, "wb") as f:
+        f.write(os.urandom(big_size))
+    return expand_selection([small]), expand_selection([big])
+
+
+class _LoopbackConnector:
+    """Conector de ConnectionManager hacia el servidor local vigente"""
+
+    resolve = None
+
+    def __init__(self, soak):
+        self.soak = soak
+
+    def connect(self, address, channel=None):
+        return self.soak.loopback.connect(), None
+
+
+class _Aborted(Exception):
+    pass
+
+
+# =============================================================================
+# PRUEBA
+# =============================================================================
+class Soak:
+    """Receptor de la app más los clientes que lo ejercitan, ciclo a ciclo"""
+
+    def __init__(self, work_dir, big_size, bandwidth=None):
+        self.dest_dir = os.path.join(work_dir, "recibidos")
+        src_dir = os.path.join(work_dir, "origen")
+        os.makedirs(self.dest_dir)
+        os.makedirs(src_dir)
+        self.small, self.big = _make_files(src_dir, big_size)
+        self.bandwidth = bandwidth
+        self.core = IOCore(max_blocking=MAX_SESSIONS + 2, name="soak").start()
+        self.loopback = None
+        self.server = None
+        self.server_task = None
+        self.sessions = collections.Counter()  # Estado final -> sesiones
+        self.errors = collections.Counter()  # Errores del lado cliente por tipo de ciclo
+        self.connector = MuxConnector(_LoopbackConnector(self))
+        self.connections = ConnectionManager(self.connector, attempts=3)
+        self.hashes = HashCache()
+
+    # -------------------------------------------------------------------------
+    # SERVIDOR (como start_server_mode / stop_server de la app)
+    # -------------------------------------------------------------------------
+    def start_server(self):
+        self.loopback = LoopbackServerSocket(bandwidth=self.bandwidth)
+        self.server = SessionServer(
+            MuxServerSocket(self.loopback), self.dest_dir, core=self.core,
+            on_session_end=lambda session: self.sessions.update([session.state]))
+        self.server_task = self.core.submit(self.server.serve())
+
+    def stop_server(self):
+        self.server.stop()
+        self.server_task.cancel()
+        try:
+            self.server_task.result(STOP_TIMEOUT)
+        except (CancelledError, Exception):
+            pass
+        self.server = None
+        self.server_task = None
+
+    def close(self):
+        self.connections.close()
+        self.connector.close()
+        if self.server:
+            self.stop_server()
+        self.core.stop()
+
+    # -------------------------------------------------------------------------
+    # CICLOS
+    # -------------------------------------------------------------------------
+    def run_cycle(self, kind):
+        try:
+            getattr(self, f"_cycle_{kind}")()
+        except _Aborted:
+            pass
+        except Exception as e:
+            self.errors[f"{kind}: {type(e).__name__}"] += 1
+
+    def _send_direct(self, entries, on_progress=None):
+        sock = self.loopback.connect()
+        try:
+            reader, writer = transfer.open_session(sock)
+            hello = transfer.client_handshake(reader, writer)
+            options = transfer.negotiate(transfer.local_capabilities(), hello.get("caps"))
+            progress = (lambda done, total: on_progress(sock, done, total)) if on_progress else None
+            send_batch(writer, entries, reader=reader, compress=options["compression"],
+                       on_progress=progress)
+            transfer.end_session(writer)
+        finally:
+            sock.close()
+
+    def _cycle_envio(self):
+        """Conexión nueva, lote de archivos pequeños y cierre ordenado"""
+        self._send_direct(self.small)
+
+    def _cycle_corte(self):
+        """Cierre brusco del socket a mitad de un archivo reanudable"""
+        def cut(sock, done, total):
+            if done >= total // 2:
+                sock.close()
+                raise _Aborted()
+        self._send_direct(self.big, on_progress=cut)
+
+    def _cycle_mudo(self):
+        """Conecta y cierra sin enviar un byte (el servidor no llega a detectar el tipo)"""
+        self.loopback.connect().close()
+
+    def _send_channel(self, entries):
+        with self.connections.use(PEER_ADDRESS) as conn:
+            send_batch(conn.writer, entries, reader=conn.reader, tuner=conn.tuner,
+                       compress=conn.options["compression"],
+                       hashes=self.hashes if conn.options.get("dedup") else None)
+
+    def _cycle_canal(self):
+        """Envío por la conexión multiplexada persistente (se reabre si se perdió)"""
+        self._send_channel(self.small)
+
+    def _cycle_reconexion(self):
+        """Se pierde el enlace multiplexado; el envío falla una vez y se reconecta"""
+        mux = self.connector.multiplexer(PEER_ADDRESS)
+        if mux is not None:
+            mux.socket.close()
+            with contextlib.suppress(Exception):
+                self._send_channel(self.small)
+        self._send_channel(self.small)
+
+    # -------------------------------------------------------------------------
+    # MEDIDAS
+    # -------------------------------------------------------------------------
+    def settle(self):
+        """
+        Deja el proceso en reposo antes de medir: cierra la conexión
+        persistente (el siguiente ciclo de canal la reabre), espera a que
+        terminen las sesiones y a que hilos y descriptores dejen de cambiar.
+        """
+        self.connections.close(PEER_ADDRESS)
+        self.connector.close()
+        deadline = time.monotonic() + IDLE_TIMEOUT
+        while self.server.active_count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        previous = None
+        while time.monotonic() < deadline:
+            current = (threading.active_count(), sum(_open_fds().values()))
+            if current == previous:
+                break
+            previous = current
+            time.sleep(0.1)
+        return self.server.active_count
+
+    def prune(self):
+        """Borra lo recibido (no los .part en curso ni los diarios) para no llenar el disco"""
+        for dirpath, dirnames, filenames in os.walk(self.dest_dir):
+            if PARTIAL_DIR in dirnames:
+                dirnames.remove(PARTIAL_DIR)
+            for filename in filenames:
+                if filename == INDEX_FILE or filename.endswith(transfer.PARTIAL_SUFFIX):
+                    continue
+                with contextlib.suppress(OSError):
+                    os.unlink(os.path.join(dirpath, filename))
+
+    def sample(self, cycle, started):
+        active = self.settle()
+        gc.collect()
+        heap = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        fds = _open_fds()
+        threads = _live_threads()
+        return {
+            "cycle": cycle,
+            "elapsed_s": round(time.monotonic() - started, 1),
+            "rss_mb": round(_rss_bytes() / 1024 ** 2, 2),
+            "heap_mb": round(heap / 1024 ** 2, 3),
+            "fds": sum(fds.values()),
+            "threads": sum(threads.values()),
+            "active": active,
+            "_fds": fds,
+            "_threads": threads,
+        }
+
+
+# =============================================================================
+# INFORME
+# =============================================================================
+COLUMNS = ("cycle", "elapsed_s", "rss_mb", "heap_mb", "fds", "threads", "active")
+
+
+def _public(sample):
+    return {key: value for key, value in sample.items() if not key.startswith("_")}
+
+
+def check(baseline, final, limits):
+    """Medidas que superan su umbral: [(nombre, crecimiento, umbral)]"""
+    failures = []
+    for name, limit in limits.items():
+        growth = final[name] - baseline[name]
+        if growth > limit:
+            failures.append((name, round(growth, 3), limit))
+    return failures
+
+
+def print_diagnosis(baseline, final, baseline_snapshot, top):
+    threads = _growth(baseline["_threads"], final["_threads"])
+    if threads:
+        print("\nhilos nuevos: " + ", ".join(f"{n} x{c}" for n, c in sorted(threads.items())))
+    fds = _growth(baseline["_fds"], final["_fds"])
+    if fds:
+        print("descriptores nuevos: " + ", ".join(f"{n} x{c}" for n, c in sorted(fds.items())))
+    if baseline_snapshot is None:
+        return
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    print(f"\n{'asignación (crecimiento desde la línea base)':<64} {'KB':>10} {'bloques':>9}")
+    for stat in snapshot.compare_to(baseline_snapshot, "lineno")[:top]:
+        frame = stat.traceback[0]
+        where = f"{os.path.relpath(frame.filename, ROOT)}:{frame.lineno}"
+        print(f"{where:<64} {stat.size_diff / 1024:>10.1f} {stat.count_diff:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de resistencia del modo servidor")
+    parser.add_argument("--cycles", type=int, default=5000, help="Ciclos tras el calentamiento")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Segundos como máximo (se para antes si se acaban los ciclos)")
+    parser.add_argument("--warmup", type=int, default=200,
+                        help="Ciclos antes de tomar la línea base")
+    parser.add_argument("--kinds", default=",".join(KINDS),
+                        help=f"Tipos de ciclo, en turno rotatorio ({', '.join(KINDS)})")
+    parser.add_argument("--restart-every", type=int, default=500,
+                        help="Ciclos entre paradas y arranques del servidor (0 = nunca)")
+    parser.add_argument("--sample-every", type=int, default=250, help="Ciclos entre medidas")
+    parser.add_argument("--big-size", type=int, default=2 * 1024 * 1024,
+                        help="Bytes del archivo que se corta a medias")
+    parser.add_argument("--bandwidth", type=int, default=None,
+                        help="Ancho de banda simulado del servidor (bytes/s)")
+    parser.add_argument("--max-rss-mb", type=float, default=32.0)
+    parser.add_argument("--max-heap-mb", type=float, default=8.0)
+    parser.add_argument("--max-fds", type=int, default=8)
+    parser.add_argument("--max-threads", type=int, default=4)
+    parser.add_argument("--no-tracemalloc", action="store_true",
+                        help="Sin tracemalloc (más rápido; no mide la memoria de Python)")
+    parser.add_argument("--top", type=int, default=15, help="Asignaciones a mostrar si falla")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON por líneas")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Muestra las trazas de error de las sesiones cortadas")
+    args = parser.parse_args(argv)
+
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    unknown = set(kinds) - set(KINDS)
+    if unknown or not kinds:
+        parser.error(f"Tipos de ciclo desconocidos: {', '.join(sorted(unknown)) or '(ninguno)'}")
+    limits = {"rss_mb": args.max_rss_mb, "heap_mb": args.max_heap_mb,
+              "fds": args.max_fds, "threads": args.max_threads}
+    if args.no_tracemalloc:
+        del limits["heap_mb"]
+    else:
+        tracemalloc.start()
+
+    work_dir = tempfile.mkdtemp(prefix="btd_soak_")
+    # Los cortes provocan a propósito miles de trazas de error en el receptor
+    soak = None
+    try:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                stack.enter_context(contextlib.redirect_stderr(
+                    stack.enter_context(open(os.devnull, "w"))))
+            soak = Soak(work_dir, args.big_size, args.bandwidth)
+            soak.start_server()
+            started = time.monotonic()
+            deadline = started + args.duration if args.duration else None
+            baseline = baseline_snapshot = final = None
+            total = args.warmup + args.cycles
+            if not args.json:
+                print(" ".join(f"{c:>10}" for c in COLUMNS))
+            for cycle in range(1, total + 1):
+                soak.run_cycle(kinds[cycle % len(kinds)])
+                if args.restart_every and cycle % args.restart_every == 0:
+                    soak.stop_server()
+                    soak.start_server()
+                soak.prune()
+                last = cycle == total or (deadline and time.monotonic() >= deadline)
+                if cycle == args.warmup or cycle % args.sample_every == 0 or last:
+                    final = soak.sample(cycle, started)
+                    if cycle == args.warmup:
+                        baseline = final
+                        if tracemalloc.is_tracing():
+                            baseline_snapshot = tracemalloc.take_snapshot()
+                    if args.json:
+                        print(json.dumps(_public(final)))
+                    else:
+                        print(" ".join(f"{str(final[c]):>10}" for c in COLUMNS))
+                    sys.stdout.flush()
+                if last:
+                    break
+
+            if baseline is None:
+                print("Sin línea base: hacen falta más ciclos que --warmup")
+                return 2
+            failures = check(baseline, final, limits)
+            summary = {
+                "cycles": final["cycle"],
+                "growth": {name: round(final[name] - baseline[name], 3) for name in limits},
+                "sessions": dict(soak.sessions),
+                "client_errors": dict(soak.errors),
+                "failures": [name for name, _, _ in failures],
+            }
+            if args.json:
+                print(json.dumps(summary))
+            else:
+                print(f"\nsesiones: {dict(soak.sessions)}")
+                if soak.errors:
+                    print(f"errores del cliente: {dict(soak.errors)}")
+                for name, growth, limit in failures:
+                    print(f"FALLO: {name} creció {growth} (umbral {limit})")
+                if failures:
+                    print_diagnosis(baseline, final, baseline_snapshot, args.top)
+                else:
+                    print("Sin crecimiento por encima de los umbrales")
+            return 1 if failures else 0
+    finally:
+        if soak is not None:
+            soak.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+RESUMEN DE TRAZAS
+Lee uno o varios archivos de trazas (tracing.py) y muestra dónde se fue el
+tiempo: tramos por nombre, contadores acumulados y, si se grabó con el
+perfilador, las funciones con más muestras.
+
+Uso:
+    python tools/trace_summary.py trazas.jsonl
+    python tools/trace_summary.py emisor.jsonl receptor.jsonl --top 30
+    python tools/trace_summary.py trazas.jsonl --folded > perfil.folded   # flame graph
+"""
+import argparse
+import collections
+import json
+import sys
+
+
+def load(paths):
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def summarize(records):
+    spans = collections.defaultdict(list)
+    errors = collections.Counter()
+    counters = collections.defaultdict(lambda: [0, 0])
+    stacks = collections.Counter()
+    for record in records:
+        kind = record.get("type")
+        if kind == "span":
+            spans[record["name"]].append(record["dur"])
+            if "error" in record:
+                errors[record["name"]] += 1
+        elif kind == "counters":
+            for name, value in record["values"].items():
+                counters[name][0] += value["n"]
+                counters[name][1] += value["sum"]
+        elif kind == "profile":
+            stacks[(record["thread"], record["stack"])] += record["samples"]
+    return spans, errors, counters, stacks
+
+
+def print_report(spans, errors, counters, stacks, top):
+    print(f"{'tramo':<24} {'n':>7} {'total s':>10} {'media ms':>10} {'máx ms':>10} {'errores':>8}")
+    for name, durations in sorted(spans.items(), key=lambda item: -sum(item[1])):
+        print(f"{name:<24} {len(durations):>7} {sum(durations):>10.3f} "
+              f"{sum(durations) / len(durations) * 1000:>10.2f} {max(durations) * 1000:>10.2f} "
+              f"{errors.get(name, 0):>8}")
+    if counters:
+        print(f"\n{'contador':<24} {'n':>9} {'suma':>16}")
+        for name, (n, total) in sorted(counters.items()):
+            print(f"{name:<24} {n:>9} {total:>16.4f}")
+    if stacks:
+        # Tiempo propio: muestras en las que la función está en lo alto de la pila
+        leaves = collections.Counter()
+        for (thread, stack), samples in stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += samples
+        total = sum(leaves.values())
+        print(f"\n{'función (muestras propias)':<48} {'muestras':>9} {'%':>6}")
+        for function, samples in leaves.most_common(top):
+            print(f"{function:<48} {samples:>9} {samples * 100 / total:>6.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumen de archivos de trazas")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--top", type=int, default=20, help="Funciones del perfil a mostrar")
+    parser.add_argument("--folded", action="store_true",
+                        help="Solo las pilas del perfil en formato plegado")
+    args = parser.parse_args(argv)
+
+    spans, errors, counters, stacks = summarize(load(args.paths))
+    if args.folded:
+        for (thread, stack), samples in stacks.most_common():
+            print(f"{thread};{stack} {samples}")
+        return 0
+    print_report(spans, errors, counters, stacks, args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
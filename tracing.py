@@ -0,0 +1,308 @@
+"""
+TRAZAS Y PERFILADO
+Tramos con nombre (span), contadores y eventos escritos como JSON por líneas,
+más un perfilador por muestreo opcional. Se activa y desactiva en marcha con
+start()/stop(); apagado, span() devuelve un objeto vacío compartido y count()
+sale en la primera línea, así que la instrumentación puede quedarse en el
+código sin coste apreciable.
+
+Líneas del archivo (campo "type"):
+    span      name, ts, dur, id, parent, thread, error y campos propios
+    event     name, ts, thread y campos propios
+    counters  ts e intervalo; por contador n (llamadas) y sum (valor sumado)
+    profile   thread, stack (raíz;...;hoja) y samples
+"""
+import collections
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+TRACE_ENV = "BTD_TRACE"  # Ruta del archivo de trazas para activarlas al arrancar
+PROFILE_ENV = "BTD_PROFILE"  # Intervalo de muestreo en segundos (requiere BTD_TRACE)
+COUNTER_INTERVAL = 1.0  # Segundos entre volcados de contadores
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_DEPTH = 48
+PROFILE_MAX_STACKS = 500  # Pilas más frecuentes que se escriben al parar
+
+_tracer = None
+_local = threading.local()
+_ids = itertools.count(1)
+
+
+class _NullSpan:
+    """Tramo que no hace nada: lo que devuelve span() con las trazas apagadas"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, fields):
+        self.tracer = tracer
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.span_id = next(_ids)
+        self.parent = stack[-1] if stack else None
+        stack.append(self.span_id)
+        self.ts = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        _local.stack.pop()
+        record = {
+            "type": "span",
+            "name": self.name,
+            "ts": self.ts,
+            "dur": duration,
+            "id": self.span_id,
+            "parent": self.parent,
+            "thread": threading.current_thread().name,
+        }
+        if exc is not None:
+            record["error"] = repr(exc)
+        record.update(self.fields)
+        self.tracer.write(record)
+        return False
+
+    def set(self, **fields):
+        """Añade campos conocidos a mitad del tramo (p. ej. bytes enviados)"""
+        self.fields.update(fields)
+
+
+# =============================================================================
+# API
+# =============================================================================
+def enabled():
+    return _tracer is not None
+
+
+def span(name, /, **fields):
+    """Context manager que mide un tramo; con las trazas apagadas no hace nada"""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return Span(tracer, name, fields)
+
+
+def count(name, value=1):
+    """Suma `value` al contador `name` (p. ej. bytes o segundos de una llamada)"""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.count(name, value)
+
+
+def clock():
+    """Marca para count_since(); None con las trazas apagadas (no se mide nada)"""
+    return time.perf_counter() if _tracer is not None else None
+
+
+def count_since(name, started):
+    """Suma al contador `name` los segundos desde clock()"""
+    tracer = _tracer
+    if started is not None and tracer is not None:
+        tracer.count(name, time.perf_counter() - started)
+
+
+def event(name, /, **fields):
+    tracer = _tracer
+    if tracer is not None:
+        tracer.write(dict(type="event", name=name, ts=time.time(),
+                          thread=threading.current_thread().name, **fields))
+
+
+def traced_stream(stream, prefix):
+    """
+    Envuelve un InputStream/OutputStream para contar llamadas, bytes y tiempo
+    de read/write/flush (las llamadas JNI en Android). Solo se envuelve si las
+    trazas están activas al abrir la sesión.
+    """
+    return stream if _tracer is None else TracedStream(stream, prefix)
+
+
+class TracedStream:
+    def __init__(self, stream, prefix):
+        self.stream = stream
+        self.prefix = prefix
+
+    def read(self, buffer, offset=0, length=None):
+        started = time.perf_counter()
+        if length is None:
+            n = self.stream.read(buffer, offset, len(buffer) - offset)
+        else:
+            n = self.stream.read(buffer, offset, length)
+        count_since(self.prefix + ".read_s", started)
+        count(self.prefix + ".read_bytes", max(n, 0))
+        return n
+
+    def write(self, data):
+        started = time.perf_counter()
+        self.stream.write(data)
+        count_since(self.prefix + ".write_s", started)
+        count(self.prefix + ".write_bytes", len(data))
+
+    def flush(self):
+        started = time.perf_counter()
+        self.stream.flush()
+        count_since(self.prefix + ".flush_s", started)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def start(path, profile_interval=None):
+    """Empieza a escribir en `path` (se añade al final); con intervalo, también muestrea"""
+    global _tracer
+    stop()
+    _tracer = Tracer(path, profile_interval)
+    return path
+
+
+def start_from_env():
+    """Activa las trazas si BTD_TRACE indica un archivo"""
+    path = os.environ.get(TRACE_ENV)
+    if not path:
+        return None
+    interval = os.environ.get(PROFILE_ENV)
+    return start(path, float(interval) if interval else None)
+
+
+def stop():
+    """Vuelca contadores y perfil pendientes y cierra el archivo"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+
+
+# =============================================================================
+# ESCRITOR
+# =============================================================================
+class Tracer:
+    def __init__(self, path, profile_interval=None):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._counters_since = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name="trazas", daemon=True)
+        self._thread.start()
+        self.sampler = None
+        if profile_interval:
+            self.sampler = Sampler(profile_interval, exclude=(self._thread.ident,))
+            self.sampler.start()
+        self.write({"type": "event", "name": "trace.start", "ts": time.time(),
+                    "thread": threading.current_thread().name, "pid": os.getpid(),
+                    "profile_interval": profile_interval})
+
+    def write(self, record):
+        line = json.dumps(record, default=str, separators=(",", ":"))
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line + "\n")
+
+    def count(self, name, value):
+        with self._lock:
+            entry = self._counters.get(name)
+            if entry is None:
+                self._counters[name] = [1, value]
+            else:
+                entry[0] += 1
+                entry[1] += value
+
+    def _flush_counters(self):
+        now = time.time()
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            since, self._counters_since = self._counters_since, now
+        if counters:
+            self.write({"type": "counters", "ts": now, "interval": now - since,
+                        "values": {name: {"n": n, "sum": total}
+                                   for name, (n, total) in counters.items()}})
+
+    def _flush_loop(self):
+        while not self._stop.wait(COUNTER_INTERVAL):
+            self._flush_counters()
+            with self._lock:
+                self._file.flush()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        if self.sampler:
+            self.sampler.stop()
+            for record in self.sampler.records():
+                self.write(record)
+        self._flush_counters()
+        with self._lock:
+            self._file.close()
+
+
+class Sampler:
+    """
+    Perfilador por muestreo: cada `interval` segundos toma la pila de todos
+    los hilos con sys._current_frames() y cuenta pilas iguales. Solo ve código
+    Python; el tiempo en JNI o en el sistema aparece en la función que lo llamó.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL, exclude=()):
+        self.interval = interval
+        self.exclude = set(exclude)
+        self.samples = collections.Counter()
+        self.total = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="perfilador", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or ident in self.exclude:
+                    continue
+                self.samples[(names.get(ident, str(ident)), _fold(frame))] += 1
+            self.total += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def records(self):
+        for (thread, stack), samples in self.samples.most_common(PROFILE_MAX_STACKS):
+            yield {"type": "profile", "thread": thread, "stack": stack,
+                   "samples": samples, "interval": self.interval}
+
+
+def _fold(frame):
+    """Pila en formato plegado (raíz;...;hoja) como la usan los flame graphs"""
+    parts = []
+    while frame is not None and len(parts) < PROFILE_MAX_DEPTH:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
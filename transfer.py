@@ -0,0 +1,745 @@
+"""
+MOTOR DE TRANSFERENCIA
+Envío y recepción de archivos sobre el protocolo de tramas (sin dependencias de Kivy)
+"""
+import hashlib
+import mmap
+import os
+import time
+
+from protocol import (
+    PROTOCOL_NAME, PROTOCOL_VERSION, FRAME_HELLO, FRAME_FILE, FRAME_DATA,
+    FRAME_END, FRAME_BYE, FRAME_ACCEPT, FRAME_CODEC, FRAME_SIGNATURES, FRAME_COPY,
+    FRAME_PING, FRAME_VERIFY, FRAME_REPAIR, FRAME_OFFER, FRAME_HAVE,
+    FrameReader, FrameWriter,
+    ProtocolError, decode_json,
+)
+import compression
+import dedup
+import delta
+import integrity
+import tracing
+from pipeline import ReceivePipeline
+from storage import PARTIAL_DIR, TransferJournal, wait_unmapped
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+INITIAL_CHUNK_SIZE = 128 * 1024  # Se empieza con escrituras grandes
+MIN_CHUNK_SIZE = 8 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+TUNING_WINDOW = 0.5  # Segundos de envío por cada medición de rendimiento
+FLUSH_PERIOD = 1.0  # Segundos de datos que se acumulan entre flush
+RESUME_MIN_SIZE = 1024 * 1024  # Por debajo no compensa esperar la negociación
+MMAP_SEND_MIN_SIZE = 8 * 1024 * 1024  # Archivos que se envían desde un mmap
+MMAP_WINDOW = 8 * 1024 * 1024  # Bytes enviados tras los que se sueltan sus páginas
+PARTIAL_SUFFIX = ".part"
+
+
+# =============================================================================
+# SALUDO INICIAL
+# =============================================================================
+def _hello(capabilities):
+    return {
+        "proto": PROTOCOL_NAME,
+        "version": PROTOCOL_VERSION,
+        "caps": capabilities or {},
+    }
+
+
+def _check_hello(hello):
+    if hello.get("proto") != PROTOCOL_NAME:
+        raise ProtocolError("El otro extremo no habla este protocolo")
+    if hello.get("version") != PROTOCOL_VERSION:
+        raise ProtocolError(f"Versión de protocolo incompatible: {hello.get('version')}")
+    return hello
+
+
+def local_capabilities():
+    """Capacidades que este extremo anuncia en el saludo"""
+    caps = {"keepalive": True, "integrity": True, "dedup": True}
+    caps.update(compression.capabilities())
+    return caps
+
+
+def negotiate(client_caps, server_caps):
+    """Opciones de sesión acordadas a partir de los dos saludos"""
+    return {
+        "compression": compression.negotiate(client_caps, server_caps),
+        # Un receptor antiguo rechazaría PING como trama inesperada
+        "keepalive": bool((server_caps or {}).get("keepalive")),
+        "verify": bool((server_caps or {}).get("integrity")),
+        # Solo un receptor con índice de contenido entiende OFFER
+        "dedup": bool((server_caps or {}).get("dedup")),
+    }
+
+
+def client_handshake(reader, writer, capabilities=None):
+    """El cliente saluda primero y espera la respuesta del servidor"""
+    writer.write_json(FRAME_HELLO, _hello(capabilities or local_capabilities()))
+    writer.flush()
+    return _check_hello(reader.expect(FRAME_HELLO))
+
+
+def server_handshake(reader, writer, capabilities=None):
+    """El servidor espera el saludo del cliente y responde con el suyo"""
+    hello = _check_hello(reader.expect(FRAME_HELLO))
+    writer.write_json(FRAME_HELLO, _hello(capabilities or local_capabilities()))
+    writer.flush()
+    return hello
+
+
+def open_session(socket):
+    """Crea lector y escritor de tramas a partir de un BluetoothSocket conectado"""
+    return (FrameReader(tracing.traced_stream(socket.getInputStream(), "net")),
+            FrameWriter(tracing.traced_stream(socket.getOutputStream(), "net")))
+
+
+# =============================================================================
+# AJUSTE AUTOMÁTICO DEL ENVÍO
+# =============================================================================
+class SendTuner:
+    """
+    Elige el tamaño de fragmento y la frecuencia de flush según el rendimiento medido.
+    Cada write() es una llamada JNI con conversión bytes -> byte[], así que se
+    prueba a duplicar o reducir el fragmento mientras el rendimiento mejore.
+    """
+
+    def __init__(self, chunk_size=INITIAL_CHUNK_SIZE, adaptive=True):
+        self.chunk_size = chunk_size
+        self.adaptive = adaptive  # False fija el fragmento (útil para medir)
+        self.flush_interval = chunk_size
+        self.throughput = 0.0  # Bytes por segundo de la última ventana
+        self._direction = 2
+        self._window_bytes = 0
+        self._window_time = 0.0
+        self._unflushed = 0
+        self._buffer = None
+
+    @property
+    def buffer(self):
+        """Búfer de lectura reutilizable entre archivos de la misma conexión"""
+        if self._buffer is None:
+            self._buffer = memoryview(bytearray(MAX_CHUNK_SIZE))
+        return self._buffer
+
+    def record_write(self, nbytes, elapsed):
+        """Registra una escritura y reajusta los parámetros al cerrar cada ventana"""
+        self._window_bytes += nbytes
+        self._window_time += elapsed
+        self._unflushed += nbytes
+        if self._window_time < TUNING_WINDOW:
+            return
+
+        throughput = self._window_bytes / self._window_time
+        if self.adaptive:
+            if throughput < self.throughput * 1.05:
+                # Sin mejora apreciable: probar en la dirección contraria
+                self._direction = 1 / self._direction
+            new_size = int(self.chunk_size * self._direction)
+            self.chunk_size = max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, new_size))
+        self.throughput = throughput
+        self.flush_interval = max(self.chunk_size, int(throughput * FLUSH_PERIOD))
+        self._window_bytes = 0
+        self._window_time = 0.0
+
+    def should_flush(self):
+        """Indica si toca flush en este límite de trama"""
+        return self._unflushed >= self.flush_interval
+
+    def flushed(self):
+        self._unflushed = 0
+
+    @property
+    def params(self):
+        """Parámetros elegidos, para registro o depuración"""
+        return {
+            "chunk_size": self.chunk_size,
+            "flush_interval": self.flush_interval,
+            "throughput": round(self.throughput),
+        }
+
+
+# =============================================================================
+# ENVÍO
+# =============================================================================
+def transfer_id(path, name, size):
+    """Identificador estable de un envío: mismo archivo sin cambios, mismo id"""
+    stat = os.stat(path)
+    key = f"{name}|{size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+
+def choose_compressor(path, sample, options):
+    """Devuelve (nombre, compresor) o (None, None) si no conviene comprimir"""
+    options = options or {}
+    codec_name = options.get("codec")
+    if not codec_name or not compression.should_compress(path, sample):
+        return None, None
+    codec = compression.get_codec(codec_name)
+    return codec_name, codec.compressor(options.get("level", compression.DEFAULT_LEVEL))
+
+
+def _iter_chunks(path, offset, tuner, data):
+    """
+    Fragmentos a enviar: vistas sobre `data` si ya está en memoria, sobre un
+    mmap del archivo si es grande, o lecturas del disco en el búfer del tuner.
+    """
+    if data is not None:
+        view = memoryview(data)
+        while offset < len(view):
+            # El tuner puede cambiar chunk_size mientras se envía el fragmento
+            chunk = view[offset:offset + tuner.chunk_size]
+            offset += len(chunk)
+            yield chunk
+        return
+    if os.path.getsize(path) >= MMAP_SEND_MIN_SIZE:
+        yield from _iter_mapped(path, offset, tuner)
+        return
+    view = tuner.buffer
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            bytes_read = f.readinto(view[:tuner.chunk_size])
+            if not bytes_read:
+                break
+            yield view[:bytes_read]
+
+
+def _iter_mapped(path, offset, tuner):
+    """
+    Vistas sobre el archivo mapeado, sin copiarlo a un búfer de Python.
+    Cada vista se libera al pedir la siguiente para poder cerrar el mmap, y
+    las páginas ya enviadas se sueltan por ventanas para no inflar la memoria.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            released = offset - offset % mmap.ALLOCATIONGRANULARITY
+            with memoryview(mapped) as view:
+                while offset < len(view):
+                    chunk = view[offset:offset + tuner.chunk_size]
+                    offset += len(chunk)
+                    try:
+                        yield chunk
+                    finally:
+                        chunk.release()
+                    if offset - released >= MMAP_WINDOW and hasattr(mapped, "madvise"):
+                        end = offset - offset % mmap.ALLOCATIONGRANULARITY
+                        mapped.madvise(mmap.MADV_DONTNEED, released, end - released)
+                        released = end
+
+
+def _read_sample(path, offset, data):
+    if data is not None:
+        return data[offset:offset + compression.SAMPLE_SIZE]
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(compression.SAMPLE_SIZE)
+
+
+def send_file(writer, path, name=None, metadata=None, on_progress=None, tuner=None,
+              reader=None, compress=None, data=None, final_flush=True, verify=False,
+              basis=None):
+    """
+    Envía un archivo completo (cabecera, datos y fin) sin cerrar la conexión.
+    Con `reader`, los archivos grandes negocian un desplazamiento de reanudación.
+    `compress` son las opciones de compresión acordadas en el saludo.
+    `data` es el contenido ya leído (envío por lotes); con final_flush=False
+    las tramas pueden quedarse acumuladas para juntarlas con el siguiente archivo.
+    El resumen va siempre en END; con `verify` los archivos reanudables esperan
+    el veredicto del receptor y reenvían los bloques que lleguen dañados.
+    `basis` ({"digest", "size"} de la versión anterior de este mismo archivo,
+    de dedup.HashCache.previous) permite al receptor pedir un envío delta si
+    aún la tiene.
+    """
+    tuner = tuner or SendTuner()
+    file_size = len(data) if data is not None else os.path.getsize(path)
+    name = name or os.path.basename(str(path))
+    header = {
+        "name": name,
+        "size": file_size,
+        "meta": metadata or {},
+    }
+    resumable = reader is not None and file_size >= RESUME_MIN_SIZE
+    verify = verify and resumable
+    if resumable:
+        header["id"] = transfer_id(path, name, file_size)
+        header["resume"] = True
+        # Si el receptor aún tiene la versión anterior, puede pedir un envío delta
+        if data is None and basis and delta.worth_trying(path, file_size, basis["size"]):
+            header["basis"] = {integrity.DIGEST_NAME: basis["digest"], "size": basis["size"]}
+        header["verify"] = verify
+    writer.write_json(FRAME_FILE, header)
+    digest = integrity.StreamDigest()
+
+    offset = 0
+    if resumable:
+        writer.flush()
+        reply = reader.expect(FRAME_ACCEPT)
+        if reply.get("mode") == "delta":
+            _send_delta(writer, reader, path, file_size, tuner, on_progress, digest)
+            _end_file(writer, reader, path, data, file_size, digest, verify)
+            tuner.flushed()
+            return file_size
+        offset = reply.get("offset", 0)
+        if not 0 <= offset <= file_size:
+            raise ProtocolError(f"Desplazamiento de reanudación inválido: {offset}")
+        if offset:
+            # Lo ya enviado en la conexión anterior también entra en el resumen
+            digest.update_from(path, offset, data)
+
+    # La decisión de comprimir va en una trama propia porque depende del offset
+    codec_name, compressor = choose_compressor(
+        path, _read_sample(path, offset, data), compress)
+    if codec_name:
+        writer.write_json(FRAME_CODEC, {"codec": codec_name})
+
+    sent_bytes = offset
+    for chunk in _iter_chunks(path, offset, tuner, data):
+        start = time.monotonic()
+        digest.update(chunk)
+        if compressor:
+            out = compressor.compress(chunk)
+            if out:
+                writer.write_frame(FRAME_DATA, out)
+        else:
+            writer.write_frame(FRAME_DATA, chunk)
+        # Solo se hace flush en límites de trama y cuando se ha acumulado bastante
+        if tuner.should_flush():
+            writer.flush()
+            tuner.flushed()
+        tuner.record_write(len(chunk), time.monotonic() - start)
+        sent_bytes += len(chunk)
+        if on_progress:
+            on_progress(sent_bytes, file_size)
+
+    if compressor:
+        out = compressor.flush()
+        if out:
+            writer.write_frame(FRAME_DATA, out)
+    _end_file(writer, reader, path, data, sent_bytes, digest, verify, final_flush)
+    if final_flush or verify:
+        tuner.flushed()
+    return sent_bytes
+
+
+def _end_file(writer, reader, path, data, size, digest, verify, final_flush=True):
+    """Trama END con el resumen; con `verify` atiende las peticiones de reparación"""
+    trailer = digest.trailer()
+    trailer["size"] = size
+    writer.write_json(FRAME_END, trailer)
+    if final_flush or verify:
+        writer.flush()
+    if not verify:
+        return
+    for _ in range(integrity.MAX_REPAIR_ROUNDS + 1):
+        reply = reader.expect(FRAME_VERIFY)
+        if reply.get("ok"):
+            return
+        blocks = reply.get("blocks") or []
+        if not blocks:
+            break
+        _send_repair(writer, path, data, trailer["block_size"], blocks)
+        writer.write_json(FRAME_END, trailer)
+        writer.flush()
+    raise integrity.IntegrityError(f"El receptor no pudo verificar {path}")
+
+
+def _send_repair(writer, path, data, block_size, blocks):
+    """Reenvía los bloques que el receptor ha marcado como dañados"""
+    with open(path, "rb") if data is None else memoryview(data) as source:
+        for index in blocks:
+            offset = index * block_size
+            if data is None:
+                source.seek(offset)
+                block = source.read(block_size)
+            else:
+                block = source[offset:offset + block_size]
+            writer.write_json(FRAME_REPAIR, {"offset": offset})
+            writer.write_frame(FRAME_DATA, block)
+
+
+def _send_delta(writer, reader, path, file_size, tuner, on_progress, digest):
+    """Envía solo literales y referencias a los bloques firmados por el receptor"""
+    frame = reader.read_frame()
+    if frame is None or frame[0] != FRAME_SIGNATURES:
+        raise ProtocolError("Se esperaban las firmas de bloques del receptor")
+    block_size, table = delta.parse_signatures(frame[1])
+    progress = [0]
+
+    def advance(nbytes, elapsed):
+        tuner.record_write(nbytes, elapsed)
+        if tuner.should_flush():
+            writer.flush()
+            tuner.flushed()
+        progress[0] += nbytes
+        if on_progress:
+            on_progress(progress[0], file_size)
+
+    def on_literal(data):
+        start = time.monotonic()
+        writer.write_frame(FRAME_DATA, data)
+        advance(len(data), time.monotonic() - start)
+
+    def on_copy(first_block, count):
+        writer.write_frame(FRAME_COPY, delta.pack_copy(first_block, count))
+        advance(count * block_size, 0.0)
+
+    with open(path, "rb") as f:
+        encoder = delta.DeltaEncoder(block_size, table, on_literal, on_copy)
+        encoder.encode(integrity.HashingFile(f, digest))
+
+
+def offer_batch(writer, reader, entries, hashes):
+    """
+    Ofrece los resúmenes de los archivos del lote (los de más de
+    DEDUP_MIN_SIZE) y devuelve (pendientes, ya_en_destino): las entradas que
+    hay que enviar y las que el receptor ya ha resuelto con lo que tenía.
+    `hashes` es la caché de resúmenes del emisor (dedup.HashCache).
+    """
+    offers = []
+    for index, (path, name) in enumerate(entries):
+        try:
+            size = os.path.getsize(path)
+            if size < dedup.DEDUP_MIN_SIZE:
+                continue
+            digest = hashes.digest(path)
+        except OSError:
+            continue  # Se informará del error al intentar enviarlo
+        offers.append({"i": index, "name": name, "size": size,
+                       integrity.DIGEST_NAME: digest})
+    hashes.save()
+    if not offers:
+        return entries, []
+    with tracing.span("send.offer", files=len(offers)) as span:
+        writer.write_json(FRAME_OFFER, {"files": offers})
+        writer.flush()
+        have = {item["i"] for item in reader.expect(FRAME_HAVE).get("have", [])}
+        span.set(have=len(have))
+    pending = [entry for index, entry in enumerate(entries) if index not in have]
+    present = [entry for index, entry in enumerate(entries) if index in have]
+    return pending, present
+
+
+def _answer_offer(writer, offer, dest_dir, on_file):
+    """Resuelve con el índice de contenido los archivos ofrecidos y contesta HAVE"""
+    index = dedup.ContentIndex.for_dir(dest_dir)
+    have = []
+    for item in offer.get("files", []):
+        size = item.get("size")
+        digest = item.get(integrity.DIGEST_NAME)
+        if not isinstance(size, int) or not digest:
+            continue
+        source = index.lookup(digest, size)
+        if source is None:
+            continue
+        name = safe_name(item.get("name", ""))
+        target = os.path.join(dest_dir, name)
+        try:
+            if os.path.abspath(source) != os.path.abspath(target):
+                # Mismo contenido con otro nombre: enlace o copia local
+                target = unique_path(dest_dir, name)
+                dedup.materialize(source, target)
+                index.add(target, digest, size)
+        except OSError:
+            continue  # Que lo envíe
+        have.append({"i": item.get("i"), "path": os.path.relpath(target, dest_dir)})
+        if on_file:
+            on_file(target, {"name": item.get("name"), "size": size, "meta": {},
+                             "dedup": True})
+    writer.write_json(FRAME_HAVE, {"have": have})
+    writer.flush()
+
+
+def end_session(writer):
+    """Avisa al receptor de que no habrá más archivos"""
+    writer.write_frame(FRAME_BYE)
+    writer.flush()
+
+
+def keepalive(writer):
+    """Trama vacía para que el enlace inactivo no se cierre y detectar si ha caído"""
+    writer.write_frame(FRAME_PING)
+    writer.flush()
+
+
+# =============================================================================
+# RECEPCIÓN
+# =============================================================================
+def safe_name(name):
+    """
+    Reduce el nombre recibido a una ruta relativa segura: se conservan las
+    subcarpetas de un envío de directorio pero nunca se sale de dest_dir
+    """
+    parts = [part.strip() for part in str(name).replace("\\", "/").split("/")]
+    parts = [part for part in parts if part not in ("", ".", "..")]
+    if not parts:
+        return "recibido.bin"
+    if parts[0] == PARTIAL_DIR:
+        parts[0] = "_" + parts[0]
+    return os.path.join(*parts)
+
+
+def unique_path(dest_dir, name):
+    """Devuelve una ruta libre en dest_dir añadiendo ' (n)' si hace falta"""
+    base, ext = os.path.splitext(name)
+    path = os.path.join(dest_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    counter = 1
+    while os.path.exists(path) or os.path.exists(path + PARTIAL_SUFFIX):
+        path = os.path.join(dest_dir, f"{base} ({counter}){ext}")
+        counter += 1
+    return path
+
+
+def _delta_basis(dest_dir, header):
+    """
+    Ruta de la versión anterior que la cabecera nombra por su resumen, si
+    sigue en dest_dir sin cambios (índice de contenido); si no, None. Un
+    archivo con el mismo nombre pero otro contenido nunca sirve de base.
+    """
+    basis = header.get("basis")
+    if not isinstance(basis, dict):
+        return None
+    digest, size = basis.get(integrity.DIGEST_NAME), basis.get("size")
+    if not digest or not isinstance(size, int):
+        return None
+    return dedup.ContentIndex.for_dir(dest_dir).lookup(digest, size)
+
+
+def _receive_payload(reader, writer, pipeline, header, dest_dir, on_file, on_progress=None):
+    """Recibe las tramas DATA de un archivo hasta su END y lo entrega al escritor"""
+    journal = None
+    basis = None
+    offset = 0
+    if header.get("resume") and header.get("id"):
+        # Reanudable: se continúa desde lo confirmado en el diario
+        journal = TransferJournal.open(dest_dir, header)
+        offset = journal.offset
+        basis_path = _delta_basis(dest_dir, header) if offset == 0 else None
+        if basis_path:
+            # Está la versión anterior que nombra el emisor: se reconstruye a partir de ella
+            journal.discard()
+            journal = None
+            name = safe_name(header.get("name", ""))
+            if os.path.abspath(basis_path) == os.path.abspath(os.path.join(dest_dir, name)):
+                # Es el mismo archivo: la nueva versión lo sustituye
+                final_path = basis_path
+            else:
+                # La base tiene otro nombre: nunca se sobrescribe lo que no se ha nombrado
+                final_path = unique_path(dest_dir, name)
+            partial_path = final_path + PARTIAL_SUFFIX
+            wait_unmapped(partial_path)
+            open(partial_path, "wb").close()
+            block_size = delta.block_size_for(os.path.getsize(basis_path))
+            writer.write_json(FRAME_ACCEPT, {"offset": 0, "mode": "delta"})
+            writer.write_frame(FRAME_SIGNATURES,
+                               delta.compute_signatures(basis_path, block_size))
+            basis = open(basis_path, "rb")
+        else:
+            partial_path = journal.partial_path
+            writer.write_json(FRAME_ACCEPT, {"offset": offset})
+        writer.flush()
+    else:
+        final_path = unique_path(dest_dir, safe_name(header.get("name", "")))
+        partial_path = final_path + PARTIAL_SUFFIX
+        # Se reserva el nombre ya, aunque el escritor abra el archivo más tarde
+        open(partial_path, "wb").close()
+    # El resumen se calcula en el hilo escritor; el diario ya lleva el suyo
+    hasher = journal.hasher if journal else integrity.new_hasher()
+    pipeline.open(partial_path, offset, journal, None if journal else hasher,
+                  header.get("size"))
+    try:
+        progress = (lambda received: on_progress(received, header)) if on_progress else None
+        received, trailer = _receive_frames(reader, pipeline, offset, basis, progress)
+    finally:
+        if basis:
+            basis.close()
+
+    expected = header.get("size")
+    if expected is not None and received != expected:
+        raise ProtocolError(f"Tamaño recibido {received} distinto de {expected}")
+    expected_digest = trailer.get(integrity.DIGEST_NAME)
+
+    def discard():
+        if journal:
+            journal.discard()
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+
+    if expected_digest and header.get("verify"):
+        # El emisor espera el veredicto: se aguarda a que el escritor termine
+        pipeline.finish()
+        pipeline.sync()
+        _verify_and_repair(reader, writer, partial_path, hasher.hexdigest(),
+                           trailer, discard)
+        expected_digest = None
+
+    def complete():
+        if expected_digest and hasher.hexdigest() != expected_digest:
+            discard()
+            raise integrity.IntegrityError(
+                f"Resumen de {header.get('name')} distinto del enviado")
+        if journal:
+            path = unique_path(dest_dir, safe_name(header.get("name", "")))
+            os.replace(partial_path, path)
+            journal.complete()
+        else:
+            path = final_path
+            os.replace(partial_path, path)
+        pipeline.durability.renamed(path)
+        # Tras una reparación el resumen del hilo escritor es el de lo llegado
+        # dañado; el del emisor ya está comprobado contra el archivo final
+        final_digest = trailer.get(integrity.DIGEST_NAME) or hasher.hexdigest()
+        dedup.ContentIndex.for_dir(dest_dir).add(path, final_digest, received)
+        if on_file:
+            on_file(path, header)
+
+    pipeline.finish(complete)
+
+
+def _verify_and_repair(reader, writer, partial_path, actual, trailer, discard):
+    """Contesta VERIFY; si el resumen no cuadra, pide los bloques con CRC distinto"""
+    expected = trailer[integrity.DIGEST_NAME]
+    rounds = 0
+    while actual != expected:
+        bad = []
+        if rounds < integrity.MAX_REPAIR_ROUNDS and "blocks" in trailer:
+            bad = integrity.damaged_blocks(partial_path, trailer)
+        writer.write_json(FRAME_VERIFY, {"ok": False, "blocks": bad})
+        writer.flush()
+        if not bad:
+            discard()
+            raise integrity.IntegrityError(f"No se pudo reparar {partial_path}")
+        trailer = _receive_repair(reader, partial_path, trailer)
+        actual = integrity.file_digest(partial_path)
+        rounds += 1
+    writer.write_json(FRAME_VERIFY, {"ok": True})
+    writer.flush()
+
+
+def _receive_repair(reader, partial_path, trailer):
+    """Escribe en su sitio los bloques reenviados hasta el nuevo END"""
+    size = os.path.getsize(partial_path)
+    with open(partial_path, "r+b") as f:
+        while True:
+            frame = reader.read_frame()
+            if frame is None:
+                raise ProtocolError("Conexión cerrada durante la reparación")
+            frame_type, payload = frame
+            if frame_type == FRAME_REPAIR:
+                offset = decode_json(payload).get("offset", -1)
+                if not 0 <= offset < size:
+                    raise ProtocolError(f"Desplazamiento de reparación inválido: {offset}")
+                f.seek(offset)
+            elif frame_type == FRAME_DATA:
+                if f.tell() + len(payload) > size:
+                    raise ProtocolError("Reparación más allá del final del archivo")
+                f.write(payload)
+            elif frame_type == FRAME_END:
+                return decode_json(payload)
+            else:
+                raise ProtocolError(f"Trama inesperada en reparación: {frame_type}")
+
+
+def _copy_blocks(pipeline, basis, block_size, payload):
+    """Copia al destino bloques de la versión anterior según una trama COPY"""
+    first_block, count = delta.unpack_copy(payload)
+    basis.seek(first_block * block_size)
+    remaining = count * block_size
+    copied = 0
+    while remaining:
+        data = basis.read(min(remaining, pipeline.pool.buffer_size))
+        if not data:
+            raise ProtocolError("Referencia a bloques fuera de la versión anterior")
+        pipeline.write_bytes(data)
+        remaining -= len(data)
+        copied += len(data)
+    return copied
+
+
+def _receive_frames(reader, pipeline, offset, basis=None, on_progress=None):
+    """Procesa las tramas de un archivo hasta END; devuelve (tamaño, datos de END)"""
+    received = offset
+    decompressor = None
+    block_size = delta.block_size_for(os.fstat(basis.fileno()).st_size) if basis else 0
+    while True:
+        frame_header = reader.read_header()
+        if frame_header is None:
+            raise ProtocolError("Conexión cerrada a mitad de archivo")
+        frame_type, length = frame_header
+        if frame_type == FRAME_DATA and decompressor:
+            for out in decompressor.decompress(reader.read_exact(length)):
+                pipeline.write_bytes(out)
+                received += len(out)
+        elif frame_type == FRAME_DATA:
+            pipeline.write_from(reader, length)
+            received += length
+        elif frame_type == FRAME_COPY and basis:
+            received += _copy_blocks(pipeline, basis, block_size, reader.read_exact(length))
+        elif frame_type == FRAME_CODEC:
+            codec_name = decode_json(reader.read_exact(length)).get("codec")
+            try:
+                decompressor = compression.get_codec(codec_name).decompressor()
+            except ValueError as e:
+                raise ProtocolError(str(e))
+        elif frame_type == FRAME_END:
+            trailer = decode_json(reader.read_exact(length))
+            if decompressor:
+                tail = decompressor.flush()
+                if tail:
+                    pipeline.write_bytes(tail)
+                    received += len(tail)
+            break
+        else:
+            raise ProtocolError(f"Trama inesperada dentro de archivo: {frame_type}")
+        if on_progress:
+            on_progress(received)
+    return received, trailer
+
+
+def receive_session(reader, writer, dest_dir, on_file=None, pipeline=None,
+                    on_progress=None, durability=None):
+    """
+    Recibe archivos uno tras otro hasta BYE o cierre; devuelve cuántos llegaron.
+    on_file(ruta, cabecera) se llama desde el hilo escritor cuando el archivo
+    ya está en disco con su nombre definitivo; on_progress(recibidos, cabecera)
+    desde el hilo de la sesión tras cada trama. `durability` (storage.Durability)
+    decide cuándo se hace fsync; por defecto, en grupo.
+    """
+    pipeline = pipeline or ReceivePipeline(durability=durability)
+    count = 0
+    try:
+        while True:
+            frame = reader.read_frame()
+            if frame is None:
+                break
+            frame_type, payload = frame
+            if frame_type == FRAME_BYE:
+                break
+            if frame_type == FRAME_PING:
+                continue
+            if frame_type == FRAME_OFFER:
+                # Lo encolado antes debe estar en disco (y en el índice) para contar
+                pipeline.sync()
+                _answer_offer(writer, decode_json(payload), dest_dir, on_file)
+                continue
+            if frame_type != FRAME_FILE:
+                raise ProtocolError(f"Se esperaba cabecera de archivo, llegó {frame_type}")
+
+            header = decode_json(payload)
+            with tracing.span("recv.file", file=header.get("name"), size=header.get("size")):
+                _receive_payload(reader, writer, pipeline, header, dest_dir, on_file,
+                                 on_progress)
+            count += 1
+    except BaseException:
+        pipeline.abort()
+        raise
+    finally:
+        try:
+            pipeline.close()
+        finally:
+            dedup.ContentIndex.for_dir(dest_dir).save()
+    return count
@@ -0,0 +1,342 @@
+"""
+TRANSPORTES
+Interfaz común de los sockets que usa el motor de transferencia, con
+implementaciones sin Kivy: BluetoothSocket de Android (pyjnius), RFCOMM nativo
+de Linux y un sustituto local (socketpair / TCP) con la misma semántica que
+BluetoothSocket, para poder medir y probar sin dos teléfonos Android.
+
+Un transporte conectado ofrece:
+    getInputStream()  -> flujo con read(buffer, offset, length): bytes leídos o -1
+    getOutputStream() -> flujo con write(data) y flush()
+    getRemoteDevice() -> objeto con getAddress()
+    close()
+Un transporte servidor ofrece accept() -> transporte conectado, y close().
+"""
+import functools
+import heapq
+import itertools
+import os
+import socket
+import threading
+import time
+
+# =============================================================================
+# CONSTANTES
+# =============================================================================
+UUID_SPP = "00001101-0000-1000-8000-00805F9B34FB"  # Estándar para RFCOMM
+SERVICE_NAME = "AppBluetoothServer"
+LOOPBACK_ADDRESS = "127.0.0.1"
+DEFAULT_RFCOMM_CHANNEL = 1
+
+
+class _RemoteDevice:
+    def __init__(self, address):
+        self._address = address
+
+    def getAddress(self):
+        return self._address
+
+    def getName(self):
+        return f"loopback-{self._address}"
+
+
+# =============================================================================
+# FLUJOS ESTILO JAVA SOBRE SOCKETS DE PYTHON
+# =============================================================================
+class SocketInputStream:
+    """InputStream: read() devuelve -1 al final del flujo, como en Java"""
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def read(self, buffer, offset=0, length=None):
+        if length is None:
+            length = len(buffer) - offset
+        if length == 0:
+            return 0
+        try:
+            with memoryview(buffer) as view:
+                n = self._sock.recv_into(view[offset:offset + length])
+        except OSError:
+            return -1
+        return n if n else -1
+
+
+class SocketOutputStream:
+    """OutputStream: write() bloquea hasta entregar todos los bytes al socket"""
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def write(self, data):
+        self._sock.sendall(data)
+
+    def flush(self):
+        pass
+
+
+class ShapedOutputStream:
+    """
+    OutputStream que limita el ancho de banda y añade latencia de entrega.
+    Un hilo bombea los datos al socket cuando "llegarían" por el enlace, así
+    que la latencia no frena las escrituras encadenadas, solo los intercambios.
+    """
+
+    def __init__(self, sock, bandwidth=None, latency=0.0):
+        self._sock = sock
+        self.bandwidth = bandwidth  # Bytes por segundo (None = sin límite)
+        self.latency = latency  # Segundos en un sentido
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._link_free_at = time.monotonic()
+        self._closed = False
+        self._error = None
+        self._pending = 0
+        self._thread = threading.Thread(target=self._pump, daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        data = bytes(data)
+        with self._cond:
+            if self._error:
+                raise self._error
+            now = time.monotonic()
+            start = max(now, self._link_free_at)
+            duration = len(data) / self.bandwidth if self.bandwidth else 0.0
+            self._link_free_at = start + duration
+            heapq.heappush(self._queue, (start + duration + self.latency, next(self._seq), data))
+            self._pending += len(data)
+            self._cond.notify()
+            # Control de flujo: el emisor no se adelanta más de un segundo al enlace
+            while self.bandwidth and self._pending > self.bandwidth and not self._error:
+                self._cond.wait(0.05)
+
+    def flush(self):
+        pass
+
+    def _pump(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                deliver_at, _, data = self._queue[0]
+                delay = deliver_at - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._queue)
+            try:
+                self._sock.sendall(data)
+            except OSError as e:
+                with self._cond:
+                    self._error = e
+                    self._queue.clear()
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._pending -= len(data)
+                self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+# =============================================================================
+# TRANSPORTE SOBRE SOCKETS DE PYTHON (local, TCP o RFCOMM de Linux)
+# =============================================================================
+class SocketTransport:
+    """Equivalente a BluetoothSocket sobre un socket de Python"""
+
+    def __init__(self, sock, address="00:00:00:00:00:00", bandwidth=None, latency=0.0):
+        self._sock = sock
+        self._device = _RemoteDevice(address)
+        self._input = SocketInputStream(sock)
+        if bandwidth or latency:
+            self._output = ShapedOutputStream(sock, bandwidth, latency)
+        else:
+            self._output = SocketOutputStream(sock)
+        self._closed = False
+
+    def getInputStream(self):
+        return self._input
+
+    def getOutputStream(self):
+        return self._output
+
+    def getRemoteDevice(self):
+        return self._device
+
+    def isConnected(self):
+        return not self._closed
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if isinstance(self._output, ShapedOutputStream):
+            self._output.close()
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+def loopback_pair(bandwidth=None, latency=0.0):
+    """Dos extremos conectados entre sí, con conformado opcional en ambos sentidos"""
+    a, b = socket.socketpair()
+    return (SocketTransport(a, "02:00:00:00:00:01", bandwidth, latency),
+            SocketTransport(b, "02:00:00:00:00:02", bandwidth, latency))
+
+
+class LoopbackServerSocket:
+    """Sustituto de BluetoothServerSocket: accept() bloquea hasta que alguien conecta"""
+
+    def __init__(self, bandwidth=None, latency=0.0, backlog=64,
+                 host=LOOPBACK_ADDRESS, port=0):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen(backlog)
+        self.port = self._sock.getsockname()[1]
+        self._ids = itertools.count(1)
+
+    def accept(self):
+        sock, _ = self._sock.accept()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        address = "02:00:00:00:%02X:%02X" % divmod(next(self._ids) % 65536, 256)
+        return SocketTransport(sock, address, self.bandwidth, self.latency)
+
+    def connect(self):
+        """Crea un cliente conectado a este servidor"""
+        sock = socket.create_connection((LOOPBACK_ADDRESS, self.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return SocketTransport(sock, "02:00:00:00:00:00", self.bandwidth, self.latency)
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+def tcp_connect(host, port):
+    """Cliente TCP con semántica de BluetoothSocket (pruebas entre máquinas)"""
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return SocketTransport(sock, host)
+
+
+# =============================================================================
+# RFCOMM NATIVO (Linux, BlueZ)
+# =============================================================================
+def rfcomm_available():
+    return hasattr(socket, "AF_BLUETOOTH") and hasattr(socket, "BTPROTO_RFCOMM")
+
+
+class RfcommServerSocket:
+    """
+    Servidor RFCOMM con el socket nativo de Linux. No registra el servicio SDP:
+    para que un Android lo encuentre por UUID hay que anunciarlo aparte
+    (por ejemplo `sdptool add --channel=N SP`).
+    """
+
+    def __init__(self, channel=DEFAULT_RFCOMM_CHANNEL, backlog=8):
+        self.channel = channel
+        self._sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM,
+                                   socket.BTPROTO_RFCOMM)
+        self._sock.bind((socket.BDADDR_ANY, channel))
+        self._sock.listen(backlog)
+
+    def accept(self):
+        sock, (address, _) = self._sock.accept()
+        return SocketTransport(sock, address)
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+def rfcomm_connect(address, channel=DEFAULT_RFCOMM_CHANNEL):
+    sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+    sock.connect((address, channel))
+    return SocketTransport(sock, address)
+
+
+# =============================================================================
+# ANDROID (pyjnius, sin Kivy)
+# =============================================================================
+def on_android():
+    """python-for-android define ANDROID_ARGUMENT en el entorno"""
+    return "ANDROID_ARGUMENT" in os.environ
+
+
+@functools.lru_cache(maxsize=None)
+def java_class(name):
+    """autoclass() con caché: cada búsqueda por reflexión se hace una sola vez"""
+    from jnius import autoclass
+    return autoclass(name)
+
+
+@functools.lru_cache(maxsize=1)
+def spp_uuid():
+    return java_class("java.util.UUID").fromString(UUID_SPP)
+
+
+@functools.lru_cache(maxsize=1)
+def android_adapter():
+    return java_class("android.bluetooth.BluetoothAdapter").getDefaultAdapter()
+
+
+def android_listen(adapter=None):
+    """BluetoothServerSocket registrado con el UUID SPP"""
+    adapter = adapter or android_adapter()
+    return adapter.listenUsingRfcommWithServiceRecord(SERVICE_NAME, spp_uuid())
+
+
+def android_connect(address, adapter=None, channel=None):
+    """
+    BluetoothSocket conectado al dispositivo con esa MAC. Sin `channel` se
+    busca el servicio por UUID (consulta SDP dentro de connect()); con un
+    canal ya conocido se conecta directamente y se ahorra esa consulta.
+    """
+    adapter = adapter or android_adapter()
+    adapter.cancelDiscovery()
+    device = adapter.getRemoteDevice(address)
+    if channel:
+        sock = _rfcomm_socket_on_channel(device, channel)
+    else:
+        sock = device.createRfcommSocketToServiceRecord(spp_uuid())
+    sock.connect()
+    return sock
+
+
+def _rfcomm_socket_on_channel(device, channel):
+    # createRfcommSocket(int) no es API pública: se invoca por reflexión
+    from jnius import cast
+    integer = java_class("java.lang.Integer")
+    method = device.getClass().getMethod("createRfcommSocket", [integer.TYPE])
+    return cast("android.bluetooth.BluetoothSocket",
+                method.invoke(device, [integer.valueOf(channel)]))
+
+
+def android_channel(sock):
+    """Canal RFCOMM de un BluetoothSocket conectado, o None si no se puede leer"""
+    try:
+        field = sock.getClass().getDeclaredField("mPort")
+        field.setAccessible(True)
+        channel = field.getInt(sock)
+    except Exception:
+        return None
+    return channel if channel > 0 else None